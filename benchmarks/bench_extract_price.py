@@ -0,0 +1,212 @@
+# bench_extract_price.py
+
+"""
+Микробенчмарк извлечения цены из сохранённых страниц товара (без браузера).
+
+Каждая стратегия price_extraction.STRATEGIES запускается по каждой странице
+отдельно: доля страниц с найденной ценой, точность по эталону (expected.json
+рядом со страницами) и время (лучшее из --repeat, p50/p95 по страницам).
+Отдельно - каскад extract_price_from_html (какая стратегия сработала первой)
+и проверка блокировки is_blocked_html. Для поиска по регулярным выражениям
+выводятся и прежние варианты по всей странице: patterns_seq (шаблоны по очереди)
+и findall_old (re.findall по строкам шаблонов, как было в Parser.extract_price);
+они находят "Доставка от 99 ₽" в шапке фикстур раньше цены товара, patterns
+ищет только в области товара (price_region).
+--min-accuracy проверяет точность patterns и каскада по эталону: при меньшей
+точности скрипт завершается с кодом 1 (проверка после изменения шаблонов).
+--pad-kb дописывает в начало и конец страниц разметку без цен, чтобы
+приблизить размер к реальному page_source (несколько МБ).
+
+Страницы: benchmarks/fixtures/html и debug/ (куда save_page_source пишет
+страницы при ошибках парсинга; для них эталона нет, точность не считается).
+
+Запуск из корня проекта:
+    python benchmarks/bench_extract_price.py
+    python benchmarks/bench_extract_price.py --dir debug --repeat 20 --verbose
+    python benchmarks/bench_extract_price.py --pad-kb 2048
+    python benchmarks/bench_extract_price.py --dir benchmarks/fixtures/html --min-accuracy 1
+"""
+
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from price_extraction import (  # noqa: E402
+    PRICE_PATTERNS, STRATEGIES, extract_by_patterns_sequential, extract_price_from_html, is_blocked_html,
+    normalize_price,
+)
+
+FIXTURES_DIR = os.path.join(ROOT, "benchmarks", "fixtures", "html")
+DEBUG_DIR = os.path.join(ROOT, "debug")
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def findall_old(html):
+    """Как было в Parser.extract_price: re.findall по каждому шаблону на всей странице"""
+    for pattern in PRICE_PATTERNS:
+        matches = re.findall(pattern, html)
+        if matches:
+            return matches[0] + " ₽"
+    return None
+
+
+# Стратегии, точность которых проверяет --min-accuracy
+CHECKED = ("patterns", "cascade")
+
+COMPARE = [
+    ("patterns_seq", extract_by_patterns_sequential),
+    ("findall_old", findall_old),
+]
+
+
+def pad_page(html, kb):
+    """Разметка без цен (скрипты состояния, как на реальных страницах) до и после содержимого"""
+    if kb <= 0:
+        return html
+    chunk = '{"sku":123456789,"rating":4.87,"reviews":1024,"slug":"product-name-1234567"},'
+    filler = "<script>window.__STATE__=[" + chunk * (kb * 1024 // len(chunk) // 2) + "];</script>"
+    position = html.find("<body>")
+    position = position + len("<body>") if position != -1 else 0
+    return html[:position] + filler + html[position:] + filler
+
+
+def load_pages(dirs, pad_kb=0):
+    """Страницы и эталонные цены: [(путь, html, эталон или None)]"""
+    pages = []
+    for folder in dirs:
+        if not os.path.isdir(folder):
+            continue
+        expected = {}
+        manifest = os.path.join(folder, "expected.json")
+        if os.path.exists(manifest):
+            with open(manifest, encoding="utf-8") as f:
+                expected = json.load(f)
+        for path in sorted(glob.glob(os.path.join(folder, "*.html"))):
+            with open(path, encoding="utf-8", errors="replace") as f:
+                html = f.read()
+            pages.append((path, pad_page(html, pad_kb), expected.get(os.path.basename(path))))
+    return pages
+
+
+def timed(func, html, repeat):
+    """Результат и лучшее время вызова из repeat запусков, сек."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(html)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def bench(pages, repeat, verbose=False):
+    funcs = STRATEGIES + COMPARE + [("cascade", lambda html: extract_price_from_html(html)[0])]
+    results = {}
+    winners = {}
+    for name, func in funcs:
+        stat = {"pages": 0, "hits": 0, "labeled": 0, "correct": 0, "latencies": []}
+        for path, html, expected in pages:
+            raw, elapsed = timed(func, html, repeat)
+            price = normalize_price(raw)
+            stat["pages"] += 1
+            stat["latencies"].append(elapsed)
+            if price:
+                stat["hits"] += 1
+            if expected is not None:
+                stat["labeled"] += 1
+                if price == expected.get("price"):
+                    stat["correct"] += 1
+            if verbose:
+                mark = ""
+                if expected is not None:
+                    mark = "ok" if price == expected.get("price") else f"ожидалось {expected.get('price')}"
+                print(f"  {name:<12} {os.path.basename(path):<28} {str(price):>8}  {elapsed * 1000:8.3f} мс  {mark}")
+        results[name] = stat
+
+    for path, html, expected in pages:
+        _, strategy = extract_price_from_html(html)
+        winners[strategy or "-"] = winners.get(strategy or "-", 0) + 1
+
+    blocked = {"labeled": 0, "correct": 0, "latencies": []}
+    for path, html, expected in pages:
+        result, elapsed = timed(is_blocked_html, html, repeat)
+        blocked["latencies"].append(elapsed)
+        if expected is not None:
+            blocked["labeled"] += 1
+            blocked["correct"] += int(result == bool(expected.get("blocked")))
+    return results, winners, blocked
+
+
+def summarize(stat):
+    latencies = stat["latencies"]
+    return {
+        "pages": stat.get("pages", len(latencies)),
+        "hit_rate": round(stat["hits"] / stat["pages"], 3) if stat.get("pages") else None,
+        "accuracy": round(stat["correct"] / stat["labeled"], 3) if stat["labeled"] else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 3),
+        "total_ms": round(sum(latencies) * 1000, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк извлечения цены из сохранённых страниц")
+    parser.add_argument("--dir", action="append", dest="dirs",
+                        help="Папка со страницами (можно несколько; по умолчанию фикстуры и debug/)")
+    parser.add_argument("--repeat", type=int, default=5, help="Запусков на страницу, берётся лучшее время")
+    parser.add_argument("--pad-kb", type=int, default=0, help="Добавить к каждой странице N КБ разметки без цен")
+    parser.add_argument("--verbose", action="store_true", help="Результат по каждой странице")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON")
+    parser.add_argument("--min-accuracy", type=float,
+                        help=f"Минимальная точность {', '.join(CHECKED)} по эталону (0..1), иначе код выхода 1")
+    args = parser.parse_args()
+
+    pages = load_pages(args.dirs or [FIXTURES_DIR, DEBUG_DIR], args.pad_kb)
+    if not pages:
+        print("Страницы не найдены")
+        sys.exit(1)
+    labeled = sum(1 for page in pages if page[2] is not None)
+    print(f"Страниц: {len(pages)} (с эталоном {labeled}), повторов {args.repeat}")
+
+    results, winners, blocked = bench(pages, args.repeat, args.verbose)
+    summary = {name: summarize(stat) for name, stat in results.items()}
+    summary["is_blocked"] = summarize(blocked)
+
+    print(f"{'стратегия':<13} {'найдено':>8} {'точность':>9} {'p50, мс':>9} {'p95, мс':>9} {'всего, мс':>10}")
+    for name, s in summary.items():
+        hit_rate = f"{s['hit_rate']:.0%}" if s["hit_rate"] is not None else "-"
+        accuracy = f"{s['accuracy']:.0%}" if s["accuracy"] is not None else "-"
+        print(f"{name:<13} {hit_rate:>8} {accuracy:>9} {s['p50_ms']:>9.3f} {s['p95_ms']:>9.3f} {s['total_ms']:>10.3f}")
+    print("Каскад, первая сработавшая стратегия: " + ", ".join(f"{k}: {v}" for k, v in sorted(winners.items())))
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "summary": summary, "winners": winners}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {args.json_path}")
+
+    if args.min_accuracy is not None:
+        failed = [
+            f"{name}: {summary[name]['accuracy']:.0%}" for name in CHECKED
+            if summary[name]["accuracy"] is not None and summary[name]["accuracy"] < args.min_accuracy
+        ]
+        if failed:
+            print(f"Точность ниже {args.min_accuracy:.0%}: {', '.join(failed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
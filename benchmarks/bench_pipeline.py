@@ -0,0 +1,263 @@
+# bench_pipeline.py
+
+"""
+Бенчмарк конвейера на локальной заглушке Seller API (mock_ozon_api.py).
+
+Этапы:
+    get_data  - get_data-api.py: отчёт, /v3/product/info/list, сохранение таблицы
+    search    - search_bad_price.py: поиск отклонений по result_price_* (цены по карте синтетические)
+    format    - format.ProductFinder: выборка товаров по списку ID
+    prices    - API-путь update_price.py: пакетная запись через PriceBatchWriter и одиночные обновления
+
+По каждому этапу выводятся время, число запросов и ответов 429, p50/p95 времени
+ответа сервера по эндпоинтам и пиковая память процесса (RSS, растёт монотонно -
+для точной цифры по одному этапу запускайте его отдельно через --stages).
+
+Запуск из корня проекта:
+    python benchmarks/bench_pipeline.py --products 5000 --latency 0.02 --rate-429 0.02
+    python benchmarks/bench_pipeline.py --stages get_data --async-api --json out/bench.json
+"""
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from mock_ozon_api import MockOzonAPI  # noqa: E402
+
+STAGES = ("get_data", "search", "format", "prices")
+PRODUCTS_FILE = "in/products_update_full_vdeeep.xlsx"
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def stats_delta(before, after):
+    """Запросы за этап по эндпоинтам: разница снимков счётчиков заглушки"""
+    delta = {}
+    for endpoint, stat in after.items():
+        prev = before.get(endpoint, {"requests": 0, "429": 0, "latencies": []})
+        requests = stat["requests"] - prev["requests"]
+        if not requests:
+            continue
+        latencies = stat["latencies"][len(prev["latencies"]):]
+        delta[endpoint] = {
+            "requests": requests,
+            "429": stat["429"] - prev["429"],
+            "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+            "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        }
+    return delta
+
+
+def load_get_data():
+    # Имя файла с дефисом, поэтому модуль загружается по пути
+    spec = importlib.util.spec_from_file_location("get_data_api", os.path.join(ROOT, "get_data-api.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write_opt_prices(api, path="in/opt_all.xlsx"):
+    """Цены 1С для каталога заглушки"""
+    import pandas as pd
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame(
+        [{"Артикул": item["offer_id"], "Цена": item["price_1c"]} for item in api.catalogue]
+    ).to_excel(path, index=False)
+
+
+def stage_get_data(api, args):
+    get_data = load_get_data()
+    sys.argv = ["get_data-api.py"] + (["--async-api"] if args.async_api else [])
+    get_data.main()
+    return {"rows": len(api.catalogue)}
+
+
+def stage_search(api, args):
+    import search_bad_price
+    from table_store import read_table, write_table
+
+    # Цены по карте берутся из API-цен заглушки с разбросом вместо парсинга pars_link
+    rng = random.Random(1)
+    df = read_table(PRODUCTS_FILE)
+    card_prices = {item["offer_id"]: item["marketing_price"] for item in api.catalogue}
+    df["Цена по карте озон"] = [
+        f"{card_prices.get(offer, 0) * rng.uniform(0.97, 1.03):.0f} ₽" for offer in df["Артикул"]
+    ]
+    write_table(df, f"out/result_price_{time.strftime('%Y%m%d_%H%M%S')}.xlsx", excel=False)
+
+    started = time.perf_counter()
+    results = search_bad_price.process_excel_file(search_bad_price.find_latest_file())
+    search_bad_price.save_bad_prices(results)
+    return {"rows": len(df), "bad_prices": len(results), "search_sec": round(time.perf_counter() - started, 3)}
+
+
+def stage_format(api, args):
+    from format import ProductFinder
+
+    ids = [str(item["id"]) for item in api.catalogue[::10]]
+    os.makedirs("get", exist_ok=True)
+    with open("get/get_new.txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(ids))
+    finder = ProductFinder(PRODUCTS_FILE, "get/get_new.txt", "in/1_1_product.xlsx", save_excel=False)
+    finder.run()
+    return {"ids": len(ids)}
+
+
+def stage_prices(api, args):
+    import conf
+    import update_price
+    from ozon_client import TokenBucket
+
+    items = api.catalogue[:args.price_updates]
+    # Как в первом проходе update_price: пачки уходят по размеру и при close()
+    writer = update_price.PriceBatchWriter(max_delay=None,
+                                           rate_limiter=TokenBucket(conf.API_RATE_LIMIT, conf.API_RATE_BURST))
+    tickets = [
+        writer.submit(item["offer_id"], item["old_price"], item["price"] * 0.98, item["min_price"])
+        for item in items
+    ]
+    writer.close()
+    batched = sum(1 for ticket in tickets if ticket.wait(timeout=60))
+
+    single = 0
+    for item in items[:args.single_updates]:
+        if update_price.update_ozon_prices(item["offer_id"], item["old_price"], item["price"], item["min_price"]):
+            single += 1
+    return {"batched_updated": batched, "single_updated": single}
+
+
+STAGE_FUNCS = {
+    "get_data": stage_get_data,
+    "search": stage_search,
+    "format": stage_format,
+    "prices": stage_prices,
+}
+
+
+def run_stage(name, api, args):
+    from table_store import peak_memory_mb
+
+    before = api.snapshot()
+    started = time.perf_counter()
+    error = None
+    try:
+        extra = STAGE_FUNCS[name](api, args)
+    except Exception as e:
+        extra = {}
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - started
+    endpoints = stats_delta(before, api.snapshot())
+    peak = peak_memory_mb()
+    return {
+        "stage": name,
+        "wall_sec": round(elapsed, 3),
+        "requests": sum(s["requests"] for s in endpoints.values()),
+        "throttled_429": sum(s["429"] for s in endpoints.values()),
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "endpoints": endpoints,
+        "error": error,
+        **extra,
+    }
+
+
+def print_result(result):
+    status = f"ОШИБКА {result['error']}" if result["error"] else "ok"
+    print(
+        f"{result['stage']:<9} {result['wall_sec']:>8.2f} сек  запросов {result['requests']:>5}  "
+        f"429: {result['throttled_429']:>3}  пик RSS {result['peak_rss_mb']} МБ  {status}"
+    )
+    for endpoint, stat in sorted(result["endpoints"].items()):
+        print(
+            f"    {endpoint:<34} {stat['requests']:>5} запр.  429: {stat['429']:>3}  "
+            f"p50 {stat['p50_ms']:>7.1f} мс  p95 {stat['p95_ms']:>7.1f} мс"
+        )
+    extra = {k: v for k, v in result.items()
+             if k not in ("stage", "wall_sec", "requests", "throttled_429", "peak_rss_mb", "endpoints", "error")}
+    if extra:
+        print(f"    {extra}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк конвейера на локальной заглушке Seller API")
+    parser.add_argument("--products", type=int, default=2000, help="Размер каталога заглушки")
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка ответа заглушки, сек.")
+    parser.add_argument("--jitter", type=float, default=0.01, help="Случайная добавка к задержке, сек.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--report-delay", type=float, default=1.0, help="Время подготовки отчёта, сек.")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"Этапы через запятую: {', '.join(STAGES)}")
+    parser.add_argument("--async-api", action="store_true", help="get_data-api.py с --async-api")
+    parser.add_argument("--price-updates", type=int, default=1000, help="Товаров для пакетной записи цен")
+    parser.add_argument("--single-updates", type=int, default=20, help="Одиночных обновлений цен")
+    parser.add_argument("--workdir", help="Рабочая папка (по умолчанию временная, удаляется после запуска)")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGE_FUNCS]
+    if unknown:
+        parser.error(f"Неизвестные этапы: {', '.join(unknown)}")
+
+    api = MockOzonAPI(args.products, args.latency, args.jitter, args.rate_429, args.report_delay)
+    base_url = api.start()
+
+    # Настройки читаются conf.py при импорте, поэтому окружение задаётся до импорта модулей проекта
+    os.environ["OZON_BASE_URL"] = base_url
+    os.environ.setdefault("OZON_CLIENT_ID", "benchmark")
+    os.environ.setdefault("OZON_API_KEY", "benchmark")
+
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+    workdir = args.workdir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    os.makedirs("logs", exist_ok=True)
+    print(f"Заглушка API: {base_url}, товаров {args.products}, задержка {args.latency} сек., 429: {args.rate_429}")
+    print(f"Рабочая папка: {workdir}")
+
+    results = []
+    try:
+        # Этапам после get_data нужна таблица товаров; без него она строится отдельно
+        if "get_data" not in stages and any(s in stages for s in ("search", "format")):
+            write_opt_prices(api)
+            results_setup = run_stage("get_data", api, args)
+            print(f"(подготовка таблицы товаров: {results_setup['wall_sec']} сек.)")
+        elif "get_data" in stages:
+            write_opt_prices(api)
+
+        for name in stages:
+            result = run_stage(name, api, args)
+            results.append(result)
+            print_result(result)
+    finally:
+        os.chdir(cwd)
+        api.stop()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"Результаты сохранены в {json_path}")
+
+    if any(result["error"] for result in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
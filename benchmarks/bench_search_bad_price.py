@@ -0,0 +1,109 @@
+# bench_search_bad_price.py
+
+"""
+Сравнение векторной проверки цен (search_bad_price.process_rows) с прежним
+построчным циклом на iterrows (process_rows_legacy).
+
+Запуск из корня проекта:
+    python benchmarks/bench_search_bad_price.py --rows 50000
+    python benchmarks/bench_search_bad_price.py --file out/result_price_20250101_000000.xlsx
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from search_bad_price import process_rows, process_rows_legacy  # noqa: E402
+from table_store import read_table  # noqa: E402
+
+
+def format_price(rng, value):
+    """Цена в одном из форматов, которые встречаются в таблицах"""
+    kind = rng.random()
+    if kind < 0.05:
+        return None
+    if kind < 0.10:
+        return ""
+    if kind < 0.40:
+        return f"{value:.2f} ₽"
+    if kind < 0.60:
+        return f"{int(value):,}".replace(",", " ") + " ₽"
+    if kind < 0.70:
+        return str(value).replace(".", ",")
+    if kind < 0.72:
+        return "Н/Д"
+    return round(value, 2)
+
+
+def make_frame(rows, seed=42):
+    rng = random.Random(seed)
+    data = []
+    for i in range(rows):
+        price_1c = rng.uniform(50, 20000)
+        ozon_price = price_1c * 1.10 * rng.uniform(0.85, 1.15)
+        sku = rng.random()
+        data.append({
+            "Ozon Product ID": 100000000 + i,
+            "SKU": np.nan if sku < 0.02 else ("bad" if sku < 0.025 else 1000000000 + i),
+            "Артикул": f"A-{i}",
+            "Цена 1С": format_price(rng, price_1c),
+            "Цена по карте озон": format_price(rng, ozon_price),
+            "Базовая цена API": format_price(rng, ozon_price * 1.2),
+            "Старая цена API": format_price(rng, ozon_price * 1.4),
+            "Минимальная цена API": format_price(rng, ozon_price * 0.9),
+            "Название товара": f"Товар{i} модель {i % 97}",
+            "Ссылка на товар": f"https://www.ozon.ru/product/{1000000000 + i}/",
+        })
+    return pd.DataFrame(data)
+
+
+def measure(func, df, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        # Сообщения об ошибочных строках не должны влиять на замер
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            result = func(df)
+            best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк search_bad_price: iterrows против векторной версии")
+    parser.add_argument("--rows", type=int, default=20000, help="Размер синтетической таблицы")
+    parser.add_argument("--file", type=str, help="Реальная таблица result_price_*.xlsx/.parquet вместо синтетики")
+    parser.add_argument("--repeat", type=int, default=3, help="Количество повторов (берётся лучший)")
+    args = parser.parse_args()
+
+    df = read_table(args.file) if args.file else make_frame(args.rows)
+    print(f"Строк: {len(df)}")
+
+    legacy_time, legacy_result = measure(process_rows_legacy, df, args.repeat)
+    fast_time, fast_result = measure(process_rows, df, args.repeat)
+
+    identical = legacy_result == fast_result
+    print(f"iterrows:  {legacy_time:.3f} сек, найдено {len(legacy_result)}")
+    print(f"векторно:  {fast_time:.3f} сек, найдено {len(fast_result)}")
+    print(f"ускорение: x{legacy_time / fast_time:.1f}" if fast_time > 0 else "ускорение: -")
+    print(f"результаты совпадают: {'да' if identical else 'НЕТ'}")
+
+    if not identical:
+        for legacy_item, fast_item in zip(legacy_result, fast_result):
+            if legacy_item != fast_item:
+                print(f"первое расхождение:\n  {legacy_item}\n  {fast_item}")
+                break
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
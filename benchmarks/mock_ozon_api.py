@@ -0,0 +1,285 @@
+# mock_ozon_api.py
+
+"""
+Локальная замена Ozon Seller API для бенчмарков (aiohttp).
+
+Эндпоинты: создание и статус отчёта товаров, скачивание CSV отчёта,
+/v3/product/info/list, /v1/product/import/prices и акции (/v1/actions...).
+Настраиваются размер каталога, задержка ответа и доля ответов 429.
+Сервер считает запросы и время обработки по каждому эндпоинту.
+
+Отдельный запуск (скрипты проекта направляются на него через OZON_BASE_URL):
+    python benchmarks/mock_ozon_api.py --port 8080 --products 10000 --latency 0.05 --rate-429 0.02
+"""
+
+import argparse
+import asyncio
+import csv
+import io
+import random
+import threading
+import time
+from collections import defaultdict
+
+from aiohttp import web
+
+REPORT_COLUMNS = [
+    "Ozon Product ID", "SKU", "Артикул", "Название товара", "Статус товара",
+    "Доступно к продаже по схеме FBS, шт.", "Видимость на Ozon", "Причины скрытия", "Дата создания",
+]
+
+
+def make_catalogue(size, seed=42):
+    """Синтетический каталог; цены 1С (price_1c) нужны бенчмарку для opt_all.xlsx"""
+    rng = random.Random(seed)
+    catalogue = []
+    for i in range(size):
+        price_1c = round(rng.uniform(100, 20000), 2)
+        price = round(price_1c * 1.10 * rng.uniform(0.85, 1.15))
+        catalogue.append({
+            "id": 100000000 + i,
+            "sku": 1000000000 + i,
+            "offer_id": f"ART-{i:06d}",
+            "name": f"Товар {i} модель {i % 97}",
+            "price_1c": price_1c,
+            "price": price,
+            "old_price": round(price * 1.3),
+            "marketing_price": round(price * 0.95),
+            "min_price": round(price * 0.9),
+            "stock": rng.randint(0, 50),
+        })
+    return catalogue
+
+
+class MockOzonAPI:
+    def __init__(self, products=1000, latency=0.02, jitter=0.0, rate_429=0.0, report_delay=1.0, seed=42):
+        """
+        :param products: Размер каталога
+        :param latency: Задержка ответа, сек.
+        :param jitter: Случайная добавка к задержке (0..jitter), сек.
+        :param rate_429: Доля запросов, на которые отвечаем 429 с Retry-After
+        :param report_delay: Через сколько секунд после создания отчёт готов
+        """
+        self.catalogue = make_catalogue(products, seed)
+        self.by_id = {str(item["id"]): item for item in self.catalogue}
+        self.by_offer = {item["offer_id"]: item for item in self.catalogue}
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.report_delay = report_delay
+        self.rng = random.Random(seed)
+        self.reports = {}
+        self.price_updates = 0
+        self.base_url = None
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: {"requests": 0, "429": 0, "latencies": []})
+
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    # Статистика
+
+    def snapshot(self):
+        """Копия счётчиков (для разницы до/после этапа бенчмарка)"""
+        with self.lock:
+            return {
+                endpoint: {"requests": s["requests"], "429": s["429"], "latencies": list(s["latencies"])}
+                for endpoint, s in self.stats.items()
+            }
+
+    def _record(self, endpoint, elapsed, throttled):
+        with self.lock:
+            stat = self.stats[endpoint]
+            stat["requests"] += 1
+            stat["latencies"].append(elapsed)
+            if throttled:
+                stat["429"] += 1
+
+    @web.middleware
+    async def middleware(self, request, handler):
+        started = time.perf_counter()
+        endpoint = "/files" if request.path.startswith("/files/") else request.path
+        throttled = False
+        try:
+            delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if endpoint != "/files" and self.rate_429 and self.rng.random() < self.rate_429:
+                throttled = True
+                return web.json_response(
+                    {"code": 8, "message": "You have reached request rate limit per second"},
+                    status=429, headers={"Retry-After": "0.1"}
+                )
+            return await handler(request)
+        finally:
+            self._record(endpoint, time.perf_counter() - started, throttled)
+
+    # Отчёты
+
+    async def report_create(self, request):
+        code = f"report-{len(self.reports) + 1}"
+        self.reports[code] = time.monotonic()
+        return web.json_response({"result": {"code": code}})
+
+    async def report_info(self, request):
+        code = (await request.json()).get("code")
+        if code not in self.reports:
+            return web.json_response({"code": 5, "message": "report not found"}, status=404)
+        ready = time.monotonic() - self.reports[code] >= self.report_delay
+        result = {"code": code, "status": "success" if ready else "processing", "file": ""}
+        if ready:
+            result["file"] = f"{self.base_url}/files/{code}.csv"
+        return web.json_response({"result": result})
+
+    async def report_file(self, request):
+        response = web.StreamResponse(headers={"Content-Type": "text/csv; charset=utf-8"})
+        await response.prepare(request)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, delimiter=";", quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+        writer.writerow(REPORT_COLUMNS)
+        await response.write(("\ufeff" + buffer.getvalue()).encode("utf-8"))
+        for start in range(0, len(self.catalogue), 1000):
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, delimiter=";", quoting=csv.QUOTE_ALL, lineterminator="\r\n")
+            for item in self.catalogue[start:start + 1000]:
+                writer.writerow([
+                    item["id"], item["sku"], item["offer_id"], item["name"], "Продается",
+                    item["stock"], "Виден покупателям", "", "2024-01-01 00:00:00",
+                ])
+            await response.write(buffer.getvalue().encode("utf-8"))
+        await response.write_eof()
+        return response
+
+    # Товары и цены
+
+    def _info_item(self, item):
+        return {
+            "id": item["id"],
+            "sku": item["sku"],
+            "offer_id": item["offer_id"],
+            "name": item["name"],
+            "price": f"{item['price']:.2f}",
+            "old_price": f"{item['old_price']:.2f}",
+            "marketing_price": f"{item['marketing_price']:.2f}",
+            "min_price": f"{item['min_price']:.2f}",
+            "currency_code": "RUB",
+            "created_at": "2024-01-01T00:00:00Z",
+            "statuses": {"status": "price_sent", "status_name": "Продается", "status_tooltip": ""},
+            "visibility_details": {"has_price": True, "has_stock": item["stock"] > 0},
+            "stocks": {"stocks": [{"source": "fbs", "present": item["stock"], "reserved": 0}]},
+        }
+
+    async def info_list(self, request):
+        payload = await request.json()
+        ids = payload.get("product_id") or []
+        offers = payload.get("offer_id") or []
+        if len(ids) + len(offers) > 1000:
+            return web.json_response({"code": 3, "message": "too many items"}, status=400)
+        items = [self.by_id[str(pid)] for pid in ids if str(pid) in self.by_id]
+        items += [self.by_offer[offer] for offer in offers if offer in self.by_offer]
+        return web.json_response({"items": [self._info_item(item) for item in items]})
+
+    async def import_prices(self, request):
+        prices = (await request.json()).get("prices") or []
+        if len(prices) > 1000:
+            return web.json_response({"code": 3, "message": "too many prices"}, status=400)
+        result = []
+        for price in prices:
+            item = self.by_offer.get(price.get("offer_id"))
+            if item is None:
+                result.append({"offer_id": price.get("offer_id"), "product_id": 0, "updated": False,
+                               "errors": [{"code": "NOT_FOUND", "message": "product not found"}]})
+                continue
+            item["price"] = float(price.get("price") or item["price"])
+            item["old_price"] = float(price.get("old_price") or item["old_price"])
+            item["min_price"] = float(price.get("min_price") or item["min_price"])
+            result.append({"offer_id": item["offer_id"], "product_id": item["id"], "updated": True, "errors": []})
+        self.price_updates += len(result)
+        return web.json_response({"result": result})
+
+    # Акции
+
+    async def actions(self, request):
+        return web.json_response({"result": [
+            {"id": 1, "title": "Бенчмарк", "action_type": "DISCOUNT", "participating_products_count": 0},
+        ]})
+
+    async def action_products(self, request):
+        payload = await request.json()
+        limit = int(payload.get("limit") or 100)
+        offset = int(payload.get("offset") or 0)
+        products = [
+            {"id": item["id"], "price": item["price"], "action_price": item["marketing_price"]}
+            for item in self.catalogue[offset:offset + limit]
+        ]
+        return web.json_response({"result": {"products": products, "total": len(self.catalogue)}})
+
+    async def action_products_change(self, request):
+        payload = await request.json()
+        ids = payload.get("product_ids") or [p.get("product_id") for p in payload.get("products") or []]
+        return web.json_response({"result": {"product_ids": ids, "rejected": []}})
+
+    def make_app(self):
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_post("/v1/report/products/create", self.report_create)
+        app.router.add_post("/v1/report/info", self.report_info)
+        app.router.add_get("/files/{name}", self.report_file)
+        app.router.add_post("/v3/product/info/list", self.info_list)
+        app.router.add_post("/v1/product/import/prices", self.import_prices)
+        app.router.add_get("/v1/actions", self.actions)
+        app.router.add_post("/v1/actions/products", self.action_products)
+        app.router.add_post("/v1/actions/products/activate", self.action_products_change)
+        app.router.add_post("/v1/actions/products/deactivate", self.action_products_change)
+        return app
+
+    # Запуск в фоновом потоке
+
+    def start(self, host="127.0.0.1", port=0):
+        """Запускает сервер в отдельном потоке со своим event loop. Возвращает базовый URL"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.make_app(), access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, host, port)
+            self._loop.run_until_complete(site.start())
+            bound_host, bound_port = self._runner.addresses[0][:2]
+            self.base_url = f"http://{bound_host}:{bound_port}"
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, name="MockOzonAPI", daemon=True)
+        self._thread.start()
+        started.wait()
+        return self.base_url
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальная замена Ozon Seller API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--products", type=int, default=1000, help="Размер каталога")
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка ответа, сек.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Случайная добавка к задержке, сек.")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Доля ответов 429")
+    parser.add_argument("--report-delay", type=float, default=1.0, help="Время подготовки отчёта, сек.")
+    args = parser.parse_args()
+
+    api = MockOzonAPI(args.products, args.latency, args.jitter, args.rate_429, args.report_delay)
+    api.base_url = f"http://{args.host}:{args.port}"
+    print(f"Mock Ozon API: {api.base_url} ({args.products} товаров). Для скриптов: OZON_BASE_URL={api.base_url}")
+    web.run_app(api.make_app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# card_price_resolver.py
+
+"""
+Цена "С Ozon картой" сначала из Seller API, браузер - только там, где API не помогает.
+
+/v3/product/info/list отдаёт marketing_price (get_data-api.py сохраняет её как
+"Маркетинговая цена API"). Резолвер запрашивает её пачками по 1000 товаров на
+весь список и отдаёт на парсинг браузером только товары:
+    - без цены в ответе API;
+    - у которых последняя спарсенная цена по карте расходится с marketing_price
+      больше допуска (по хранилищу состояния state_store.py или по парсингу
+      в этом же запуске);
+    - у которых цена только что изменена (invalidate): API обновляет
+      marketing_price с задержкой, проверку после коррекции делает браузер.
+Ведётся статистика: сколько цен взято из API и сколько спарсено.
+"""
+
+import threading
+from typing import Dict, Iterable, Optional, Set
+
+from loguru import logger
+
+from state_store import to_float, to_text
+
+INFO_LIST_ENDPOINT = "/v3/product/info/list"
+CHUNK_SIZE = 1000
+
+
+def default_client():
+    """Общий клиент Seller API; None, если ключи API не заданы"""
+    try:
+        from ozon_client import get_client
+        return get_client()
+    except (ImportError, ValueError) as e:
+        logger.warning(f"Seller API недоступен, цены по карте будут только парситься: {e}")
+        return None
+
+
+class CardPriceResolver:
+    def __init__(self, client=None, store=None, tolerance_pct: float = 1.0, chunk_size: int = CHUNK_SIZE):
+        """
+        :param client: OzonClient (по умолчанию общий клиент процесса)
+        :param store: StateStore для поиска товаров, где API расходится с ценой по карте
+        :param tolerance_pct: Допустимое расхождение marketing_price и спарсенной цены, %
+        """
+        self.client = client if client is not None else default_client()
+        self.store = store
+        self.tolerance_pct = tolerance_pct
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.api_prices: Dict[str, float] = {}
+        self.offer_ids: Dict[str, str] = {}
+        self.divergent: Set[str] = set()
+        self.invalidated: Set[str] = set()
+        self.stats = {"api": 0, "scraped": 0, "scrape_failed": 0, "diverged": 0}
+
+    def prefetch(self, product_ids: Iterable) -> int:
+        """Загружает marketing_price пачками для всех Ozon Product ID. Возвращает число цен"""
+        ids = sorted({pid for pid in (to_text(value) for value in product_ids) if pid})
+        if self.client is None or not ids:
+            return 0
+
+        if self.store is not None:
+            try:
+                self.divergent.update(self.store.card_price_divergence(self.tolerance_pct))
+            except Exception as e:
+                logger.warning(f"Не удалось прочитать расхождения цен из хранилища: {e}")
+
+        loaded = 0
+        for start in range(0, len(ids), self.chunk_size):
+            chunk = ids[start:start + self.chunk_size]
+            data = self.client.post(INFO_LIST_ENDPOINT, {"product_id": chunk})
+            if not data:
+                logger.warning(f"Нет ответа API для {len(chunk)} товаров, они будут спарсены")
+                continue
+            with self.lock:
+                for item in data.get("items", []):
+                    ozon_id = to_text(item.get("id"))
+                    price = to_float(item.get("marketing_price"))
+                    if not ozon_id:
+                        continue
+                    if item.get("offer_id"):
+                        self.offer_ids[str(item["offer_id"])] = ozon_id
+                    if price and price > 0:
+                        self.api_prices[ozon_id] = price
+                        loaded += 1
+        logger.info(
+            f"Цены по карте из API: {loaded} из {len(ids)} товаров, "
+            f"расходятся с парсингом {len(self.divergent & set(ids))}"
+        )
+        return loaded
+
+    def _key(self, ozon_id=None, offer_id=None) -> Optional[str]:
+        key = to_text(ozon_id)
+        if key is None and offer_id is not None:
+            key = self.offer_ids.get(str(offer_id))
+        return key
+
+    def api_price(self, ozon_id=None, offer_id=None) -> Optional[float]:
+        """Цена из API или None, если товар нужно парсить браузером"""
+        key = self._key(ozon_id, offer_id)
+        with self.lock:
+            if key is None or key in self.divergent or key in self.invalidated:
+                return None
+            price = self.api_prices.get(key)
+            if price is not None:
+                self.stats["api"] += 1
+            return price
+
+    def record_scrape(self, price: Optional[float], ozon_id=None, offer_id=None):
+        """Учитывает спарсенную цену; расхождение с API отправляет товар на парсинг и дальше"""
+        key = self._key(ozon_id, offer_id)
+        with self.lock:
+            if not price:
+                self.stats["scrape_failed"] += 1
+                return
+            self.stats["scraped"] += 1
+            api_price = self.api_prices.get(key) if key else None
+            if api_price and abs(price - api_price) / price * 100 > self.tolerance_pct and key not in self.divergent:
+                self.divergent.add(key)
+                self.stats["diverged"] += 1
+                logger.info(f"Цена по карте {price} расходится с marketing_price API {api_price} ({key})")
+
+    def invalidate(self, ozon_id=None, offer_id=None):
+        """Цена товара изменена: до конца запуска проверять его браузером"""
+        key = self._key(ozon_id, offer_id)
+        if key is not None:
+            with self.lock:
+                self.invalidated.add(key)
+
+    def summary(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+        resolved = stats["api"] + stats["scraped"]
+        stats["api_share"] = round(stats["api"] / resolved, 3) if resolved else 0.0
+        return stats
+
+    def log_summary(self):
+        s = self.summary()
+        logger.info(
+            f"Цены по карте: из API {s['api']}, спарсено {s['scraped']} (не удалось {s['scrape_failed']}), "
+            f"доля API {s['api_share']:.0%}, новых расхождений с API {s['diverged']}"
+        )
@@ -9,7 +9,8 @@ from dotenv import load_dotenv
 # Конфигурация API
 CLIENT_ID = os.getenv("OZON_CLIENT_ID")
 API_KEY = os.getenv("OZON_API_KEY")
-BASE_URL = "https://api-seller.ozon.ru"
+# OZON_BASE_URL переопределяет адрес API (например, локальная заглушка из benchmarks/mock_ozon_api.py)
+BASE_URL = os.getenv("OZON_BASE_URL", "https://api-seller.ozon.ru")
 HEADERS = {
     "Client-Id": CLIENT_ID,
     "Api-Key": API_KEY,
@@ -22,6 +23,7 @@ if not CLIENT_ID or not API_KEY:
 
 # Настройки времени
 FILE_CHECK_INTERVAL = 1900
+WATCH_POLL_INTERVAL = 1       # опрос папки in, если inotify недоступен
 PRODUCT_DELAY_RANGE = (3, 5) 
 TIMEOUT = 5
 MAX_API_ATTEMPTS = 3
@@ -30,6 +32,48 @@ API_TIMEOUT = 10
 BACKOFF_BASE = 2
 BACKOFF_MAX = 60
 
+# Параллельная загрузка данных из Seller API
+API_CONCURRENCY = 4       # одновременных запросов в асинхронном режиме
+API_RATE_LIMIT = 5        # запросов в секунду (token bucket)
+API_RATE_BURST = 5        # максимальный всплеск запросов
+API_POOL_SIZE = 10        # keep-alive соединений в пуле клиента ozon_client
+API_KEEPALIVE_TIMEOUT = 60
+
+# Пакетная запись цен (/v1/product/import/prices принимает до 1000 товаров)
+PRICE_BATCH_MODE = True       # первый проход по файлу отправляет коррекции пачками
+PRICE_BATCH_SIZE = 1000
+PRICE_BATCH_MAX_DELAY = 2     # сек. ожидания добора пачки во втором проходе (первый шлёт только полные пачки)
+PRICE_TICKET_TIMEOUT = 300    # сек. ожидания результата пачки; дальше обновление считается неудачным
+PRICE_WORKERS = 1             # параллельных браузеров в update_price (1 - последовательная обработка)
+
+# Журнал прогресса рабочего файла in_work/inwork.jsonl
+JOURNAL_FSYNC_EVERY = 20      # fsync журнала раз в N записей
+JOURNAL_FSYNC_INTERVAL = 5    # ... или не реже чем раз в N сек.
+JOURNAL_COMPACT_EVERY = 500   # перезапись рабочего файла раз в N записей журнала
+
+# Потоковая обработка CSV отчёта
+REPORT_STREAM_BATCH = 1000    # строк отчёта на один проход обогащения через API
+REPORT_PREFETCH_BATCHES = 2   # пачек, запрашиваемых в API заранее (--async-api), пока пишутся предыдущие
+REPORT_CHUNK_SIZE = 65536     # байт за одно чтение тела ответа
+
+# Опрос готовности отчёта (/v1/report/info)
+REPORT_POLL_INITIAL = 1       # сек. до первого повторного опроса
+REPORT_POLL_FACTOR = 1.5      # множитель роста интервала
+REPORT_POLL_MAX = 15          # максимальный интервал между опросами
+REPORT_POLL_DEADLINE = 600    # общее время ожидания отчёта, сек.
+
+# Кэш скачанных отчётов (частичные обновления переиспользуют свежий отчёт)
+REPORT_CACHE_DIR = "cache/reports"
+REPORT_CACHE_TTL = 3600       # сек.
+DIRECT_FETCH_MAX_IDS = 2000   # до стольких ID частичное обновление идёт напрямую через /v3/product/info/list
+
+# Промежуточные таблицы пишутся в Parquet (table_store.py); xlsx - итоговый файл для людей
+EXCEL_EXPORT = True
+
+# Хранилище состояния (state_store.py): товары, цены 1С, цены по карте и история коррекций
+STATE_STORE = True
+STATE_DB_PATH = "data/state.sqlite3"
+
 # Общие настройки
 THREADS_PER_PROXY = 3
 MAX_PROXIES = 1
@@ -40,7 +84,6 @@ MAX_ATTEMPTS_PER_PRODUCT = 5
 PRICE_TOLERANCE = 0.05
 HTTPBIN_URL = "https://httpbin.org/ip"
 SUPPORTED_SCHEMES: Tuple[str, ...] = ("http", "https")
-MAX_FILE_AGE_MINUTES = 30
 
 STATIC_USER_AGENTS: List[str] = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/83.0.4103.24 Safari/537.36",
@@ -51,16 +94,34 @@ STATIC_USER_AGENTS: List[str] = [
     "Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/90.0.4430.212 YaBrowser/21.5.2.644 Yowser/2.5 Safari/537.36"
     ]
 
+# Селекторы виджета цены (ожидание загрузки цены на странице товара)
+# Регулярные выражения для поиска цены - price_extraction.PRICE_PATTERNS
 PRICE_SELECTORS: List[str] = [
     "div[data-widget='webPrice'] button span"
 ]
+PRICE_WAIT_TIMEOUT = 15
 
-PRICE_PATTERNS: List[str] = [  
-    r'(\d+[\s.]?\d+)\s*[₽]',
-    r'[\D](\d{1,3}(?:\s?\d{3})*(?:[.,]\d+)?)\s*[₽]',
-    r'"price"\s*:\s*"([\d\s]+)\s*₽"',
-    r'finalPrice":"([\d\s]+)\s*₽'
-]
+# Профиль загрузки страницы товара (ozon_scraper.LOAD_PROFILES): light - без картинок,
+# шрифтов, видео и счётчиков, eager-загрузка; full - страница целиком
+LOAD_PROFILE = "light"
+
+# Пул браузеров (ozon_scraper.DriverPool) живёт между рабочими файлами; браузер
+# перезапускается после POOL_MAX_PAGES страниц или роста JS-кучи больше POOL_MAX_HEAP_GROWTH_MB
+POOL_MAX_PAGES = 50
+POOL_MAX_HEAP_GROWTH_MB = 300
+
+# Цена по карте сначала из marketing_price Seller API (card_price_resolver.py); браузером
+# проверяются товары без цены в API, с расхождением больше допуска (%) и после коррекции
+CARD_PRICE_API_FIRST = True
+CARD_PRICE_API_TOLERANCE = 1.0
+
+# Кэш спарсенных цен по карте (scrape_cache.py), общий с pars_link.py: запись действует
+# SCRAPE_CACHE_TTL секунд, сверх SCRAPE_CACHE_MAX_ENTRIES вытесняются давно не использованные.
+# Проверка после коррекции цены всегда идёт мимо кэша
+SCRAPE_CACHE = True
+SCRAPE_CACHE_PATH = "data/scrape_cache.sqlite3"
+SCRAPE_CACHE_TTL = 3 * 60 * 60
+SCRAPE_CACHE_MAX_ENTRIES = 50000
 
 CONDITIONS: List[dict] = [
     {"min_offset": -100, "max_offset": -40, "old_price_multiplier": 1.20, "price_multiplier": 1.20, "min_price_discount": 0.10},
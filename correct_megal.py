@@ -1,12 +1,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
 import asyncio
-import aiohttp
 import pandas as pd
-import random
-from datetime import datetime
 from loguru import logger
 from conf import BASE_URL, CLIENT_ID, API_KEY
+from ozon_client import AsyncOzonClient
 import json
 import os
 import subprocess
@@ -58,45 +56,10 @@ class OzonAPI:
         self.session = session
     
     async def api_request(self, method, endpoint, json_payload=None):
-        """Асинхронный запрос к API с обработкой ошибок"""
+        """Асинхронный запрос к API с обработкой ошибок (повторы выполняет AsyncOzonClient)"""
         if not self.session or self.session.closed:
             return None
-            
-        url = f"{conf.BASE_URL}{endpoint}"
-        start_time = datetime.now()
-        logger.debug(f"API-запрос к {endpoint} начат")
-
-        for attempt in range(1, 6):
-            try:
-                async with self.session.request(method, url, json=json_payload, ssl=False) as resp:
-                    text = await resp.text()
-                    elapsed = (datetime.now() - start_time).total_seconds()
-                    logger.debug(f"API-запрос к {endpoint} завершен за {elapsed:.2f} секунд")
-
-                    if resp.status == 200:
-                        try:
-                            result = await resp.json()
-                            return result
-                        except aiohttp.ContentTypeError:
-                            logger.error(f"Невалидный JSON в ответе: {text}")
-                            return None
-
-                    if resp.status in (429, 500, 502, 503, 504):
-                        logger.warning(f"{endpoint} попытка {attempt} вернула {resp.status}. Повтор...")
-                        delay = 2 ** attempt + random.random()
-                        await asyncio.sleep(delay)
-                        continue
-
-                    logger.error(f"API {endpoint} ошибка {resp.status}: {text}")
-                    return None
-
-            except Exception as e:
-                logger.warning(f"{endpoint} попытка {attempt} вызвала исключение: {e}")
-                delay = 2 ** attempt + random.random()
-                await asyncio.sleep(delay)
-
-        logger.error(f"API {endpoint} превышено количество попыток")
-        return None
+        return await self.session.request(method, endpoint, json_payload)
 
     async def get_product_info(self, product_ids):
         """Получение информации о товарах"""
@@ -848,13 +811,7 @@ class OzonProductManager:
         if self.session and not self.session.closed:
             await self.session.close()
             
-        headers = {
-            'Client-Id': conf.CLIENT_ID,
-            'Api-Key': conf.API_KEY,
-            'Content-Type': 'application/json'
-        }
-        timeout = aiohttp.ClientTimeout(total=conf.REQUEST_TIMEOUT)
-        self.session = aiohttp.ClientSession(headers=headers, timeout=timeout)
+        self.session = AsyncOzonClient(timeout=conf.REQUEST_TIMEOUT, max_attempts=5)
         self.api = OzonAPI(self.session)
         self.product_manager = ProductManager(self.api)
         logger.info("Сессия успешно создана")
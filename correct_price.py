@@ -4,11 +4,9 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import asyncio
-import aiohttp
-import random
-from datetime import datetime
 from loguru import logger
 from conf import BASE_URL, CLIENT_ID, API_KEY
+from ozon_client import AsyncOzonClient
 
 class Config:
     BASE_URL = BASE_URL
@@ -46,13 +44,7 @@ class ActionManagerApp:
         if self.session and not self.session.closed:
             return
 
-        headers = {
-            'Client-Id': conf.CLIENT_ID,
-            'Api-Key': conf.API_KEY,
-            'Content-Type': 'application/json'
-        }
-        timeout = aiohttp.ClientTimeout(total=conf.REQUEST_TIMEOUT)
-        self.session = aiohttp.ClientSession(headers=headers, timeout=timeout)
+        self.session = AsyncOzonClient(timeout=conf.REQUEST_TIMEOUT, max_attempts=5)
         logger.info("Сессия успешно создана")
 
     def create_ui(self):
@@ -393,46 +385,14 @@ class ActionManagerApp:
             
             
     async def api_request(self, method, endpoint, json_payload=None):
-        """Асинхронный запрос к API с обработкой ошибок"""
+        """Асинхронный запрос к API с обработкой ошибок (повторы выполняет AsyncOzonClient)"""
         if not self.session or self.session.closed:
             await self.init_session()
 
-        url = f"{conf.BASE_URL}{endpoint}"
-        start_time = datetime.now()
-        logger.debug(f"API-запрос к {endpoint} начат")
-
-        for attempt in range(1, 6):
-            try:
-                async with self.session.request(method, url, json=json_payload) as resp:
-                    text = await resp.text()
-                    elapsed = (datetime.now() - start_time).total_seconds()
-                    logger.debug(f"API-запрос к {endpoint} завершен за {elapsed:.2f} секунд")
-
-                    if resp.status == 200:
-                        try:
-                            result = await resp.json()
-                            logger.debug(f"Получен ответ: {result}")
-                            return result
-                        except aiohttp.ContentTypeError:
-                            logger.error(f"Невалидный JSON в ответе: {text}")
-                            return None
-
-                    if resp.status in (429, 500, 502, 503, 504):
-                        logger.warning(f"{endpoint} попытка {attempt} вернула {resp.status}. Повтор...")
-                        delay = 2 ** attempt + random.random()
-                        await asyncio.sleep(delay)
-                        continue
-
-                    logger.error(f"API {endpoint} ошибка {resp.status}: {text}")
-                    return None
-
-            except Exception as e:
-                logger.warning(f"{endpoint} попытка {attempt} вызвала исключение: {e}")
-                delay = 2 ** attempt + random.random()
-                await asyncio.sleep(delay)
-
-        logger.error(f"API {endpoint} превышено количество попыток")
-        return None
+        result = await self.session.request(method, endpoint, json_payload)
+        if result is not None:
+            logger.debug(f"Получен ответ: {result}")
+        return result
 
     def deactivate_selected(self):
         """Деактивация выбранной акции"""
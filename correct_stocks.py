@@ -4,12 +4,10 @@
 import tkinter as tk
 from tkinter import ttk, messagebox
 import asyncio
-import aiohttp
 import pickle
 import os
-import random
-from datetime import datetime, timedelta, UTC
 from conf import BASE_URL, CLIENT_ID, API_KEY
+from ozon_client import AsyncOzonClient
 import loguru
 
 # --- Configuration ---
@@ -28,37 +26,8 @@ logger.add("action_manager.log", rotation="10 MB", encoding="utf-8")
 
 # --- API helpers with retry ---
 async def api_request(session, method, endpoint, json_payload=None):
-    url = f"{conf.BASE_URL}{endpoint}"
-    start_time = datetime.now()
-    logger.debug(f"API request to {endpoint} started")
-    
-    for attempt in range(1, 6):
-        try:
-            async with session.request(method, url, json=json_payload, ssl=False) as resp:
-                text = await resp.text()
-                elapsed = (datetime.now() - start_time).total_seconds()
-                logger.debug(f"API request to {endpoint} completed in {elapsed:.2f}s")
-                
-                if resp.status == 200:
-                    return await resp.json()
-                    
-                if resp.status in (429, 500, 502, 503, 504):
-                    logger.warning(f"{endpoint} attempt {attempt} returned {resp.status}. Retrying...")
-                    delay = 2 ** attempt + random.random()
-                    logger.debug(f"Sleeping for {delay:.2f}s before retry")
-                    await asyncio.sleep(delay)
-                    continue
-                    
-                logger.error(f"API {endpoint} failed {resp.status}: {text}")
-                return None
-                
-        except Exception as e:
-            logger.warning(f"{endpoint} attempt {attempt} exception: {e}")
-            delay = 2 ** attempt + random.random()
-            await asyncio.sleep(delay)
-            
-    logger.error(f"API {endpoint} max retries exceeded")
-    return None
+    """session: AsyncOzonClient; повторы при 429/5xx выполняет сам клиент"""
+    return await session.request(method, endpoint, json_payload)
 
 # --- Action management ---
 async def get_actions(session):
@@ -158,13 +127,7 @@ class ActionManagerApp:
         self.loop.run_until_complete(self.init_session())
 
     async def init_session(self):
-        headers = {
-            'Client-Id': conf.CLIENT_ID,
-            'Api-Key': conf.API_KEY,
-            'Content-Type': 'application/json'
-        }
-        timeout = aiohttp.ClientTimeout(total=conf.REQUEST_TIMEOUT)
-        self.session = aiohttp.ClientSession(headers=headers, timeout=timeout)
+        self.session = AsyncOzonClient(timeout=conf.REQUEST_TIMEOUT, max_attempts=5)
 
     def create_ui(self):
         input_frame = ttk.Frame(self.root, padding="10")
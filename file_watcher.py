@@ -0,0 +1,143 @@
+# file_watcher.py
+
+"""
+Ожидание появления новых файлов в папке (например, in/bad_price_*.jsonl).
+
+На Linux используется inotify через libc (без сторонних зависимостей):
+файл замечается сразу после атомарного переименования (IN_MOVED_TO) или
+закрытия после записи (IN_CLOSE_WRITE). На других системах, а также если
+inotify недоступен, папка опрашивается раз в poll_interval секунд.
+"""
+
+import ctypes
+import ctypes.util
+import fnmatch
+import glob
+import os
+import select
+import struct
+import sys
+import time
+from typing import Dict, List, Optional
+
+from loguru import logger
+
+# Константы из <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class DirectoryWatcher:
+    """Отслеживает появление в папке файлов, подходящих под шаблон имени"""
+
+    def __init__(self, directory: str, pattern: str, poll_interval: float = 1.0):
+        """
+        :param directory: Папка для наблюдения
+        :param pattern: Шаблон имени файла (fnmatch), например "bad_price_*"
+        :param poll_interval: Период опроса папки, если inotify недоступен
+        """
+        self.directory = directory
+        self.pattern = pattern
+        self.poll_interval = poll_interval
+        self.fd: Optional[int] = None
+        self.snapshot: Dict[str, float] = {}
+
+        os.makedirs(directory, exist_ok=True)
+        if sys.platform.startswith("linux"):
+            self._init_inotify()
+        if self.fd is None:
+            self.snapshot = self._scan()
+            logger.info(f"Наблюдение за {directory}/{pattern}: опрос раз в {poll_interval} сек.")
+        else:
+            logger.info(f"Наблюдение за {directory}/{pattern}: inotify")
+
+    @property
+    def mode(self) -> str:
+        return "inotify" if self.fd is not None else "polling"
+
+    def _init_inotify(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_init1")
+            wd = libc.inotify_add_watch(fd, os.fsencode(self.directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+            if wd < 0:
+                os.close(fd)
+                raise OSError(ctypes.get_errno(), "inotify_add_watch")
+            self.fd = fd
+        except (OSError, AttributeError) as e:
+            logger.warning(f"inotify недоступен ({e}), используется опрос папки")
+            self.fd = None
+
+    def _scan(self) -> Dict[str, float]:
+        files = {}
+        for path in glob.glob(os.path.join(self.directory, self.pattern)):
+            try:
+                files[path] = os.path.getmtime(path)
+            except OSError:
+                continue
+        return files
+
+    def _read_events(self) -> List[str]:
+        found = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_len = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset:offset + name_len].rstrip(b"\0").decode("utf-8", "replace")
+                offset += name_len
+                if mask & IN_Q_OVERFLOW:
+                    # Очередь событий переполнена - берём все подходящие файлы
+                    found.extend(self._scan())
+                elif name and fnmatch.fnmatch(name, self.pattern):
+                    found.append(os.path.join(self.directory, name))
+        return found
+
+    def _poll_changes(self) -> List[str]:
+        current = self._scan()
+        changed = [path for path, mtime in current.items() if self.snapshot.get(path) != mtime]
+        self.snapshot = current
+        return changed
+
+    def wait(self, timeout: float) -> List[str]:
+        """
+        Ждёт появления новых (или перезаписанных) файлов не дольше timeout секунд.
+        Возвращает их пути; пустой список - если за это время ничего не появилось.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if self.fd is not None:
+                ready, _, _ = select.select([self.fd], [], [], max(remaining, 0))
+                found = self._read_events() if ready else []
+            else:
+                found = self._poll_changes()
+                if not found and remaining > 0:
+                    time.sleep(min(self.poll_interval, remaining))
+                    found = self._poll_changes()
+            if found:
+                return sorted(set(found))
+            if time.monotonic() >= deadline:
+                return []
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
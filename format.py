@@ -1,22 +1,35 @@
+import argparse
+
 import pandas as pd
-import os
+
+from table_store import read_table, write_table
 
 
 class ProductFinder:
     """
     Класс для поиска строк в Excel-файле по списку идентификаторов.
     Поддерживает поиск по полям: 'Ozon Product ID', 'SKU', 'Артикул'.
+    По умолчанию ищет точные совпадения (без учёта регистра и пробелов по краям),
+    режим 'substring' - прежний поиск вхождения подстроки.
     """
 
-    def __init__(self, input_file_path, id_list_path, output_file_path):
+    MATCH_MODES = ("exact", "substring")
+
+    def __init__(self, input_file_path, id_list_path, output_file_path, save_excel=True, match_mode="exact"):
         """
-        :param input_file_path: Путь к исходному Excel-файлу
+        :param input_file_path: Путь к исходному Excel-файлу (при наличии читается Parquet рядом с ним)
         :param id_list_path: Путь к файлу со списком идентификаторов
         :param output_file_path: Путь для сохранения результата
+        :param save_excel: Сохранять ли xlsx помимо Parquet
+        :param match_mode: 'exact' - точное совпадение, 'substring' - вхождение подстроки
         """
+        if match_mode not in self.MATCH_MODES:
+            raise ValueError(f"Неизвестный режим поиска: {match_mode}")
         self.input_file_path = input_file_path
         self.id_list_path = id_list_path
         self.output_file_path = output_file_path
+        self.save_excel = save_excel
+        self.match_mode = match_mode
         self.product_ids = set()  # Для хранения уникальных идентификаторов
         self.result_df = None     # Для хранения результата поиска
 
@@ -33,10 +46,38 @@ class ProductFinder:
             print(f"[ERROR] Ошибка при чтении файла {self.id_list_path}: {e}")
             raise
 
+    @staticmethod
+    def normalize_ids(values):
+        """
+        Приводит идентификаторы к единому виду для точного сравнения:
+        строка без пробелов по краям, в нижнем регистре, целые числа без '.0'
+        (числовые колонки Excel читаются как float, если в них есть пропуски).
+        """
+        return (
+            values.astype(str)
+                  .str.strip()
+                  .str.lower()
+                  .str.replace(r'^(\d+)\.0+$', r'\1', regex=True)
+                  .astype(object)  # isin по object-колонке работает через хэш-таблицу
+        )
+
+    def exact_mask(self, df, columns):
+        """Маска строк, где хотя бы одна колонка точно совпадает с идентификатором из списка"""
+        ids = self.normalize_ids(pd.Series(sorted(self.product_ids), dtype=object)).unique()
+        mask = pd.Series(False, index=df.index)
+        for col in columns:
+            column = df[col]
+            mask |= self.normalize_ids(column).isin(ids) & column.notna()
+        return mask
+
+    def substring_mask(self, df, columns):
+        """Прежний режим: вхождение любого идентификатора как подстроки (regex)"""
+        return df[columns].apply(lambda row: row.astype(str).str.contains('|'.join(self.product_ids), case=False).any(), axis=1)
+
     def find_matching_rows(self):
         """Читает Excel-файл и находит строки, где значения совпадают с идентификаторами."""
         try:
-            df = pd.read_excel(self.input_file_path)
+            df = read_table(self.input_file_path)
 
             # Проверяем наличие нужных столбцов
             required_columns = ['Ozon Product ID', 'SKU', 'Артикул']
@@ -45,7 +86,10 @@ class ProductFinder:
                 raise KeyError("Нет ни одного из ожидаемых столбцов: Ozon Product ID, SKU, Артикул")
 
             # Создаем маску для фильтрации строк
-            mask = df[available_columns].apply(lambda row: row.astype(str).str.contains('|'.join(self.product_ids), case=False).any(), axis=1)
+            if self.match_mode == "exact":
+                mask = self.exact_mask(df, available_columns)
+            else:
+                mask = self.substring_mask(df, available_columns)
             self.result_df = df[mask]
 
             print(f"[INFO] Найдено {len(self.result_df)} совпадений.")
@@ -54,18 +98,15 @@ class ProductFinder:
             raise
 
     def save_result(self):
-        """Сохраняет результат поиска в новый Excel-файл, если данные найдены."""
+        """Сохраняет результат поиска в Parquet и Excel-файл, если данные найдены."""
         if self.result_df is None:
             print("[ERROR] Нет данных для сохранения. Возможно, поиск не был выполнен или совпадений не найдено.")
             return
 
         try:
-            # Создаем директорию, если её нет
-            os.makedirs(os.path.dirname(self.output_file_path), exist_ok=True)
-
-            # Сохраняем результат
-            self.result_df.to_excel(self.output_file_path, index=False)
-            print(f"[INFO] Результат сохранён в файл: {self.output_file_path}")
+            # Сохраняем результат (директория создаётся при необходимости)
+            saved = write_table(self.result_df, self.output_file_path, excel=self.save_excel)
+            print(f"[INFO] Результат сохранён в файл: {saved}")
         except Exception as e:
             print(f"[ERROR] Ошибка при сохранении файла: {e}")
             raise
@@ -79,9 +120,15 @@ class ProductFinder:
 
 # Точка входа
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Поиск товаров из get/get_new.txt в таблице товаров")
+    parser.add_argument("--match-mode", choices=ProductFinder.MATCH_MODES, default="exact",
+                        help="exact - точное совпадение (по умолчанию), substring - прежний поиск вхождения подстроки")
+    args = parser.parse_args()
+
     finder = ProductFinder(
         input_file_path='in/products_update_full.xlsx',
         id_list_path='get/get_new.txt',
-        output_file_path='in/1_1_product.xlsx'
+        output_file_path='in/1_1_product.xlsx',
+        match_mode=args.match_mode
     )
     finder.run()
\ No newline at end of file
@@ -1,19 +1,32 @@
 # get_data-api.py
 
 import argparse
+import asyncio
+import codecs
 import csv
+import hashlib
+import itertools
+import json
 import os
-import requests
+import random
+import threading
 import time
-from openpyxl import Workbook, load_workbook
-from openpyxl.utils import get_column_letter
+from collections import deque
+from openpyxl import load_workbook
 from loguru import logger
-import certifi
 
 # Конфигурация API
-from conf import BASE_URL, HEADERS
-
-BASE_URL = BASE_URL.rstrip('/')
+from conf import (
+    API_CONCURRENCY, API_RATE_LIMIT, API_RATE_BURST, REPORT_STREAM_BATCH, REPORT_PREFETCH_BATCHES, REPORT_CHUNK_SIZE,
+    REPORT_POLL_INITIAL, REPORT_POLL_FACTOR, REPORT_POLL_MAX, REPORT_POLL_DEADLINE,
+    REPORT_CACHE_DIR, REPORT_CACHE_TTL, DIRECT_FETCH_MAX_IDS, EXCEL_EXPORT, STATE_STORE, STATE_DB_PATH
+)
+from ozon_client import AsyncOzonClient, TokenBucket, get_client
+from state_store import open_store, to_float, to_text
+from table_store import (
+    PARQUET_AVAILABLE, ExcelRowWriter, ParquetRowWriter, iter_table_records, iter_table_rows, peak_memory_mb,
+    prefer_parquet, table_exists, upsert_parquet_rows, write_parquet_table
+)
 
 # Настройка логгера
 logger.remove()
@@ -23,34 +36,24 @@ logger.add(
     format="{time:YYYY-MM-DD HH:mm:ss.SSS} | {level} | {module}:{function}:{line} - {message}"
 )
 
-# Парсинг аргументов командной строки
-parser = argparse.ArgumentParser()
-parser.add_argument('--update-ids', type=str, help='Файл с ID товаров для обновления')
-parser.add_argument('--single-id', type=int, help='ID одного товара для обновления')
-args = parser.parse_args()
 
+# Параметры отчёта по всем товарам
+REPORT_PAYLOAD = {
+    "language": "DEFAULT", 
+    "offer_id": [], 
+    "search": "",
+    "sku": [], 
+    "visibility": "ALL"
+}
 
-def create_report():
+
+def create_report(payload=REPORT_PAYLOAD):
     logger.info("Создаём новый отчёт товаров через Ozon API")
-    payload = {
-        "language": "DEFAULT", 
-        "offer_id": [], 
-        "search": "",
-        "sku": [], 
-        "visibility": "ALL"
-    }
     
     try:
-        resp = requests.post(
-            f"{BASE_URL}/v1/report/products/create",
-            headers=HEADERS, 
-            json=payload, 
-            verify=certifi.where()
-        )
-        logger.debug(f"POST /v1/report/products/create → {resp.status_code}")
-        resp.raise_for_status()
+        data = get_client().post("/v1/report/products/create", payload, raise_errors=True)
         
-        report_code = resp.json()["result"]["code"]
+        report_code = data["result"]["code"]
         logger.info(f"Отчёт создан успешно, код: {report_code}")
         return report_code
         
@@ -59,44 +62,59 @@ def create_report():
         raise
 
 
-def check_report_status(code):
+def report_poll_delay(attempt, initial=REPORT_POLL_INITIAL, factor=REPORT_POLL_FACTOR, max_delay=REPORT_POLL_MAX):
+    """Пауза перед следующим опросом: экспоненциальный рост от initial до max_delay с джиттером ±20%"""
+    delay = min(initial * factor ** (attempt - 1), max_delay)
+    return delay * random.uniform(0.8, 1.2)
+
+
+def check_report_status(code, deadline=REPORT_POLL_DEADLINE):
+    """
+    Опрашивает /v1/report/info, пока отчёт не будет готов.
+    Первые опросы частые (маленькие отчёты готовы за пару секунд), дальше
+    интервал растёт экспоненциально; общее ожидание ограничено deadline секунд.
+    """
     logger.info(f"Ожидаем готовность отчёта {code}")
     payload = {"code": code}
+    started = time.perf_counter()
+    attempt = 0
     
-    for attempt in range(1, 21):
+    while True:
+        attempt += 1
         try:
-            resp = requests.post(
-                f"{BASE_URL}/v1/report/info",
-                headers=HEADERS, 
-                json=payload, 
-                verify=certifi.where()
-            )
-            logger.debug(f"POST /v1/report/info → {resp.status_code} (попытка {attempt}/20)")
-            resp.raise_for_status()
+            data = get_client().post("/v1/report/info", payload, raise_errors=True)
+            logger.debug(f"POST /v1/report/info (попытка {attempt})")
             
-            res = resp.json()["result"]
+            res = data["result"]
             status = res['status']
             logger.debug(f"Статус отчёта: {status}")
             
             if status == "success":
-                logger.info(f"Отчёт готов после {attempt} попыток")
+                elapsed = time.perf_counter() - started
+                logger.info(f"Отчёт готов за {elapsed:.1f} сек после {attempt} опросов")
                 return res["file"]
             elif status in ("error", "expired"):
-                logger.error(f"Отчёт завершился с ошибкой: {status}")
+                elapsed = time.perf_counter() - started
+                logger.error(f"Отчёт завершился с ошибкой: {status} ({elapsed:.1f} сек, {attempt} опросов)")
                 return None
-                
-            logger.debug(f"Отчёт ещё не готов, ждём 10 секунд...")
-            time.sleep(10)
             
         except Exception as e:
             logger.error(f"Ошибка при проверке статуса отчёта (попытка {attempt}): {e}")
-            time.sleep(10)
+        
+        elapsed = time.perf_counter() - started
+        remaining = deadline - elapsed
+        if remaining <= 0:
+            break
+        
+        delay = min(report_poll_delay(attempt), remaining)
+        logger.debug(f"Отчёт ещё не готов, ждём {delay:.1f} секунд...")
+        time.sleep(delay)
     
-    logger.error("Превышено время ожидания готовности отчёта")
+    logger.error(f"Превышено время ожидания готовности отчёта: {deadline} сек, {attempt} опросов")
     return None
 
 
-def download_report(path):
+def report_url(path):
     if not path:
         logger.error("Получен пустой путь к файлу отчёта")
         raise RuntimeError("Не удалось получить путь к файлу отчёта")
@@ -104,33 +122,125 @@ def download_report(path):
     # Формируем полный URL если получен относительный путь
     if not path.startswith("http"):
         path = f"https://cdn1.ozone.ru/s3/{path.lstrip('/')}"
-        
-    logger.info(f"Скачиваем отчёт по адресу: {path}")
+    return path
+
+
+def iter_text_lines(chunks):
+    """Собирает строки (с сохранением переводов строк) из потока текстовых фрагментов"""
+    tail = ""
+    for chunk in chunks:
+        lines = (tail + chunk).splitlines(keepends=True)
+        tail = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        yield from lines
+    if tail:
+        yield tail
+
+
+def report_cache_file(payload=REPORT_PAYLOAD, cache_dir=REPORT_CACHE_DIR):
+    """Путь к кэшу отчёта: имя файла - хэш параметров создания отчёта"""
+    key = hashlib.sha1(json.dumps(payload, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+    return os.path.join(cache_dir, f"report_{key[:16]}.csv")
+
+
+def get_cached_report(payload=REPORT_PAYLOAD, ttl=REPORT_CACHE_TTL):
+    """Возвращает путь к кэшированному отчёту, если он моложе ttl секунд, иначе None"""
+    cache_file = report_cache_file(payload)
+    if not os.path.isfile(cache_file):
+        return None
+    
+    age = time.time() - os.path.getmtime(cache_file)
+    if age > ttl:
+        logger.info(f"Кэш отчёта устарел ({age / 60:.1f} мин.): {cache_file}")
+        return None
+    
+    logger.info(f"Используем кэш отчёта возрастом {age / 60:.1f} мин.: {cache_file}")
+    return cache_file
+
+
+def iter_cached_report_rows(cache_file):
+    """Построчно читает сохранённый CSV отчёта"""
+    with open(cache_file, "r", encoding="utf-8", newline="") as f:
+        rows_count = 0
+        for row in csv.DictReader(f, delimiter=";", quotechar='"'):
+            rows_count += 1
+            yield row
+    logger.info(f"Загружено {rows_count} товаров из кэша отчёта")
+
+
+def iter_tee(chunks, f):
+    """Пропускает фрагменты дальше, попутно записывая их в файл"""
+    for chunk in chunks:
+        f.write(chunk)
+        yield chunk
+
+
+def iter_report_rows(path, cache_file=None):
+    """
+    Потоково читает CSV отчёта: тело ответа декодируется (с учётом BOM) и
+    разбирается по мере скачивания, строки отдаются по одной.
+    Пиковая память не зависит от размера отчёта.
+    Если указан cache_file, отчёт попутно сохраняется туда (после полного скачивания).
+    """
+    url = report_url(path)
+    logger.info(f"Скачиваем отчёт по адресу: {url}")
     
+    resp = get_client().send("GET", url, stream=True)
+    logger.debug(f"GET {url} → {resp.status_code}")
+    cache_tmp = None
+    cache_f = None
+    completed = False
     try:
-        resp = requests.get(path, headers=HEADERS, verify=certifi.where())
-        logger.debug(f"GET {path} → {resp.status_code}")
         resp.raise_for_status()
         
-        # Декодируем содержимое с учётом BOM
-        txt = resp.content.decode("utf-8-sig")
-        
         # Парсим CSV с разделителем ";"
-        products_data = list(csv.DictReader(txt.splitlines(), delimiter=";", quotechar='"'))
-        logger.info(f"Успешно загружено {len(products_data)} товаров из отчёта")
-        
-        # Логируем доступные колонки для отладки
-        if products_data:
-            logger.debug(f"Доступные колонки в отчёте: {list(products_data[0].keys())}")
+        chunks = codecs.iterdecode(resp.iter_content(chunk_size=REPORT_CHUNK_SIZE), "utf-8-sig")
+        if cache_file:
+            os.makedirs(os.path.dirname(cache_file) or ".", exist_ok=True)
+            cache_tmp = f"{cache_file}.part"
+            cache_f = open(cache_tmp, "w", encoding="utf-8", newline="")
+            chunks = iter_tee(chunks, cache_f)
+        reader = csv.DictReader(iter_text_lines(chunks), delimiter=";", quotechar='"')
         
-        return products_data
+        rows_count = 0
+        for row in reader:
+            if rows_count == 0:
+                # Логируем доступные колонки для отладки
+                logger.debug(f"Доступные колонки в отчёте: {reader.fieldnames}")
+            rows_count += 1
+            yield row
         
+        logger.info(f"Успешно загружено {rows_count} товаров из отчёта")
+        completed = True
     except Exception as e:
         logger.error(f"Ошибка при скачивании отчёта: {e}")
         raise
+    finally:
+        resp.close()
+        if cache_f is not None:
+            cache_f.close()
+            if completed:
+                os.replace(cache_tmp, cache_file)
+                logger.info(f"Отчёт сохранён в кэш: {cache_file}")
+            elif os.path.exists(cache_tmp):
+                os.remove(cache_tmp)
+
+
+def get_report_rows(payload=REPORT_PAYLOAD, use_cache=False, ttl=REPORT_CACHE_TTL):
+    """
+    Строки отчёта товаров. При use_cache=True берёт свежий (моложе ttl) отчёт
+    из кэша вместо создания нового; новый отчёт всегда обновляет кэш.
+    """
+    if use_cache:
+        cache_file = get_cached_report(payload, ttl)
+        if cache_file:
+            return iter_cached_report_rows(cache_file)
+    
+    code = create_report(payload)
+    path = check_report_status(code)
+    return iter_report_rows(path, cache_file=report_cache_file(payload))
 
 
-def get_product_prices(product_ids):
+def get_product_prices(product_ids, parse_items=None):
     logger.info(f"Получаем цены для {len(product_ids)} товаров")
     prices = {}
     endpoint = "/v3/product/info/list"
@@ -145,45 +255,175 @@ def get_product_prices(product_ids):
         logger.debug(f"Обрабатываем пакет {chunk_num}/{total_chunks} ({len(chunk)} товаров)")
         
         payload = {"product_id": [str(pid) for pid in chunk]}
-        
+
         try:
-            response = requests.post(
-                f"{BASE_URL}{endpoint}",
-                headers=HEADERS,
-                json=payload,
-                verify=certifi.where()
-            )
-            
-            if response.status_code != 200:
-                logger.error(f"Ошибка API для пакета {chunk_num}: {response.status_code} - {response.text}")
+            started = time.perf_counter()
+            data = get_client().post(endpoint, payload)
+            elapsed = time.perf_counter() - started
+
+            if data is None:
+                logger.error(f"Ошибка API для пакета {chunk_num}")
                 continue
-                
-            data = response.json().get("items", [])
-            
-            for item in data:
-                product_id = item.get("id")
-                if product_id:
-                    price_info = {
-                        "base_price": item.get("price", "Н/Д"),
-                        "old_price": item.get("old_price", "Н/Д"),
-                        "marketing_price": item.get("marketing_price", "Н/Д"),
-                        "min_price": item.get("min_price", "Н/Д"),
-                        "currency": item.get("currency_code", "RUB")
-                    }
-                    prices[product_id] = price_info
-                    
-            logger.debug(f"Пакет {chunk_num} обработан, получено {len([x for x in data if x.get('id')])} цен")
-            
+
+            chunk_prices = (parse_items or parse_price_items)(data.get("items", []))
+            prices.update(chunk_prices)
+
+            logger.debug(f"Пакет {chunk_num} обработан за {elapsed:.2f} сек, получено {len(chunk_prices)} цен")
+
         except Exception as e:
             logger.error(f"Ошибка при обработке пакета {chunk_num}: {e}")
-            
+
         # Задержка между запросами для соблюдения rate limits
         time.sleep(0.5)
-    
+
+    logger.info(f"Получено цен для {len(prices)} товаров из {len(product_ids)} запрошенных")
+    return prices
+
+
+def parse_price_items(items):
+    """Преобразует items ответа /v3/product/info/list в словарь цен по ID товара"""
+    prices = {}
+    for item in items:
+        product_id = item.get("id")
+        if product_id:
+            prices[product_id] = {
+                "base_price": item.get("price", "Н/Д"),
+                "old_price": item.get("old_price", "Н/Д"),
+                "marketing_price": item.get("marketing_price", "Н/Д"),
+                "min_price": item.get("min_price", "Н/Д"),
+                "currency": item.get("currency_code", "RUB")
+            }
+    return prices
+
+
+async def _fetch_prices_chunk(client, semaphore, chunk, chunk_num, total_chunks, latencies, parse_items=None):
+    """Запрашивает цены для одного пакета ID с учётом лимитов"""
+    payload = {"product_id": [str(pid) for pid in chunk]}
+
+    async with semaphore:
+        started = time.perf_counter()
+        data = await client.post("/v3/product/info/list", payload)
+        elapsed = time.perf_counter() - started
+        latencies.append(elapsed)
+
+        if data is None:
+            logger.error(f"Ошибка API для пакета {chunk_num}")
+            return {}
+
+        chunk_prices = (parse_items or parse_price_items)(data.get("items", []))
+        logger.debug(
+            f"Пакет {chunk_num}/{total_chunks} обработан за {elapsed:.2f} сек, "
+            f"получено {len(chunk_prices)} цен"
+        )
+        return chunk_prices
+
+
+async def fetch_prices_with_client(client, semaphore, product_ids, latencies, parse_items=None):
+    """Цены для списка ID пакетами по 100 через уже открытый AsyncOzonClient"""
+    chunk_size = 100
+    chunks = [product_ids[i:i+chunk_size] for i in range(0, len(product_ids), chunk_size)]
+    results = await asyncio.gather(*(
+        _fetch_prices_chunk(client, semaphore, chunk, num, len(chunks), latencies, parse_items)
+        for num, chunk in enumerate(chunks, start=1)
+    ))
+    prices = {}
+    for chunk_prices in results:
+        prices.update(chunk_prices)
+    return prices
+
+
+def log_chunk_latencies(latencies, total_elapsed):
+    if not latencies:
+        return
+    ordered = sorted(latencies)
+    p50 = ordered[len(ordered) // 2]
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    logger.info(
+        f"Задержка пакетов: p50={p50:.2f} сек, p95={p95:.2f} сек, max={ordered[-1]:.2f} сек; "
+        f"всего {total_elapsed:.2f} сек на {len(ordered)} пакетов"
+    )
+
+
+async def get_product_prices_async(product_ids, concurrency=API_CONCURRENCY, rate_limit=API_RATE_LIMIT, parse_items=None):
+    """
+    Асинхронный вариант get_product_prices: пакеты по 100 ID запрашиваются
+    параллельно (не более concurrency одновременно) с ограничением частоты rate_limit.
+    Возвращает тот же словарь цен (или результат parse_items, если он передан).
+    """
+    logger.info(
+        f"Получаем цены для {len(product_ids)} товаров асинхронно "
+        f"(параллельно: {concurrency}, лимит: {rate_limit} запр/сек)"
+    )
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    started = time.perf_counter()
+    client = AsyncOzonClient(pool_size=concurrency, rate_limiter=TokenBucket(rate_limit, API_RATE_BURST))
+    async with client:
+        prices = await fetch_prices_with_client(client, semaphore, product_ids, latencies, parse_items)
+    log_chunk_latencies(latencies, time.perf_counter() - started)
+
     logger.info(f"Получено цен для {len(prices)} товаров из {len(product_ids)} запрошенных")
     return prices
 
 
+def parse_report_items(items):
+    """
+    Преобразует items ответа /v3/product/info/list в строки в формате CSV отчёта
+    (те колонки, что использует save_to_excel) вместе с ценами.
+    """
+    rows = {}
+    for item in items:
+        product_id = item.get("id")
+        if not product_id:
+            continue
+        
+        sources = item.get("sources") or []
+        sku = item.get("sku") or next((src.get("sku") for src in sources if src.get("sku")), "")
+        
+        fbs_stock = 0
+        for stock in (item.get("stocks") or {}).get("stocks", []):
+            if stock.get("source") == "fbs":
+                fbs_stock += (stock.get("present") or 0) - (stock.get("reserved") or 0)
+        
+        statuses = item.get("statuses") or {}
+        visibility = item.get("visibility_details") or {}
+        visible = visibility.get("has_price", True) and visibility.get("has_stock", True)
+        
+        row = {
+            "Ozon Product ID": str(product_id),
+            "SKU": str(sku) if sku else "",
+            "Артикул": item.get("offer_id", ""),
+            "Название товара": item.get("name", ""),
+            "Статус товара": statuses.get("status_name") or statuses.get("status", ""),
+            "Доступно к продаже по схеме FBS, шт.": fbs_stock,
+            "Видимость на Ozon": "Виден покупателям" if visible else "Скрыт",
+            "Причины скрытия": statuses.get("status_tooltip", ""),
+            "Дата создания": item.get("created_at", ""),
+        }
+        row.update(parse_price_items([item])[product_id])
+        rows[product_id] = row
+    return rows
+
+
+def fetch_products_direct(product_ids, async_mode=False):
+    """
+    Быстрый путь для частичного обновления: данные товаров берутся напрямую
+    из /v3/product/info/list пакетами по 100 ID, без создания отчёта.
+    Возвращает список строк в формате отчёта, уже с ценами API.
+    """
+    logger.info(f"Получаем данные {len(product_ids)} товаров напрямую из /v3/product/info/list")
+    if async_mode:
+        rows = asyncio.run(get_product_prices_async(product_ids, parse_items=parse_report_items))
+    else:
+        rows = get_product_prices(product_ids, parse_items=parse_report_items)
+    
+    missing = [pid for pid in product_ids if pid not in rows]
+    if missing:
+        logger.warning(f"Не найдено в API {len(missing)} товаров: {missing[:20]}")
+    return [rows[pid] for pid in product_ids if pid in rows]
+
+
 def extract_ids_from_report(products_data):
     """Извлекает ID товаров из данных отчёта для последующих API запросов"""
     product_ids = []
@@ -197,7 +437,7 @@ def extract_ids_from_report(products_data):
     return product_ids
 
 
-def enrich_products_with_api_data(products_data):
+def enrich_products_with_api_data(products_data, async_mode=False):
     """Обогащает данные из отчёта информацией из API (цены)"""
     if not products_data:
         return products_data
@@ -210,9 +450,15 @@ def enrich_products_with_api_data(products_data):
         return products_data
     
     # Получаем цены через API
-    prices = get_product_prices(product_ids)
-    
-    # Обогащаем данные ценами
+    if async_mode:
+        prices = asyncio.run(get_product_prices_async(product_ids))
+    else:
+        prices = get_product_prices(product_ids)
+    return apply_api_prices(products_data, prices)
+
+
+def apply_api_prices(products_data, prices):
+    """Дописывает в строки отчёта цены API по Ozon Product ID"""
     enriched_count = 0
     for product in products_data:
         product_id_str = product.get("Ozon Product ID")
@@ -226,6 +472,86 @@ def enrich_products_with_api_data(products_data):
     return products_data
 
 
+class AsyncPriceFetcher:
+    """
+    Один event loop в фоновом потоке и один AsyncOzonClient (aiohttp-сессия,
+    keep-alive соединения, TokenBucket) на весь поток строк отчёта. Пачки
+    отправляются через submit() из синхронного кода и выполняются параллельно
+    (общий лимит API_CONCURRENCY запросов).
+    """
+
+    def __init__(self, concurrency=API_CONCURRENCY, rate_limit=API_RATE_LIMIT):
+        self.concurrency = concurrency
+        self.rate_limit = rate_limit
+        self.latencies = []
+        self.started = time.perf_counter()
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="AsyncPriceFetcher", daemon=True)
+        self.thread.start()
+        self.client = None
+        self.semaphore = None
+        self._call(self._open())
+
+    def _call(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    async def _open(self):
+        # Семафор и сессия привязываются к циклу фонового потока
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.client = AsyncOzonClient(
+            pool_size=self.concurrency, rate_limiter=TokenBucket(self.rate_limit, API_RATE_BURST)
+        )
+
+    def submit(self, product_ids):
+        """Запрос цен пачки; возвращает concurrent.futures.Future со словарём цен"""
+        return asyncio.run_coroutine_threadsafe(
+            fetch_prices_with_client(self.client, self.semaphore, product_ids, self.latencies), self.loop
+        )
+
+    def close(self):
+        try:
+            if self.client is not None:
+                self._call(self.client.close())
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+            log_chunk_latencies(self.latencies, time.perf_counter() - self.started)
+
+
+def iter_enriched_products(rows, batch_size=REPORT_STREAM_BATCH, async_mode=False, prefetch=REPORT_PREFETCH_BATCHES):
+    """
+    Потоковое обогащение: строки отчёта набираются пачками по batch_size,
+    для каждой пачки запрашиваются цены из API, после чего строки отдаются дальше.
+    В асинхронном режиме все пачки идут через один AsyncPriceFetcher: до prefetch
+    следующих пачек запрашиваются, пока отдаются строки текущей (в памяти не
+    больше prefetch + 1 пачек), порядок строк сохраняется.
+    """
+    rows = iter(rows)
+    batches = iter(lambda: list(itertools.islice(rows, batch_size)), [])
+    if not async_mode:
+        for batch in batches:
+            yield from enrich_products_with_api_data(batch)
+        return
+
+    fetcher = AsyncPriceFetcher()
+    in_flight = deque()
+    try:
+        for batch in batches:
+            in_flight.append((batch, fetcher.submit(extract_ids_from_report(batch))))
+            if len(in_flight) > prefetch:
+                ready, future = in_flight.popleft()
+                yield from apply_api_prices(ready, future.result())
+        while in_flight:
+            ready, future = in_flight.popleft()
+            yield from apply_api_prices(ready, future.result())
+    finally:
+        # Генератор закрыт раньше времени или пачка завершилась ошибкой
+        for _, future in in_flight:
+            future.cancel()
+        fetcher.close()
+
+
 def load_opt_prices(opt_price_file="in/opt_all.xlsx"):
     logger.info(f"Загружаем цены из файла: {opt_price_file}")
     
@@ -358,11 +684,15 @@ def find_price_for_product(item, price_indexes):
     return None
 
 
-def enrich_products_with_prices(data, opt_price_file="in/opt_all.xlsx"):
-    logger.info(f"Начинаем обогащение {len(data)} товаров ценами из {opt_price_file}")
+def iter_products_with_prices(data, opt_price_file="in/opt_all.xlsx", store=None):
+    """Потоково проставляет товарам цену 1С ('Цена'); цены 1С сохраняются в хранилище состояния"""
+    logger.info(f"Начинаем обогащение товаров ценами из {opt_price_file}")
     
     # Загружаем индексы цен
     price_indexes = load_opt_prices(opt_price_file)
+    if store is not None and any(price_indexes.values()):
+        saved = store.replace_prices_1c(price_indexes)
+        logger.info(f"Цены 1С сохранены в хранилище состояния: {saved}")
     
     # Счетчики для статистики
     found_prices = 0
@@ -383,10 +713,145 @@ def enrich_products_with_prices(data, opt_price_file="in/opt_all.xlsx"):
             article = item.get('Артикул', 'Н/Д')
             name = item.get('Название товара', 'Н/Д')
             logger.debug(f"Цена не найдена для товара: артикул='{article}', название='{name}'")
+        
+        yield item
     
     logger.info(f"Результаты обогащения ценами: найдено={found_prices}, не найдено={not_found_prices}")
-    
-    return data
+
+
+def product_link(sku):
+    return f"https://www.ozon.ru/product/{sku}/" if sku and sku != "Н/Д" else ""
+
+
+def store_product_row(item):
+    """Товар отчёта/API в колонках таблицы products хранилища состояния"""
+    fbs_stock = to_float(item.get("Доступно к продаже по схеме FBS, шт."))
+    return {
+        "ozon_id": to_text(item.get("Ozon Product ID")),
+        "sku": to_text(item.get("SKU")),
+        "offer_id": to_text(item.get("Артикул")),
+        "name": to_text(item.get("Название товара")),
+        "url": product_link(item.get("SKU", "")) or None,
+        "status": to_text(item.get("Статус товара")),
+        "visibility": to_text(item.get("Видимость на Ozon")),
+        "base_price": to_float(item.get("base_price")),
+        "old_price": to_float(item.get("old_price")),
+        "marketing_price": to_float(item.get("marketing_price")),
+        "min_price": to_float(item.get("min_price")),
+        "price_1c": to_float(item.get("Цена")),
+        "fbs_stock": int(fbs_stock) if fbs_stock is not None else None,
+    }
+
+
+def iter_stored_products(data, store, batch_size=REPORT_STREAM_BATCH):
+    """Пропускает товары дальше, попутно сохраняя их в хранилище состояния пачками"""
+    batch = []
+    saved = 0
+    for item in data:
+        batch.append(store_product_row(item))
+        if len(batch) >= batch_size:
+            saved += store.upsert_products(batch)
+            batch = []
+        yield item
+    saved += store.upsert_products(batch)
+    logger.info(f"Товаров сохранено в хранилище состояния: {saved}")
+
+
+# Маппинг полей для правильного отображения в Excel
+FIELD_MAPPING = {
+    "SKU": "SKU",
+    "Артикул": "Артикул",
+    "Ozon Product ID": "Ozon Product ID",
+    "Название товара": "Название товара",
+    "Статус товара": "Статус товара",
+    "Доступно к продаже по схеме FBS, шт.": "Доступно FBS",
+    "Видимость на Ozon": "Видимость",
+    "Причины скрытия": "Причины скрытия",
+    "Дата создания": "Дата создания",
+    "product_link": "Ссылка на товар",
+    "base_price": "Базовая цена API",
+    "old_price": "Старая цена API",
+    "marketing_price": "Маркетинговая цена API",
+    "min_price": "Минимальная цена API",
+    "Цена": "Цена 1С",
+}
+
+# Обратный маппинг для поиска ключей
+REVERSE_FIELD_MAPPING = {v: k for k, v in FIELD_MAPPING.items()}
+
+# Порядок колонок в итоговом файле
+COLUMN_ORDER = [
+    "Ozon Product ID", "SKU", "Артикул", "Ссылка на товар", "Название товара",
+    "Статус товара", "Видимость", "Причины скрытия", "Базовая цена API",
+    "Старая цена API", "Маркетинговая цена API", "Минимальная цена API",
+    "Цена 1С", "Доступно FBS", "Дата создания"
+]
+
+PRICE_COLUMNS = [
+    "Базовая цена API", "Старая цена API",
+    "Маркетинговая цена API", "Минимальная цена API",
+    "Цена 1С"
+]
+
+
+def format_product_row(item):
+    """Товар отчёта/API в строку итоговой таблицы (значения в порядке COLUMN_ORDER)"""
+    row = []
+    for col in COLUMN_ORDER:
+        if col == "Ссылка на товар":
+            # Генерируем ссылку на товар используя SKU из отчёта
+            row.append(product_link(item.get('SKU', '')))
+            continue
+            
+        # Получаем значение по ключу
+        key = REVERSE_FIELD_MAPPING.get(col, col)
+        val = item.get(key, "")
+
+        # Форматируем ценовые поля
+        if col in PRICE_COLUMNS:
+            if val and val != "Н/Д":
+                try:
+                    num = float(str(val).replace(',', '.'))
+                    row.append(f"{num:.2f} ₽")
+                except (ValueError, TypeError):
+                    row.append(val)
+            else:
+                row.append(val)
+        elif col == "Доступно FBS":
+            # Форматируем количество
+            if val:
+                try:
+                    row.append(int(val))
+                except (ValueError, TypeError):
+                    row.append(val)
+            else:
+                row.append(val)
+        else:
+            row.append(val)
+    return row
+
+
+def iter_old_rows(filename, update_ids):
+    """
+    Строки старого файла, которые не затронуты частичным обновлением (построчно, для xlsx
+    без Parquet). Старые строки уже в колонках итоговой таблицы и переносятся как есть.
+    """
+    try:
+        # Создаем множество для быстрого поиска обновляемых ID
+        update_set = set(str(uid) for uid in update_ids)
+        old_records_added = 0
+        
+        # Добавляем записи, которые не обновляются
+        for old_item in iter_table_records(filename):
+            old_id = old_item.get('Ozon Product ID')
+            if old_id is not None and str(old_id) not in update_set:
+                old_records_added += 1
+                yield [old_item.get(col, "") for col in COLUMN_ORDER]
+        
+        logger.info(f"Добавлено {old_records_added} старых записей")
+        
+    except Exception as e:
+        logger.error(f"Ошибка при добавлении старых записей: {e}")
 
 
 def save_to_excel(
@@ -395,162 +860,96 @@ def save_to_excel(
     filename="in/products_update.xlsx",
     update_ids=None
 ):
-    logger.info(f"Начинаем сохранение {len(data)} записей в файл {filename}")
+    """
+    data может быть списком или итератором (потоковый режим).
+    При частичном обновлении (update_ids) новые строки сливаются со старой таблицей
+    по Ozon Product ID: при наличии Parquet - по колонкам через pyarrow, без разбора
+    старых строк в Python; если xlsx не нужен, запись не зависит от размера каталога
+    ничем, кроме чтения и записи Parquet.
+    """
+    logger.info(f"Начинаем сохранение записей в файл {filename}")
+    started = time.perf_counter()
     
-    if not data:
+    data = iter(data)
+    first = next(data, None)
+    if first is None:
         logger.error("Нет данных для сохранения")
         return
 
-    # Обогащаем данные ценами из 1С
-    data = enrich_products_with_prices(data, opt_price_file)
+    store = open_store(STATE_DB_PATH) if STATE_STORE else None
+    parquet_writer = None
+    excel_writer = None
+    try:
+        # Обогащаем данные ценами из 1С
+        data = iter_products_with_prices(itertools.chain([first], data), opt_price_file, store=store)
+        if store is not None:
+            # В хранилище состояния попадают только новые данные (upsert по Ozon Product ID)
+            data = iter_stored_products(data, store)
 
-    # Частичное обновление: добавляем старые записи
-    if update_ids and os.path.isfile(filename):
-        logger.info("Режим частичного обновления: добавляем старые записи")
-        try:
-            wb_old = load_workbook(filename, read_only=True)
-            ws_old = wb_old.active
-            
-            if ws_old is not None:
-                headers_old = [cell.value for cell in ws_old[1]]
-                
-                if 'Ozon Product ID' in headers_old:
-                    id_idx = headers_old.index('Ozon Product ID')
-                    old_records_added = 0
-                    
-                    # Создаем множество для быстрого поиска обновляемых ID
-                    update_set = set(str(uid) for uid in update_ids)
-                    
-                    # Добавляем записи, которые не обновляются
-                    for row in ws_old.iter_rows(min_row=2, values_only=True):
-                        if len(row) > id_idx and row[id_idx] is not None:
-                            old_id = str(row[id_idx])
-                            if old_id not in update_set:
-                                # Создаем запись из старых данных
-                                old_item = {}
-                                for i, header in enumerate(headers_old):
-                                    old_item[header] = row[i] if i < len(row) else None
-                                data.append(old_item)
-                                old_records_added += 1
-                    
-                    logger.info(f"Добавлено {old_records_added} старых записей, итого: {len(data)}")
-            
-            wb_old.close()
-            
-        except Exception as e:
-            logger.error(f"Ошибка при добавлении старых записей: {e}")
-
-    # Маппинг полей для правильного отображения в Excel
-    field_mapping = {
-        "SKU": "SKU",
-        "Артикул": "Артикул",
-        "Ozon Product ID": "Ozon Product ID",
-        "Название товара": "Название товара",
-        "Статус товара": "Статус товара",
-        "Доступно к продаже по схеме FBS, шт.": "Доступно FBS",
-        "Видимость на Ozon": "Видимость",
-        "Причины скрытия": "Причины скрытия",
-        "Дата создания": "Дата создания",
-        "product_link": "Ссылка на товар",
-        "base_price": "Базовая цена API",
-        "old_price": "Старая цена API",
-        "marketing_price": "Маркетинговая цена API",
-        "min_price": "Минимальная цена API",
-        "Цена": "Цена 1С",
-    }
-    
-    # Обратный маппинг для поиска ключей
-    reverse_map = {v: k for k, v in field_mapping.items()}
-
-    # Определяем порядок колонок в итоговом файле
-    column_order = [
-        "Ozon Product ID", "SKU", "Артикул", "Ссылка на товар", "Название товара",
-        "Статус товара", "Видимость", "Причины скрытия", "Базовая цена API",
-        "Старая цена API", "Маркетинговая цена API", "Минимальная цена API",
-        "Цена 1С", "Доступно FBS", "Дата создания"
-    ]
-
-    # Создаём Excel книгу
-    logger.debug("Создаем Excel книгу и заполняем данными")
-    wb = Workbook()
-    ws = wb.active
-    
-    if ws is None:
-        logger.error("Не удалось создать лист Excel")
-        return
-        
-    ws.title = "Товары"
-    ws.append(column_order)
+        rows = (format_product_row(item) for item in data)
 
-    # Заполняем данные
-    rows_added = 0
-    for item in data:
-        row = []
-        for col in column_order:
-            if col == "Ссылка на товар":
-                # Генерируем ссылку на товар используя SKU из отчёта
-                sku = item.get('SKU', '')
-                row.append(f"https://www.ozon.ru/product/{sku}/" if sku and sku != "Н/Д" else "")
-                continue
-                
-            # Получаем значение по ключу
-            key = reverse_map.get(col, col)
-            val = item.get(key, "")
-
-            # Форматируем ценовые поля
-            if col in [
-                "Базовая цена API", "Старая цена API",
-                "Маркетинговая цена API", "Минимальная цена API",
-                "Цена 1С"
-            ]:
-                if val and val != "Н/Д":
-                    try:
-                        num = float(str(val).replace(',', '.'))
-                        row.append(f"{num:.2f} ₽")
-                    except (ValueError, TypeError):
-                        row.append(val)
-                else:
-                    row.append(val)
-            elif col == "Доступно FBS":
-                # Форматируем количество
-                if val:
-                    try:
-                        row.append(int(val))
-                    except (ValueError, TypeError):
-                        row.append(val)
-                else:
-                    row.append(val)
+        # Частичное обновление: слияние со старыми записями
+        merged = None
+        if update_ids and table_exists(filename):
+            if PARQUET_AVAILABLE and prefer_parquet(filename):
+                logger.info("Режим частичного обновления: слияние по Ozon Product ID")
+                merged = upsert_parquet_rows(filename, COLUMN_ORDER, list(rows), "Ozon Product ID", update_ids)
+                rows = iter_table_rows(merged)
             else:
-                row.append(val)
-                
-        ws.append(row)
-        rows_added += 1
-
-    logger.debug(f"Добавлено {rows_added} строк данных в Excel")
-
-    # Автоподбор ширины столбцов
-    logger.debug("Настраиваем ширину столбцов")
-    for idx, col_cells in enumerate(ws.columns, start=1):
-        col_letter = get_column_letter(idx)
-        
-        # Находим максимальную длину текста в колонке
-        max_len = 0
-        for cell in col_cells:
-            if cell.value:
-                cell_len = len(str(cell.value))
-                if cell_len > max_len:
-                    max_len = cell_len
-        
-        # Устанавливаем ширину с ограничением максимума
-        adjusted_width = min((max_len + 2) * 1.2, 50)
-        ws.column_dimensions[col_letter].width = adjusted_width
-
-    # Создаем директорию если её нет
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    
-    # Сохраняем файл
-    wb.save(filename)
-    logger.info(f"Файл успешно сохранён: {filename}")
+                logger.info("Режим частичного обновления: добавляем старые записи")
+                rows = itertools.chain(rows, iter_old_rows(filename, update_ids))
+
+        # Промежуточная таблица для следующих этапов (format.py и др.) пишется в Parquet рядом с xlsx
+        excel = EXCEL_EXPORT or not PARQUET_AVAILABLE
+        parquet_writer = ParquetRowWriter(filename, COLUMN_ORDER) if PARQUET_AVAILABLE and merged is None else None
+
+        # xlsx пишется потоково, ширина колонок считается в том же проходе
+        if excel:
+            logger.debug("Создаем Excel книгу и заполняем данными")
+            excel_writer = ExcelRowWriter(filename, COLUMN_ORDER, sheet_title="Товары")
+
+        # Заполняем данные (rows - ленивый генератор: обогащение ценами 1С и запись в хранилище идут здесь)
+        rows_added = 0
+        if excel_writer is not None or parquet_writer is not None:
+            for row in rows:
+                if excel_writer is not None:
+                    excel_writer.append(row)
+                if parquet_writer is not None:
+                    parquet_writer.append(row)
+                rows_added += 1
+        elif merged is not None:
+            rows_added = merged.num_rows
+
+        logger.info(f"Добавлено {rows_added} строк данных")
+
+        if excel_writer is not None:
+            excel_writer.close()
+            excel_writer = None
+            logger.info(f"Файл успешно сохранён: {filename}")
+
+        # Parquet закрывается после xlsx, чтобы читатели не сочли xlsx более свежим
+        if parquet_writer is not None:
+            parquet_writer.close()
+            parquet_writer = None
+        if merged is not None:
+            write_parquet_table(merged, filename)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения {filename}, прежние файлы оставлены без изменений: {e}")
+        raise
+    finally:
+        # После ошибки недописанные файлы удаляются: <файл>.parquet.part и временные данные xlsx
+        if parquet_writer is not None:
+            parquet_writer.abort()
+        if excel_writer is not None:
+            excel_writer.abort()
+        if store is not None:
+            store.close()
+
+    peak = peak_memory_mb()
+    logger.info(
+        f"Сохранение {rows_added} строк заняло {time.perf_counter() - started:.1f} сек."
+        + (f", пик памяти процесса {peak:.0f} МБ" if peak is not None else "")
+    )
 
 
 def main():
@@ -559,6 +958,11 @@ def main():
     parser = argparse.ArgumentParser(description="Скрипт для получения и обработки данных товаров Ozon")
     parser.add_argument("--update-ids", type=str, help="Файл с ID товаров для обновления")
     parser.add_argument("--single-id", type=int, help="ID одного товара для обновления")
+    parser.add_argument("--async-api", action="store_true", help="Параллельная асинхронная загрузка цен из API")
+    parser.add_argument("--strategy", choices=("auto", "direct", "report"), default="auto",
+                        help="Частичное обновление: direct - /v3/product/info/list, report - из отчёта, auto - по числу ID")
+    parser.add_argument("--no-report-cache", action="store_true", help="Не использовать кэш отчёта при частичном обновлении")
+    parser.add_argument("--report-cache-ttl", type=int, default=REPORT_CACHE_TTL, help="Срок годности кэша отчёта, сек")
     args = parser.parse_args()
 
     try:
@@ -585,31 +989,43 @@ def main():
                 logger.error("Список ID товаров пуст")
                 return
 
-            # Создаем и получаем отчет
-            code = create_report()
-            path = check_report_status(code)
-            products = download_report(path)
+            # Выбираем стратегию: для небольшого числа ID быстрее запросить товары напрямую
+            strategy = args.strategy
+            if strategy == "auto":
+                strategy = "direct" if len(ids) <= DIRECT_FETCH_MAX_IDS else "report"
+            logger.info(f"Стратегия получения данных: {strategy} ({len(ids)} ID)")
 
-            # Фильтруем только нужные товары
-            logger.info(f"Фильтруем товары по {len(ids)} указанным ID")
-            selected_products = []
-            ids_set = set(ids)
-            
-            for product in products:
-                product_id_str = product.get("Ozon Product ID")
-                if product_id_str and str(product_id_str).strip() and str(product_id_str).strip().isdigit():
-                    if int(product_id_str) in ids_set:
-                        selected_products.append(product)
-            
-            logger.info(f"Найдено {len(selected_products)} товаров из {len(ids)} запрошенных")
+            if strategy == "direct":
+                processed_products = fetch_products_direct(ids, async_mode=args.async_api)
+                logger.info(f"Найдено {len(processed_products)} товаров из {len(ids)} запрошенных")
 
-            if not selected_products:
-                logger.warning("Не найдено товаров для обновления")
-                return
-       
-            # Обогащаем данные ценами из API
-            logger.info("Обогащаем данные ценами из API")
-            processed_products = enrich_products_with_api_data(selected_products)
+                if not processed_products:
+                    logger.warning("Не найдено товаров для обновления")
+                    return
+            else:
+                # Получаем отчет (свежий отчёт из кэша переиспользуется)
+                rows = get_report_rows(use_cache=not args.no_report_cache, ttl=args.report_cache_ttl)
+
+                # Фильтруем только нужные товары прямо при чтении отчёта
+                logger.info(f"Фильтруем товары по {len(ids)} указанным ID")
+                selected_products = []
+                ids_set = set(ids)
+                
+                for product in rows:
+                    product_id_str = product.get("Ozon Product ID")
+                    if product_id_str and str(product_id_str).strip() and str(product_id_str).strip().isdigit():
+                        if int(product_id_str) in ids_set:
+                            selected_products.append(product)
+                
+                logger.info(f"Найдено {len(selected_products)} товаров из {len(ids)} запрошенных")
+
+                if not selected_products:
+                    logger.warning("Не найдено товаров для обновления")
+                    return
+           
+                # Обогащаем данные ценами из API
+                logger.info("Обогащаем данные ценами из API")
+                processed_products = enrich_products_with_api_data(selected_products, async_mode=args.async_api)
 
             # Сохраняем результаты
             output_filename = "in/products_update_single.xlsx"
@@ -626,16 +1042,12 @@ def main():
         # Полный режим для всех товаров
         logger.info("Режим полного обновления всех товаров")
         
-        # Создаем и получаем отчет
-        code = create_report()
-        path = check_report_status(code)
-        products = download_report(path)
+        # Создаем и получаем новый отчет (он же обновляет кэш)
+        rows = get_report_rows(use_cache=False)
 
-        # Обогащаем данные ценами из API
+        # Строки отчёта читаются потоково и обогащаются ценами из API пачками
         logger.info("Обогащаем данные ценами из API")
-        processed_products = enrich_products_with_api_data(products)
-
-        logger.info(f"Обработано {len(processed_products)} товаров")
+        processed_products = iter_enriched_products(rows, async_mode=args.async_api)
 
         # Сохраняем результаты полного обновления
         output_filename = "in/products_update_full_vdeeep.xlsx"
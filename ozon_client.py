@@ -0,0 +1,305 @@
+# ozon_client.py
+
+"""
+Общий клиент Ozon Seller API для всех скриптов проекта.
+
+Держит одно долгоживущее соединение (keep-alive пул) на процесс вместо
+нового TCP/TLS соединения на каждый запрос и повторяет запросы при 429/5xx
+с учётом заголовка Retry-After. Есть синхронный (OzonClient, requests) и
+асинхронный (AsyncOzonClient, aiohttp) интерфейс с одинаковым поведением.
+"""
+
+import asyncio
+import random
+import ssl
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+import certifi
+import requests
+from requests.adapters import HTTPAdapter
+from loguru import logger
+
+from conf import (
+    BASE_URL, HEADERS, API_TIMEOUT, MAX_API_ATTEMPTS,
+    BACKOFF_BASE, BACKOFF_MAX, API_POOL_SIZE, API_KEEPALIVE_TIMEOUT
+)
+
+# Статусы, при которых запрос имеет смысл повторить
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class OzonAPIError(Exception):
+    """Ошибка запроса к Seller API после исчерпания попыток"""
+
+    def __init__(self, endpoint, status=None, text=""):
+        self.endpoint = endpoint
+        self.status = status
+        self.text = text
+        super().__init__(f"API {endpoint} ошибка {status}: {text}")
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов (token bucket).
+    Потокобезопасен и может использоваться как из синхронного, так и из асинхронного кода.
+    """
+
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Скорость пополнения, токенов в секунду
+        :param capacity: Максимальное количество накопленных токенов
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _reserve(self):
+        """Резервирует токен и возвращает время ожидания до его появления"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def acquire(self):
+        """Блокирующее ожидание токена"""
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def acquire_async(self):
+        """Асинхронное ожидание токена"""
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+def retry_delay(attempt, retry_after=None):
+    """
+    Пауза перед повторной попыткой: значение Retry-After (секунды или HTTP-дата),
+    иначе экспоненциальная задержка с джиттером. Не больше BACKOFF_MAX.
+    """
+    if retry_after:
+        try:
+            delay = float(retry_after)
+        except ValueError:
+            try:
+                delay = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                delay = None
+        if delay is not None:
+            return min(max(delay, 0.0), BACKOFF_MAX)
+    return min(BACKOFF_BASE ** attempt + random.random(), BACKOFF_MAX)
+
+
+class OzonClient:
+    """Синхронный клиент Seller API на общем requests.Session с пулом соединений"""
+
+    def __init__(self, base_url=BASE_URL, headers=None, timeout=API_TIMEOUT,
+                 max_attempts=MAX_API_ATTEMPTS, pool_size=API_POOL_SIZE, rate_limiter=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.rate_limiter = rate_limiter
+
+        self.session = requests.Session()
+        self.session.headers.update(headers or HEADERS)
+        self.session.verify = certifi.where()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def _url(self, endpoint):
+        return endpoint if endpoint.startswith("http") else f"{self.base_url}{endpoint}"
+
+    def send(self, method, endpoint, json_payload=None, **kwargs):
+        """
+        Выполняет запрос с повторами при 429/5xx и сетевых ошибках.
+        Возвращает последний requests.Response (в том числе неуспешный);
+        при исчерпании попыток из-за исключений пробрасывает последнее из них.
+        """
+        url = self._url(endpoint)
+        kwargs.setdefault("timeout", self.timeout)
+        last_error = None
+
+        for attempt in range(1, self.max_attempts + 1):
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            started = time.perf_counter()
+            try:
+                resp = self.session.request(method, url, json=json_payload, **kwargs)
+            except requests.RequestException as e:
+                last_error = e
+                logger.warning(f"{endpoint} попытка {attempt} вызвала исключение: {e}")
+                if attempt < self.max_attempts:
+                    time.sleep(retry_delay(attempt))
+                continue
+
+            elapsed = time.perf_counter() - started
+            logger.debug(f"{method} {endpoint} → {resp.status_code} за {elapsed:.2f} сек (попытка {attempt})")
+
+            if resp.status_code in RETRY_STATUSES and attempt < self.max_attempts:
+                delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+                logger.warning(f"{endpoint} попытка {attempt} вернула {resp.status_code}. Повтор через {delay:.1f} сек")
+                resp.close()
+                time.sleep(delay)
+                continue
+            return resp
+
+        raise last_error
+
+    def request(self, method, endpoint, json_payload=None, raise_errors=False):
+        """
+        Запрос к API с разбором JSON.
+        Возвращает dict ответа или None при ошибке (или OzonAPIError при raise_errors=True).
+        """
+        try:
+            resp = self.send(method, endpoint, json_payload)
+        except requests.RequestException as e:
+            logger.error(f"API {endpoint} превышено количество попыток: {e}")
+            if raise_errors:
+                raise OzonAPIError(endpoint, text=str(e)) from e
+            return None
+
+        if resp.status_code != 200:
+            logger.error(f"API {endpoint} ошибка {resp.status_code}: {resp.text}")
+            if raise_errors:
+                raise OzonAPIError(endpoint, resp.status_code, resp.text)
+            return None
+
+        try:
+            return resp.json()
+        except ValueError:
+            logger.error(f"Невалидный JSON в ответе {endpoint}: {resp.text}")
+            if raise_errors:
+                raise OzonAPIError(endpoint, resp.status_code, resp.text)
+            return None
+
+    def post(self, endpoint, json_payload=None, raise_errors=False):
+        return self.request("POST", endpoint, json_payload, raise_errors=raise_errors)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncOzonClient:
+    """
+    Асинхронный клиент Seller API на одном aiohttp.ClientSession с keep-alive пулом.
+    Сессия создаётся лениво внутри работающего event loop.
+    """
+
+    def __init__(self, base_url=BASE_URL, headers=None, timeout=API_TIMEOUT,
+                 max_attempts=MAX_API_ATTEMPTS, pool_size=API_POOL_SIZE, rate_limiter=None):
+        self.base_url = base_url.rstrip('/')
+        self.headers = dict(headers or HEADERS)
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.pool_size = pool_size
+        self.rate_limiter = rate_limiter
+        self.session = None
+        self._closed = False
+
+    @property
+    def closed(self):
+        return self._closed
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                keepalive_timeout=API_KEEPALIVE_TIMEOUT,
+                ssl=ssl.create_default_context(cafile=certifi.where())
+            )
+            self.session = aiohttp.ClientSession(
+                headers=self.headers,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                connector=connector
+            )
+        return self.session
+
+    async def request(self, method, endpoint, json_payload=None, raise_errors=False):
+        """
+        Асинхронный запрос с повторами при 429/5xx.
+        Возвращает dict ответа или None при ошибке (или OzonAPIError при raise_errors=True).
+        """
+        session = await self._get_session()
+        url = endpoint if endpoint.startswith("http") else f"{self.base_url}{endpoint}"
+        status, text = None, ""
+
+        for attempt in range(1, self.max_attempts + 1):
+            if self.rate_limiter:
+                await self.rate_limiter.acquire_async()
+            started = time.perf_counter()
+            try:
+                async with session.request(method, url, json=json_payload) as resp:
+                    status = resp.status
+                    text = await resp.text()
+                    elapsed = time.perf_counter() - started
+                    logger.debug(f"{method} {endpoint} → {status} за {elapsed:.2f} сек (попытка {attempt})")
+
+                    if status == 200:
+                        try:
+                            return await resp.json(content_type=None)
+                        except ValueError:
+                            logger.error(f"Невалидный JSON в ответе {endpoint}: {text}")
+                            break
+
+                    if status in RETRY_STATUSES and attempt < self.max_attempts:
+                        delay = retry_delay(attempt, resp.headers.get("Retry-After"))
+                        logger.warning(f"{endpoint} попытка {attempt} вернула {status}. Повтор через {delay:.1f} сек")
+                        await asyncio.sleep(delay)
+                        continue
+
+                    logger.error(f"API {endpoint} ошибка {status}: {text}")
+                    break
+
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, text = None, str(e)
+                logger.warning(f"{endpoint} попытка {attempt} вызвала исключение: {e}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(retry_delay(attempt))
+        else:
+            logger.error(f"API {endpoint} превышено количество попыток")
+
+        if raise_errors:
+            raise OzonAPIError(endpoint, status, text)
+        return None
+
+    async def post(self, endpoint, json_payload=None, raise_errors=False):
+        return await self.request("POST", endpoint, json_payload, raise_errors=raise_errors)
+
+    async def close(self):
+        self._closed = True
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_client():
+    """Общий синхронный клиент процесса: все вызовы переиспользуют один пул соединений"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = OzonClient()
+        return _shared_client
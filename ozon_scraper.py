@@ -0,0 +1,631 @@
+# ozon_scraper.py
+
+"""
+Общие части парсинга страниц Ozon для pars_link.py и update_price.py:
+мониторинг трафика, менеджер прокси, базовый Parser (загрузка страницы,
+проверка блокировки, извлечение цены через price_extraction.py) и пул
+браузеров DriverPool.
+
+Настройки (таймауты, задержки, прокси, селекторы, профиль загрузки) передаются
+объектом config - классом Config из pars_link.py или модулем conf. Запуск
+драйвера, прогрев, имитация поведения и обход блокировки у скриптов свои и
+остаются в их подклассах Parser.
+"""
+
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from threading import Lock
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+from fake_useragent import UserAgent
+from loguru import logger
+from requests.auth import HTTPProxyAuth
+from selenium.common.exceptions import TimeoutException, WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+from price_extraction import extract_price_from_html, is_blocked_html, normalize_price
+
+# Профили загрузки страницы (config.LOAD_PROFILE): стратегия загрузки Selenium и
+# запросы, которые браузер не выполняет (CDP Network.setBlockedURLs).
+# light не грузит картинки, шрифты, видео и счётчики; скрипты и стили Ozon
+# остаются - без них не отрисуется виджет webPrice. eager отдаёт страницу после
+# DOMContentLoaded, появление цены дожидается Parser.load_page.
+LOAD_PROFILES = {
+    "full": {
+        "page_load_strategy": "normal",
+        "blocked_urls": [],
+    },
+    "light": {
+        "page_load_strategy": "eager",
+        "blocked_urls": [
+            # Картинки
+            "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.avif", "*.svg", "*.ico",
+            # Шрифты
+            "*.woff", "*.woff2", "*.ttf", "*.otf",
+            # Видео
+            "*.mp4", "*.webm", "*.m3u8", "*.ts",
+            # Счётчики и реклама
+            "*mc.yandex.ru*", "*an.yandex.ru*", "*google-analytics.com*", "*googletagmanager.com*",
+            "*doubleclick.net*", "*top-fwz1.mail.ru*", "*vk.com/rtrg*", "*criteo*",
+        ],
+    },
+}
+
+# Переданный трафик страницы по Resource Timing API (документ и загруженные ресурсы)
+PAGE_TRANSFER_JS = """
+    const entries = performance.getEntriesByType('navigation').concat(performance.getEntriesByType('resource'));
+    let bytes = 0;
+    for (const entry of entries) {
+        bytes += entry.transferSize || 0;
+    }
+    return [bytes, entries.length];
+"""
+JS_HEAP_JS = "return performance.memory ? performance.memory.usedJSHeapSize : 0;"
+
+
+def resolve_load_profile(config) -> Tuple[str, Dict]:
+    """Имя и настройки профиля загрузки из config.LOAD_PROFILE (по умолчанию full)"""
+    name = getattr(config, "LOAD_PROFILE", "full")
+    if name not in LOAD_PROFILES:
+        logger.warning(f"Неизвестный профиль загрузки {name}, используется full")
+        name = "full"
+    return name, LOAD_PROFILES[name]
+
+
+def format_bytes(count):
+    if count < 1024:
+        return f"{count} B"
+    elif count < 1024**2:
+        return f"{count/1024:.2f} KB"
+    else:
+        return f"{count/(1024**2):.2f} MB"
+
+
+class TrafficMonitor:
+    """Класс для мониторинга сетевого трафика"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.total_bytes_received = 0
+        self.total_bytes_sent = 0
+        self.url_traffic = {}
+        self.profile_stats = {}
+
+    def add_traffic(self, url, bytes_received, bytes_sent):
+        with self.lock:
+            self.total_bytes_received += bytes_received
+            self.total_bytes_sent += bytes_sent
+            if url in self.url_traffic:
+                self.url_traffic[url]["received"] += bytes_received
+                self.url_traffic[url]["sent"] += bytes_sent
+            else:
+                self.url_traffic[url] = {
+                    "received": bytes_received, "sent": bytes_sent}
+            self._log_traffic(url)
+
+    def _log_traffic(self, url):
+        received = self.url_traffic[url]["received"]
+        sent = self.url_traffic[url]["sent"]
+        total = received + sent
+        logger.info(
+            f"[Traffic] {url}: received {format_bytes(received)}, sent {format_bytes(sent)}, total {format_bytes(total)}")
+
+    def add_page_load(self, url, bytes_received, seconds, profile, requests_count=0):
+        """Загрузка страницы товара: трафик, число запросов и время до появления цены по профилю"""
+        with self.lock:
+            stat = self.profile_stats.setdefault(profile, {"pages": 0, "bytes": 0, "seconds": 0.0})
+            stat["pages"] += 1
+            stat["bytes"] += bytes_received
+            stat["seconds"] += seconds
+        logger.info(
+            f"[Load] {url}: profile {profile}, {format_bytes(bytes_received)}, "
+            f"{requests_count} requests, {seconds:.2f} s")
+        self.add_traffic(url, bytes_received, 0)
+
+    def get_profile_summary(self):
+        """Средний трафик и время загрузки страницы по профилям (для сравнения full и light)"""
+        with self.lock:
+            parts = [
+                f"{profile}: {stat['pages']} pages, avg {format_bytes(stat['bytes'] // stat['pages'])}, "
+                f"{stat['seconds'] / stat['pages']:.2f} s"
+                for profile, stat in self.profile_stats.items() if stat["pages"]
+            ]
+        return "; ".join(parts) or "no pages"
+
+    def get_total_traffic(self):
+        with self.lock:
+            return format_bytes(self.total_bytes_received + self.total_bytes_sent)
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                "total_received": self.total_bytes_received,
+                "total_sent": self.total_bytes_sent,
+                "total": self.total_bytes_received + self.total_bytes_sent,
+                "url_details": self.url_traffic,
+                "profiles": self.profile_stats
+            }
+
+
+# Global traffic monitor instance
+traffic_monitor = TrafficMonitor()
+
+
+class ProxyManager:
+    """Управление прокси и User-Agent"""
+
+    def __init__(self, config, proxies_file="proxies.txt"):
+        self.config = config
+        self.lock = threading.Lock()
+        self.proxies: List[Tuple[str, Optional[Dict[str, str]]]] = []
+        self.index = 0
+        self.ua = UserAgent(platforms=['desktop'], browsers=['chrome', 'firefox', 'edge'])
+        self._load_proxies(proxies_file)
+
+    def _load_proxies(self, path):
+        if not os.path.isfile(path):
+            logger.warning(f"{path} not found, using direct connection.")
+            self.proxies = [("direct", None)]
+            return
+
+        with open(path, 'r') as f:
+            lines = [ln.strip() for ln in f if ln.strip()]
+
+        for raw in lines:
+            try:
+                proxy_str = raw
+                # Добавляем схему по умолчанию, если отсутствует
+                if '://' not in proxy_str:
+                    proxy_str = 'http://' + proxy_str
+                parsed = urlparse(proxy_str)
+
+                # Фильтрация неподдерживаемых схем
+                if parsed.scheme not in self.config.SUPPORTED_SCHEMES:
+                    logger.warning(
+                        f"Skip unsupported scheme {parsed.scheme} in {proxy_str}")
+                    continue
+
+                host = parsed.hostname
+                port = parsed.port
+                if not host or not port:
+                    logger.warning(f"Invalid proxy address: {proxy_str}")
+                    continue
+
+                # Учётные данные при наличии
+                cred = None
+                if parsed.username and parsed.password:
+                    cred = {
+                        'username': parsed.username,
+                        'password': parsed.password
+                    }
+
+                server = f"{parsed.scheme}://{host}:{port}"
+
+                # Быстрая проверка прокси
+                if self._check_proxy_simple(server, cred):
+                    self.proxies.append((server, cred))
+                    logger.info(f"Added proxy: {server}")
+
+                # Ограничиваем пул прокси
+                if len(self.proxies) >= self.config.MAX_PROXIES:
+                    break
+
+            except Exception as e:
+                logger.warning(f"Error parsing proxy '{raw}': {e}")
+
+        if not self.proxies:
+            # Всегда есть опция прямого соединения
+            self.proxies = [("direct", None)]
+            logger.warning("No valid proxies found, using direct connection.")
+        else:
+            logger.info(f"Loaded proxies: {[p[0] for p in self.proxies]}")
+
+    def _check_proxy_simple(self, server, credentials):
+        proxies = {"http": server, "https": server}
+        auth = None
+        if credentials:
+            auth = HTTPProxyAuth(
+                credentials['username'], credentials['password'])
+        try:
+            resp = requests.get(
+                self.config.HTTPBIN_URL, proxies=proxies, auth=auth, timeout=self.config.TIMEOUT)
+            # log traffic from proxy check
+            traffic_monitor.add_traffic('proxy_check', len(resp.content), 0)
+            return resp.ok
+        except Exception:
+            return False
+
+    def get_proxy(self):
+        with self.lock:
+            if not self.proxies:
+                return ("direct", None)
+            proxy = self.proxies[self.index]
+            self.index = (self.index + 1) % len(self.proxies)
+            logger.debug(f"Using proxy: {proxy[0]}")
+            return proxy
+
+    def get_random_user_agent(self):
+        try:
+            return self.ua.random if self.ua else random.choice(self.config.STATIC_USER_AGENTS)
+        except Exception:
+            return random.choice(self.config.STATIC_USER_AGENTS)
+
+
+class Parser:
+    """
+    Базовый парсер страниц Ozon. Страница читается из браузера один раз
+    (driver.page_source), по этому тексту проверяется блокировка и
+    извлекается цена. Подклассы задают setup_driver, handle_block и
+    rotate_identity; warm_up и simulate_human_behavior - по желанию.
+    setup_driver подкласса вызывает apply_load_profile(options) до запуска
+    браузера и enable_load_profile(driver) после.
+    """
+
+    # True - parse_price возвращает только цифры цены ("1234"), иначе текст со страницы ("1 234 ₽")
+    DIGITS_ONLY = False
+
+    def __init__(self, proxy_manager: ProxyManager, config, traffic: Optional[TrafficMonitor] = None):
+        self.proxy_manager = proxy_manager
+        self.config = config
+        self.traffic_monitor = traffic or traffic_monitor
+        self.load_profile_name, self.load_profile = resolve_load_profile(config)
+        # Кортеж (server, credentials)
+        self.proxy_info = self.proxy_manager.get_proxy()
+        self.user_agent = self.proxy_manager.get_random_user_agent()
+        self.driver = None
+        self.anti_bot_counter = 0  # Счетчик встреч с анти-ботом
+        self.pages_loaded = 0  # Страниц загружено (для DriverPool)
+        self.heap_baseline_mb = 0.0
+
+        try:
+            self.start_driver()
+        except Exception as e:
+            logger.error(f"Ошибка инициализации драйвера: {e}")
+            if self.driver:
+                self.driver.quit()
+            self.driver = None
+            raise
+
+    def setup_driver(self):
+        raise NotImplementedError
+
+    def start_driver(self):
+        """
+        Запуск нового браузера с прогревом. Счётчики для DriverPool относятся к
+        текущему браузеру, поэтому сбрасываются: после смены идентификации пул
+        не должен перезапускать только что запущенный браузер.
+        """
+        self.driver = self.setup_driver()
+        self.warm_up()
+        self.pages_loaded = 0
+        self.heap_baseline_mb = self.heap_mb()
+
+    def apply_load_profile(self, options):
+        """Стратегия загрузки страницы профиля (ChromeOptions до запуска браузера)"""
+        options.page_load_strategy = self.load_profile["page_load_strategy"]
+
+    def enable_load_profile(self, driver):
+        """Блокировка запросов профиля в запущенном браузере"""
+        blocked_urls = self.load_profile["blocked_urls"]
+        if not blocked_urls:
+            return
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked_urls})
+        except Exception as e:
+            logger.warning(f"Не удалось включить блокировку запросов профиля {self.load_profile_name}: {e}")
+
+    def page_transfer(self, page_source: str) -> Tuple[int, int]:
+        """Трафик страницы по Resource Timing и число запросов; при ошибке - размер HTML"""
+        try:
+            transferred, count = self.driver.execute_script(PAGE_TRANSFER_JS)
+            if transferred:
+                return int(transferred), int(count)
+        except Exception as e:
+            logger.debug(f"Resource Timing недоступен: {e}")
+        return len(page_source.encode('utf-8')), 1
+
+    def warm_up(self):
+        pass
+
+    def simulate_human_behavior(self):
+        pass
+
+    def handle_block(self):
+        raise NotImplementedError
+
+    def rotate_identity(self):
+        raise NotImplementedError
+
+    def quit(self):
+        try:
+            if self.driver:
+                self.driver.quit()
+                self.driver = None
+                logger.info("Драйвер закрыт")
+        except Exception as e:
+            logger.warning(f"Ошибка при закрытии драйвера: {e}")
+
+    def is_alive(self) -> bool:
+        """Браузер отвечает на команды"""
+        if not self.driver:
+            return False
+        try:
+            self.driver.execute_script("return 1;")
+            return True
+        except Exception:
+            return False
+
+    def heap_mb(self) -> float:
+        """Занятая JS-куча текущей вкладки, МБ (0, если браузер не сообщает)"""
+        try:
+            return (self.driver.execute_script(JS_HEAP_JS) or 0) / 1024**2
+        except Exception:
+            return 0.0
+
+    def load_page(self, url: str) -> str:
+        """Открывает страницу, ждёт виджет цены и возвращает page_source (один раз за попытку)"""
+        logger.info(f"Загрузка URL: {url}")
+        started = time.perf_counter()
+        self.pages_loaded += 1
+        self.driver.get(url)
+
+        # Страница блокировки виджета не содержит, тогда просто истекает ожидание
+        try:
+            WebDriverWait(self.driver, self.config.PRICE_WAIT_TIMEOUT).until(
+                EC.presence_of_element_located((By.CSS_SELECTOR, ", ".join(self.config.PRICE_SELECTORS))))
+        except TimeoutException:
+            pass
+        load_seconds = time.perf_counter() - started
+
+        time.sleep(random.uniform(*self.config.REQUEST_DELAY))
+        self.simulate_human_behavior()
+
+        page_source = self.driver.page_source
+        bytes_received, requests_count = self.page_transfer(page_source)
+        self.traffic_monitor.add_page_load(url, bytes_received, load_seconds, self.load_profile_name, requests_count)
+        return page_source
+
+    def parse_price(self, url: str) -> str | None:
+        if not self.driver:
+            try:
+                self.start_driver()
+            except Exception as e:
+                logger.error(f"Не удалось инициализировать драйвер: {e}")
+                return None
+
+        retries = 0
+        while retries < self.config.MAX_RETRIES:
+            try:
+                page_source = self.load_page(url)
+
+                if self.is_blocked(page_source):
+                    self.handle_block()
+                    retries += 1
+                    continue
+
+                price = self.extract_price(page_source)
+                if price:
+                    return price
+
+                retries += 1
+                self.rotate_identity()
+            except Exception as e:
+                logger.error(f"Ошибка при парсинге {url}: {e}")
+                retries += 1
+                self.rotate_identity()
+
+        logger.error(f"Не удалось извлечь цену: {url}")
+        return None
+
+    def extract_price(self, page_source: Optional[str] = None) -> str | None:
+        """Извлечение цены из HTML страницы (каскад стратегий price_extraction.py)"""
+        if page_source is None:
+            if not self.driver:
+                logger.error("Драйвер не инициализирован")
+                return None
+            page_source = self.driver.page_source
+
+        price, strategy = extract_price_from_html(page_source)
+        if not price:
+            return None
+        if self.DIGITS_ONLY:
+            price = normalize_price(price)
+        logger.info(f"Найдена цена ({strategy}): {price}")
+        return price
+
+    def is_blocked(self, page_source: Optional[str] = None) -> bool:
+        """Проверяет, не открылась ли страница блокировки или проверки на робота"""
+        if page_source is None:
+            if not self.driver:
+                return False
+            try:
+                page_source = self.driver.page_source
+            except Exception as e:
+                logger.warning(f"Ошибка при проверке блокировки: {e}")
+                return False
+
+        if is_blocked_html(page_source):
+            logger.warning("Обнаружена страница блокировки")
+            return True
+        return False
+
+
+class DriverPool:
+    """
+    Ограниченный пул парсеров (браузеров), которые выдаются на один URL и
+    возвращаются обратно, вместо запуска Chrome и warm_up для каждого потока
+    или файла. Пул живёт в памяти процесса: браузеры переиспользуются только
+    в пределах одного запуска скрипта. Перед выдачей браузер проверяется (is_alive); после max_pages
+    страниц или роста JS-кучи больше max_heap_growth_mb браузер закрывается
+    и при следующей выдаче создаётся новый. Ошибка WebDriver внутри session()
+    тоже закрывает браузер; прочие исключения (API, разбор данных) браузер
+    не трогают - он возвращается в пул.
+
+        pool = DriverPool(lambda: Parser(proxy_manager), size=3)
+        with pool.session() as parser:
+            price = parser.parse_price(url)
+        pool.close()
+
+    lazy_session() выдаёт LazyLease: браузер берётся из пула только при первом
+    parse_price, поэтому товар с ценой из API или кэша браузер не занимает.
+    """
+
+    def __init__(self, factory: Callable[[], "Parser"], size: int = 1, max_pages: int = 50,
+                 max_heap_growth_mb: float = 300.0, name: str = "pool"):
+        self.factory = factory
+        self.size = max(1, size)
+        self.max_pages = max_pages
+        self.max_heap_growth_mb = max_heap_growth_mb
+        self.name = name
+        self.lock = Lock()
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.idle: List[Parser] = []
+        self.closed = False
+        self.metrics = {
+            "created": 0, "startup_sec": 0.0, "startup_failed": 0, "leases": 0, "reused": 0,
+            "recycled_pages": 0, "recycled_memory": 0, "recycled_health": 0, "discarded_errors": 0,
+        }
+
+    def _count(self, key: str, value=1):
+        with self.lock:
+            self.metrics[key] += value
+
+    def _create(self) -> "Parser":
+        started = time.perf_counter()
+        try:
+            parser = self.factory()
+        except Exception:
+            self._count("startup_failed")
+            raise
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.metrics["created"] += 1
+            self.metrics["startup_sec"] += elapsed
+        logger.info(f"[{self.name}] Запущен браузер за {elapsed:.1f} сек.")
+        return parser
+
+    def _retire(self, parser: "Parser", reason: str):
+        self._count(reason)
+        logger.info(f"[{self.name}] Браузер закрыт ({reason}, страниц {parser.pages_loaded})")
+        parser.quit()
+
+    def lease(self, timeout: Optional[float] = None) -> "Parser":
+        """Свободный проверенный парсер или новый, если свободных нет и пул не заполнен"""
+        if self.closed:
+            raise RuntimeError(f"{self.name}: пул закрыт")
+        if not self.slots.acquire(timeout=timeout):
+            raise TimeoutError(f"{self.name}: нет свободного браузера за {timeout} сек.")
+        try:
+            while True:
+                with self.lock:
+                    parser = self.idle.pop() if self.idle else None
+                if parser is None:
+                    parser = self._create()
+                    self._count("leases")
+                    return parser
+                if parser.is_alive():
+                    self._count("leases")
+                    self._count("reused")
+                    return parser
+                self._retire(parser, "recycled_health")
+        except Exception:
+            self.slots.release()
+            raise
+
+    def release(self, parser: "Parser", failed: bool = False):
+        """Возврат парсера в пул; исчерпавший лимиты или сломанный браузер закрывается"""
+        try:
+            if failed or not parser.driver:
+                self._retire(parser, "discarded_errors")
+            elif self.closed:
+                parser.quit()
+            elif self.max_pages and parser.pages_loaded >= self.max_pages:
+                self._retire(parser, "recycled_pages")
+            elif self.max_heap_growth_mb and parser.heap_mb() - parser.heap_baseline_mb > self.max_heap_growth_mb:
+                self._retire(parser, "recycled_memory")
+            else:
+                with self.lock:
+                    self.idle.append(parser)
+        finally:
+            self.slots.release()
+
+    @contextmanager
+    def session(self, timeout: Optional[float] = None):
+        parser = self.lease(timeout)
+        failed = False
+        try:
+            yield parser
+        except WebDriverException:
+            failed = True
+            raise
+        finally:
+            self.release(parser, failed)
+
+    @contextmanager
+    def lazy_session(self, timeout: Optional[float] = None):
+        lease = LazyLease(self, timeout)
+        failed = False
+        try:
+            yield lease
+        except WebDriverException:
+            failed = True
+            raise
+        finally:
+            if lease.parser is not None:
+                self.release(lease.parser, failed)
+
+    def stats(self) -> Dict:
+        with self.lock:
+            metrics = dict(self.metrics)
+        metrics["startup_avg_sec"] = round(metrics["startup_sec"] / metrics["created"], 2) if metrics["created"] else 0.0
+        metrics["reuse_rate"] = round(metrics["reused"] / metrics["leases"], 3) if metrics["leases"] else 0.0
+        return metrics
+
+    def log_stats(self):
+        m = self.stats()
+        logger.info(
+            f"[{self.name}] Браузеров запущено {m['created']} (ошибок запуска {m['startup_failed']}), "
+            f"запуск в среднем {m['startup_avg_sec']:.1f} сек., всего {m['startup_sec']:.1f} сек.; "
+            f"выдач {m['leases']}, повторных {m['reused']} ({m['reuse_rate']:.0%}); "
+            f"закрыто: по числу страниц {m['recycled_pages']}, по памяти {m['recycled_memory']}, "
+            f"не отвечали {m['recycled_health']}, после ошибок {m['discarded_errors']}"
+        )
+
+    def close(self):
+        """Закрывает свободные браузеры; занятые закроются при возврате"""
+        self.closed = True
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for parser in idle:
+            parser.quit()
+        self.log_stats()
+
+
+class LazyLease:
+    """
+    Парсер из пула, который берётся при первом parse_price (DriverPool.lazy_session).
+    used - страница загружалась браузером; по нему решается, нужна ли пауза
+    между товарами.
+    """
+
+    def __init__(self, pool: DriverPool, timeout: Optional[float] = None):
+        self.pool = pool
+        self.timeout = timeout
+        self.parser: Optional[Parser] = None
+
+    @property
+    def used(self) -> bool:
+        return self.parser is not None
+
+    def parse_price(self, url: str) -> Optional[str]:
+        if self.parser is None:
+            self.parser = self.pool.lease(self.timeout)
+        return self.parser.parse_price(url)
@@ -1,7 +1,5 @@
-import pandas as pd
 import random
 import time
-import re
 from queue import Queue
 from threading import Thread, Lock
 from loguru import logger
@@ -9,78 +7,18 @@ from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
-import requests
-from requests.auth import HTTPProxyAuth
 import zipfile
-import threading
 import os
 import sys
-from typing import List, Tuple, Dict, Optional
 from urllib.parse import urlparse
-from fake_useragent import UserAgent
 import undetected_chromedriver as uc
-
-# Traffic monitoring class
-
-
-class TrafficMonitor:
-    """Класс для мониторинга сетевого трафика"""
-
-    def __init__(self):
-        self.lock = Lock()
-        self.total_bytes_received = 0
-        self.total_bytes_sent = 0
-        self.url_traffic = {}
-
-    def add_traffic(self, url, bytes_received, bytes_sent):
-        with self.lock:
-            self.total_bytes_received += bytes_received
-            self.total_bytes_sent += bytes_sent
-            if url in self.url_traffic:
-                self.url_traffic[url]["received"] += bytes_received
-                self.url_traffic[url]["sent"] += bytes_sent
-            else:
-                self.url_traffic[url] = {
-                    "received": bytes_received, "sent": bytes_sent}
-            self._log_traffic(url)
-
-    def _log_traffic(self, url):
-        received = self.url_traffic[url]["received"]
-        sent = self.url_traffic[url]["sent"]
-        total = received + sent
-
-        def format_bytes(count):
-            if count < 1024:
-                return f"{count} B"
-            elif count < 1024**2:
-                return f"{count/1024:.2f} KB"
-            else:
-                return f"{count/(1024**2):.2f} MB"
-        logger.info(
-            f"[Traffic] {url}: received {format_bytes(received)}, sent {format_bytes(sent)}, total {format_bytes(total)}")
-
-    def get_total_traffic(self):
-        with self.lock:
-            total = self.total_bytes_received + self.total_bytes_sent
-            if total < 1024:
-                return f"{total} B"
-            elif total < 1024**2:
-                return f"{total/1024:.2f} KB"
-            else:
-                return f"{total/(1024**2):.2f} MB"
-
-    def get_stats(self):
-        with self.lock:
-            return {
-                "total_received": self.total_bytes_received,
-                "total_sent": self.total_bytes_sent,
-                "total": self.total_bytes_received + self.total_bytes_sent,
-                "url_details": self.url_traffic
-            }
-
-
-# Global traffic monitor instance
-traffic_monitor = TrafficMonitor()
+from table_store import read_table, write_table, table_exists
+from state_store import open_store, to_float
+from card_price_resolver import CardPriceResolver
+from scrape_cache import ScrapeCache, open_cache
+from price_extraction import normalize_price
+from ozon_scraper import DriverPool, ProxyManager, traffic_monitor
+from ozon_scraper import Parser as BaseParser
 
 
 class Config:
@@ -90,10 +28,33 @@ class Config:
     PROXY_CHANGE_DELAY = 1  # Увеличенное время ожидания после смены прокси
     MAX_RETRIES = 2  # Больше попыток для надежности
     TIMEOUT = 2  # Таймаут для запросов
+    PRICE_WAIT_TIMEOUT = 5  # Ожидание виджета цены на странице товара
+    # Профиль загрузки страницы (ozon_scraper.LOAD_PROFILES): light - без картинок,
+    # шрифтов, видео и счётчиков, eager-загрузка; full - страница целиком
+    LOAD_PROFILE = "light"
+    # Пул браузеров (ozon_scraper.DriverPool): браузер перезапускается после
+    # POOL_MAX_PAGES страниц или роста JS-кучи больше POOL_MAX_HEAP_GROWTH_MB
+    POOL_MAX_PAGES = 50
+    POOL_MAX_HEAP_GROWTH_MB = 300
+    # Цена по карте сначала из marketing_price Seller API (card_price_resolver.py),
+    # браузером парсятся только товары без цены в API или с расхождением больше допуска, %
+    CARD_PRICE_API_FIRST = True
+    CARD_PRICE_API_TOLERANCE = 1.0
+    # Кэш спарсенных цен (scrape_cache.py), общий с update_price.py: запись действует
+    # SCRAPE_CACHE_TTL секунд, сверх SCRAPE_CACHE_MAX_ENTRIES вытесняются давно не использованные
+    SCRAPE_CACHE = True
+    SCRAPE_CACHE_PATH = "data/scrape_cache.sqlite3"
+    SCRAPE_CACHE_TTL = 3 * 60 * 60
+    SCRAPE_CACHE_MAX_ENTRIES = 50000
     # URL для проверки работоспособности прокси
     HTTPBIN_URL = "https://httpbin.org/ip"
     # Поддерживаемые схемы прокси
     SUPPORTED_SCHEMES = ("http", "https")
+    # Результаты всегда пишутся в Parquet, xlsx - дополнительно для просмотра
+    SAVE_EXCEL = True
+    # Цены по карте дополнительно пишутся в хранилище состояния (state_store.py)
+    STATE_STORE = True
+    STATE_DB_PATH = "data/state.sqlite3"
 
     # Расширенный список User-Agent
     STATIC_USER_AGENTS = [
@@ -105,139 +66,18 @@ class Config:
         "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/113.0.0.0 Safari/537.36 Edg/113.0.1774.57"
     ]
 
-    # Известные селекторы для цен на Ozon
+    # Известные селекторы для цен на Ozon (ожидание загрузки цены)
+    # Регулярные выражения для поиска цены - price_extraction.PRICE_PATTERNS
     PRICE_SELECTORS = [
 
         "div[data-widget='webPrice'] button span"
 
     ]
-    
-
-    PRICE_PATTERNS = [
-        r'(\d+[\s.]?\d+)\s*[₽]',
-        r'[\D](\d{1,3}(?:\s?\d{3})*(?:[.,]\d+)?)\s*[₽]',
-        r'"price"\s*:\s*"([\d\s]+)\s*₽"',
-        r'finalPrice":"([\d\s]+)\s*₽'
-    ]
-
-
-class ProxyManager:
-    def __init__(self, proxies_file="proxies.txt"):
-        self.lock = threading.Lock()
-        self.proxies: List[Tuple[str, Optional[Dict[str, str]]]] = []
-        self.index = 0
-        self.ua = UserAgent(platforms=['desktop'], browsers=['chrome', 'firefox', 'edge'])
-        self._load_proxies(proxies_file)
-
-    def _load_proxies(self, path):
-        if not os.path.isfile(path):
-            logger.warning(f"{path} not found, using direct connection.")
-            self.proxies = [("direct", None)]
-            return
-
-        with open(path, 'r') as f:
-            lines = [ln.strip() for ln in f if ln.strip()]
-
-        for raw in lines:
-            try:
-                proxy_str = raw
-                # Добавляем схему по умолчанию, если отсутствует
-                if '://' not in proxy_str:
-                    proxy_str = 'http://' + proxy_str
-                parsed = urlparse(proxy_str)
-
-                # Фильтрация неподдерживаемых схем
-                if parsed.scheme not in Config.SUPPORTED_SCHEMES:
-                    logger.warning(
-                        f"Skip unsupported scheme {parsed.scheme} in {proxy_str}")
-                    continue
-
-                host = parsed.hostname
-                port = parsed.port
-                if not host or not port:
-                    logger.warning(f"Invalid proxy address: {proxy_str}")
-                    continue
-
-                # Учётные данные при наличии
-                cred = None
-                if parsed.username and parsed.password:
-                    cred = {
-                        'username': parsed.username,
-                        'password': parsed.password
-                    }
-
-                server = f"{parsed.scheme}://{host}:{port}"
-
-                # Быстрая проверка прокси
-                if self._check_proxy_simple(server, cred):
-                    self.proxies.append((server, cred))
-                    logger.info(f"Added proxy: {server}")
 
-                # Ограничиваем пул прокси
-                if len(self.proxies) >= Config.MAX_PROXIES:
-                    break
 
-            except Exception as e:
-                logger.warning(f"Error parsing proxy '{raw}': {e}")
-
-        if not self.proxies:
-            # Всегда есть опция прямого соединения
-            self.proxies = [("direct", None)]
-            logger.warning("No valid proxies found, using direct connection.")
-        else:
-            logger.info(f"Loaded proxies: {[p[0] for p in self.proxies]}")
-
-    def _check_proxy_simple(self, server, credentials):
-        proxies = {"http": server, "https": server}
-        auth = None
-        if credentials:
-            auth = HTTPProxyAuth(
-                credentials['username'], credentials['password'])
-        try:
-            resp = requests.get(
-                Config.HTTPBIN_URL, proxies=proxies, auth=auth, timeout=Config.TIMEOUT)
-            # log traffic from proxy check
-            traffic_monitor.add_traffic('proxy_check', len(resp.content), 0)
-            return resp.ok
-        except Exception:
-            return False
-
-    def get_proxy(self):
-        with self.lock:
-            if not self.proxies:
-                return ("direct", None)
-            proxy = self.proxies[self.index]
-            self.index = (self.index + 1) % len(self.proxies)
-            logger.debug(f"Using proxy: {proxy[0]}")
-            return proxy
-
-    def get_random_user_agent(self):
-        try:
-            return self.ua.random if self.ua else random.choice(Config.STATIC_USER_AGENTS)
-        except:
-            return random.choice(Config.STATIC_USER_AGENTS)
-
-
-class Parser:
+class Parser(BaseParser):
     def __init__(self, proxy_manager: ProxyManager):
-        self.proxy_manager = proxy_manager
-        # Теперь это кортеж (server, credentials)
-        self.proxy_info = self.proxy_manager.get_proxy()
-        self.user_agent = self.proxy_manager.get_random_user_agent()
-        self.driver = None
-        self.anti_bot_counter = 0  # Счетчик встреч с анти-ботом
-
-        # Попытка инициализации драйвера
-        try:
-            self.driver = self.setup_driver()
-            # Предварительный прогрев браузера
-            self.warm_up()
-        except Exception as e:
-            logger.error(f"Ошибка инициализации драйвера: {e}")
-            if self.driver:
-                self.driver.quit()
-            self.driver = None
-            raise
+        super().__init__(proxy_manager, Config)
 
     def setup_driver(self):
         """Настройка и запуск Selenium с undetected_chromedriver для обхода защиты"""
@@ -334,6 +174,9 @@ class Parser:
                 # Для прокси без аутентификации используем стандартный способ
                 options.add_argument(f'--proxy-server={proxy_server}')
 
+        # Профиль загрузки страницы (Config.LOAD_PROFILE)
+        self.apply_load_profile(options)
+
         # Создаем undetected_chromedriver
         try:
             driver = uc.Chrome(
@@ -345,6 +188,7 @@ class Parser:
             # Устанавливаем таймаут загрузки страницы и скриптов
             driver.set_page_load_timeout(Config.TIMEOUT)
             driver.set_script_timeout(Config.TIMEOUT)
+            self.enable_load_profile(driver)
 
             # Добавляем дополнительные скрипты для обхода обнаружения автоматизации
             stealth_js = """
@@ -570,109 +414,6 @@ class Parser:
         except Exception as e:
             logger.warning(f"Ошибка при выполнении скрипта: {e}")
 
-    def parse_price(self, url: str) -> str | None:
-        if not self.driver:
-            try:
-                self.driver = self.setup_driver()
-                self.warm_up()
-            except Exception as e:
-                logger.error(f"Не удалось инициализировать драйвер: {e}")
-                return None
-
-        retries = 0
-        while retries < Config.MAX_RETRIES:
-            try:
-                logger.info(f"Загрузка URL: {url}")
-                self.driver.get(url)
-                time.sleep(random.uniform(*Config.REQUEST_DELAY))
-                
-                if self.driver:
-                    page_source = self.driver.page_source
-                    bytes_rcv = len(page_source.encode('utf-8'))
-                    traffic_monitor.add_traffic(url, bytes_rcv, 0)
-                    self.simulate_human_behavior()
-                    
-                    if self.is_blocked():
-                        self.handle_block()
-                        retries += 1
-                        continue
-
-                    price = self.extract_price()
-                    if price:
-                        return price
-
-                retries += 1
-                self.rotate_identity()
-            except Exception as e:
-                logger.error(f"Ошибка при парсинге {url}: {e}")
-                retries += 1
-                self.rotate_identity()
-
-        logger.error(f"Не удалось извлечь цену: {url}")
-        return None
-
-    def extract_price(self) -> str | None:
-        if not self.driver:
-            logger.error("Драйвер не инициализирован")
-            return None
-        
-        """Извлечение цены со страницы различными методами"""
-        # Метод 1: Проверка всех селекторов
-        for selector in Config.PRICE_SELECTORS:
-            try:
-                # Ищем элемент с ожиданием
-                wait = WebDriverWait(self.driver, 5)
-                price_element = wait.until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, selector)))
-                price_text = price_element.text.strip()
-
-                # Проверяем, что текст похож на цену
-                if '₽' in price_text or 'руб' in price_text:
-                    logger.info(
-                        f"Найдена цена по селектору {selector}: {price_text}")
-                    return price_text
-            except:
-                continue
-
-        # Метод 2: Поиск по регулярным выражениям в HTML
-        page_source = self.driver.page_source
-
-        for pattern in Config.PRICE_PATTERNS:
-            matches = re.findall(pattern, page_source)
-            if matches:
-                price = matches[0] + " ₽"
-                logger.info(f"Найдена цена по регулярному выражению: {price}")
-                return price
-
-        # Метод 3: Использование JavaScript для извлечения цены
-        try:
-            price_js = self.driver.execute_script("""
-                // Найдем все элементы, которые могут содержать цену
-                const priceElements = document.querySelectorAll('span, div');
-                
-                // Регулярное выражение для поиска цены
-                const priceRegex = /(\\d+[\\s.]?\\d*)[\\s₽]+/;
-                
-                // Проходим по всем элементам
-                for (const el of priceElements) {
-                    if (el.innerText && 
-                        (el.innerText.includes('₽') || el.innerText.includes('руб')) && 
-                        priceRegex.test(el.innerText)) {
-                        return el.innerText.trim();
-                    }
-                }
-                
-                return null;
-            """)
-
-            if price_js:
-                logger.info(f"Найдена цена с помощью JavaScript: {price_js}")
-                return price_js
-        except:
-            pass
-
-        return None
-
     def save_page_source(self, url):
         if not self.driver:
             return
@@ -701,55 +442,6 @@ class Parser:
         except Exception as e:
             logger.warning(f"Ошибка при сохранении страницы: {e}")
 
-    def is_blocked(self) -> bool:
-        if not self.driver:
-            return False
-        """Проверяет наличие страницы блокировки"""
-        try:
-            # Проверка на различные формы блокировки
-            blocks = [
-                # Общая форма блокировки
-                "//div[contains(@class, 'fab-chlg')]",
-                # Текст капчи
-                "//div[contains(text(), 'Подтвердите, что вы не робот')]",
-                # Сообщение об ограничении
-                "//span[contains(text(), 'Доступ ограничен')]",
-                # Контейнер безопасности
-                "//div[contains(@class, 'security-container')]",
-                "//iframe[contains(@src, 'captcha')]",  # iFrame с капчей
-                "//div[contains(@class, 'captcha')]"  # Элемент капчи
-            ]
-
-            for xpath in blocks:
-                try:
-                    element = self.driver.find_element(By.XPATH, xpath)
-                    if element.is_displayed():
-                        logger.warning(f"Обнаружена блокировка: {xpath}")
-                        return True
-                except:
-                    continue
-
-            # Дополнительная проверка через JavaScript
-            is_blocked_js = self.driver.execute_script("""
-                return document.body.innerText.includes('робот') || 
-                       document.body.innerText.includes('captcha') ||
-                       document.body.innerText.includes('капча') ||
-                       document.body.innerText.includes('Доступ ограничен') ||
-                       document.body.innerText.includes('безопасность') ||
-                       document.body.innerText.includes('Подтвердите');
-            """)
-
-            if is_blocked_js:
-                logger.warning(
-                    "Обнаружена блокировка через JavaScript проверку")
-                return True
-
-            return False
-
-        except Exception as e:
-            logger.warning(f"Ошибка при проверке блокировки: {e}")
-            return False
-
     def handle_block(self):
         if not self.driver:
             return
@@ -859,11 +551,8 @@ class Parser:
             # Ждем перед новым подключением
             time.sleep(Config.PROXY_CHANGE_DELAY)
 
-            # Создаем новый драйвер
-            self.driver = self.setup_driver()
-
-            # Прогреваем браузер
-            self.warm_up()
+            # Создаем и прогреваем новый драйвер (счётчики пула - с нуля)
+            self.start_driver()
 
             logger.success(
                 f"Идентификация успешно изменена на {self.proxy_info[0]}")
@@ -876,28 +565,44 @@ class Parser:
 
 
 class ThreadManager:
-    def __init__(self, urls: list, proxy_manager: ProxyManager):
+    def __init__(self, urls: list, proxy_manager: ProxyManager, pool: DriverPool = None,
+                 cache: ScrapeCache = None):
         self.url_queue = Queue()
         for url in urls:
             self.url_queue.put(url)
         self.proxy_manager = proxy_manager
+        # Браузеры берутся из пула на каждый URL; свой пул закрывается в конце start()
+        self.pool = pool
+        self.own_pool = pool is None
+        # Кэш спарсенных цен проверяется до того, как из пула берётся браузер
+        self.cache = cache
+        self.cached_urls = set()
         self.results = {}
         self.lock = Lock()
         self.failed_urls = []  # Добавляем список для неудачных URL
 
     def worker(self):
-        parser = None
         while not self.url_queue.empty():
+            scraped = False
             try:
                 url = self.url_queue.get()
 
-                # Создаем новый парсер, если нет или драйвер не инициализирован
-                if not parser or not parser.driver:
-                    parser = Parser(self.proxy_manager)
-
-                # Парсим цену
-                logger.info(f"Обработка URL: {url}")
-                price = parser.parse_price(url)
+                cached = self.cache.get(url) if self.cache else None
+                if cached is not None:
+                    logger.info(f"Цена из кэша парсинга: {url}")
+                    price = f"{cached:.0f} ₽"
+                    with self.lock:
+                        self.cached_urls.add(url)
+                else:
+                    # Парсим цену браузером из пула (сломанный после ошибки пул закроет сам)
+                    logger.info(f"Обработка URL: {url}")
+                    scraped = True
+                    with self.pool.session() as parser:
+                        price = parser.parse_price(url)
+                    # В кэш - первое число найденного текста ("1 234 ₽ 10% скидка" -> 1234)
+                    normalized = normalize_price(price)
+                    if normalized and self.cache:
+                        self.cache.put(url, float(normalized), price)
 
                 # Сохраняем результат
                 with self.lock:
@@ -915,27 +620,14 @@ class ThreadManager:
                 with self.lock:
                     self.failed_urls.append(url)
 
-                # Безопасное завершение текущего парсера
-                if parser:
-                    try:
-                        parser.quit()
-                    except:
-                        pass
-
                 # Небольшая пауза перед повторной попыткой
                 time.sleep(Config.PROXY_CHANGE_DELAY)
 
-                # Перезапуск с новым парсером
-                parser = None
-
             finally:
                 self.url_queue.task_done()
-                # Делаем паузу между запросами
-                time.sleep(random.uniform(*Config.REQUEST_DELAY))
-
-        # Закрываем браузер после работы
-        if parser:
-            parser.quit()
+                # Делаем паузу между запросами (цена из кэша страницу не загружала)
+                if scraped:
+                    time.sleep(random.uniform(*Config.REQUEST_DELAY))
 
     def start(self):
         """Запуск потоков с учётом MAX_PROXIES и THREADS_PER_PROXY"""
@@ -946,6 +638,12 @@ class ThreadManager:
         # Защита от 0 потоков
         total_threads = max(1, total_threads)
 
+        if self.pool is None:
+            self.pool = DriverPool(
+                lambda: Parser(self.proxy_manager), size=total_threads, max_pages=Config.POOL_MAX_PAGES,
+                max_heap_growth_mb=Config.POOL_MAX_HEAP_GROWTH_MB, name="pars_link"
+            )
+
         logger.info(
             f"Запуск {total_threads} потоков для обработки {self.url_queue.qsize()} URL")
 
@@ -988,6 +686,69 @@ class ThreadManager:
             # Ожидание завершения повторных попыток
             self.url_queue.join()
 
+        if self.own_pool:
+            self.pool.close()
+        else:
+            self.pool.log_stats()
+
+
+def product_ids_by_url(df):
+    """Ozon Product ID по ссылке на товар"""
+    if "Ozon Product ID" not in df.columns:
+        return {}
+    return {str(url).strip(): ozon_id for url, ozon_id in zip(df["Ссылка на товар"], df["Ozon Product ID"])}
+
+
+def resolve_api_prices(ids_by_url, urls):
+    """
+    Цены по карте из Seller API для товаров из таблицы.
+    Возвращает (resolver, {url: цена из API}, url для парсинга браузером)
+    """
+    store = open_store(Config.STATE_DB_PATH) if Config.STATE_STORE else None
+    try:
+        resolver = CardPriceResolver(store=store, tolerance_pct=Config.CARD_PRICE_API_TOLERANCE)
+        resolver.prefetch(ids_by_url.values())
+    finally:
+        if store is not None:
+            store.close()
+
+    api_results = {}
+    to_scrape = []
+    for url in urls:
+        price = resolver.api_price(ids_by_url.get(url))
+        if price is None:
+            to_scrape.append(url)
+        else:
+            api_results[url] = f"{price:.0f} ₽"
+    logger.info(f"Цены из API: {len(api_results)}, на парсинг браузером: {len(to_scrape)}")
+    return resolver, api_results, to_scrape
+
+
+def save_card_prices(df, results):
+    """Сохранение полученных цен по карте в хранилище состояния"""
+    store = open_store(Config.STATE_DB_PATH)
+    if store is None:
+        return
+    try:
+        prices = []
+        for record in df.to_dict("records"):
+            url = str(record.get("Ссылка на товар") or "").strip()
+            if url in results:
+                prices.append({
+                    "url": url,
+                    "ozon_id": record.get("Ozon Product ID"),
+                    "sku": record.get("SKU"),
+                    # Первое число найденного текста: to_float склеил бы все цифры ("1 234 ₽ 10%")
+                    "price": to_float(normalize_price(results[url])),
+                    "raw": results[url],
+                })
+        saved = store.add_card_prices(prices)
+        logger.info(f"Цены по карте сохранены в хранилище состояния: {saved}")
+    except Exception as e:
+        logger.error(f"Ошибка сохранения в хранилище состояния: {e}")
+    finally:
+        store.close()
+
 
 def main():
     # Настройка логирования
@@ -1018,11 +779,11 @@ def main():
     try:
         input_filename = "in/1_1_product.xlsx"  # Единое имя файла
 
-        if not os.path.exists(input_filename):
+        if not table_exists(input_filename):
             logger.error(f"Файл '{input_filename}' не найден!")
             return
 
-        df = pd.read_excel(input_filename)
+        df = read_table(input_filename)
 
         # Проверка наличия нужной колонки
         if "Ссылка на товар" not in df.columns:
@@ -1057,7 +818,7 @@ def main():
 
     # Инициализация прокси-менеджера
     try:
-        proxy_manager = ProxyManager()
+        proxy_manager = ProxyManager(Config)
         if not proxy_manager.proxies:
             logger.error("Не удалось инициализировать прокси!")
             return
@@ -1065,24 +826,52 @@ def main():
         logger.error(f"Ошибка инициализации прокси: {e}")
         return
 
+    # Цены из API, браузером - только остальные
+    resolver = None
+    api_results = {}
+    urls_to_scrape = valid_urls
+    ids_by_url = product_ids_by_url(df)
+    if Config.CARD_PRICE_API_FIRST:
+        try:
+            resolver, api_results, urls_to_scrape = resolve_api_prices(ids_by_url, valid_urls)
+        except Exception as e:
+            logger.error(f"Ошибка получения цен из API, все товары будут спарсены: {e}")
+
+    cache = None
+    if Config.SCRAPE_CACHE:
+        cache = open_cache(Config.SCRAPE_CACHE_PATH, Config.SCRAPE_CACHE_TTL, Config.SCRAPE_CACHE_MAX_ENTRIES)
+
     # Запуск парсинга
     try:
-        thread_manager = ThreadManager(valid_urls, proxy_manager)
-        thread_manager.start()
+        thread_manager = ThreadManager(urls_to_scrape, proxy_manager, cache=cache)
+        if urls_to_scrape:
+            thread_manager.start()
     except Exception as e:
         logger.error(f"Ошибка запуска потоков: {e}")
+        if cache is not None:
+            cache.close()
         return
 
+    # Цены из кэша уже учтены в истории и в резолвере, когда были спарсены
+    scraped_results = {
+        url: price for url, price in thread_manager.results.items() if url not in thread_manager.cached_urls
+    }
+    if resolver is not None:
+        for url in urls_to_scrape:
+            if url not in thread_manager.cached_urls:
+                resolver.record_scrape(to_float(normalize_price(scraped_results.get(url))), ids_by_url.get(url))
+    results = {**api_results, **thread_manager.results}
+
     # Сохранение результатов
     try:
-        df["Цена по карте озон"] = df["Ссылка на товар"].map(thread_manager.results)
+        df["Цена по карте озон"] = df["Ссылка на товар"].map(results)
         df["Дата парсинга"] = time.strftime("%Y-%m-%d %H:%M:%S")
 
         output_file = f"out/result_price_{time.strftime('%Y%m%d_%H%M%S')}.xlsx"
-        df.to_excel(output_file, index=False)
+        output_file = write_table(df, output_file, excel=Config.SAVE_EXCEL)
 
         # Статистика
-        success_count = len(thread_manager.results)
+        success_count = len(results)
         failed_count = len(thread_manager.failed_urls)
         total_count = len(valid_urls)
         success_rate = (success_count / total_count) * \
@@ -1096,9 +885,19 @@ def main():
     
     except Exception as e:
         logger.error(f"Ошибка сохранения результатов: {e}")
+
+    # В историю цен по карте идут только спарсенные цены: по ним ищутся расхождения с API
+    if Config.STATE_STORE:
+        save_card_prices(df, scraped_results)
+    if resolver is not None:
+        resolver.log_summary()
+    if cache is not None:
+        cache.log_summary()
+        cache.close()
         
     # print total traffic
     logger.info(f"Total traffic used: {traffic_monitor.get_total_traffic()}")
+    logger.info(f"Page loads by profile: {traffic_monitor.get_profile_summary()}")
 
     logger.info("=" * 50)
     logger.info("Парсер завершил работу")
@@ -0,0 +1,251 @@
+# price_extraction.py
+
+"""
+Извлечение цены "С Ozon картой" из HTML страницы товара без браузера.
+
+Стратегии повторяют методы Parser.extract_price (pars_link.py, update_price.py),
+но работают по сохранённому page_source, поэтому их можно проверять и
+сравнивать на фикстурах (benchmarks/fixtures/html) и страницах из debug/:
+    web_price  - span внутри кнопки виджета div[data-widget='webPrice']
+    patterns   - регулярные выражения PRICE_PATTERNS в области товара
+    text_scan  - первый span/div области товара, текст которого содержит цену (аналог JS-поиска)
+
+Область товара (price_region) - от конца шапки страницы до первой полки
+рекомендаций или подвала: в шапке есть "Доставка от 99 ₽", в рекомендациях -
+цены чужих товаров, и без ограничения они находились раньше цены товара.
+"""
+
+import re
+from html.parser import HTMLParser
+from typing import Callable, Dict, List, Optional, Tuple
+
+PRICE_PATTERNS: List[str] = [
+    r'(\d+[\s.]?\d+)\s*[₽]',
+    r'[\D](\d{1,3}(?:\s?\d{3})*(?:[.,]\d+)?)\s*[₽]',
+    r'"price"\s*:\s*"([\d\s]+)\s*₽"',
+    r'finalPrice":"([\d\s]+)\s*₽'
+]
+PRICE_REGEXES = [re.compile(pattern) for pattern in PRICE_PATTERNS]
+
+# Все PRICE_PATTERNS одним выражением: группа цены каждого шаблона именованная
+# (price0, price1, ...), поиск идёт за один проход и останавливается на первом
+# совпадении в области товара. Все шаблоны заканчиваются знаком рубля, поэтому
+# выражение проверяется только в коротком окне перед каждым "₽" области (str.find)
+# по порядку, а не по всему HTML.
+PRICE_ANCHOR = "₽"
+ANCHOR_LOOKBEHIND = 64
+PRICE_GROUPS = [f"price{i}" for i in range(len(PRICE_PATTERNS))]
+COMBINED_PRICE_RE = re.compile("|".join(
+    re.sub(r"(?<!\\)\((?!\?)", f"(?P<{name}>", pattern, count=1)
+    for name, pattern in zip(PRICE_GROUPS, PRICE_PATTERNS)
+))
+
+# Границы области товара (str.find, page_source из Chrome в нижнем регистре):
+# после шапки, до первой полки рекомендаций или подвала
+PRICE_REGION_START = "</header"
+PRICE_REGION_END_MARKERS = (
+    "<footer",
+    'data-widget="skuShelf', "data-widget='skuShelf",
+    'data-widget="webFooter', "data-widget='webFooter",
+)
+
+# Признаки страницы блокировки/проверки (объединение проверок обоих парсеров)
+BLOCK_MARKERS = (
+    "Доступ ограничен",
+    "Подозрительная активность",
+    "Проверка безопасности",
+    "Подтвердите, что вы не робот",
+    "Please verify you are a human",
+    "Cloudflare",
+)
+BLOCK_PATTERNS = (
+    re.compile(r"<title>[^<]*Security check", re.IGNORECASE),
+    re.compile(r"<iframe[^>]+src=[\"'][^\"']*(?:challenge|captcha)", re.IGNORECASE),
+    re.compile(r"class=[\"'][^\"']*(?:fab-chlg|security-container)", re.IGNORECASE),
+)
+
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "link",
+    "meta", "param", "source", "track", "wbr",
+}
+
+WEB_PRICE_MARKER = re.compile(r"""data-widget=["']webPrice["']""")
+PRICE_TEXT_RE = re.compile(r"(\d+[\s.]?\d*)[\s₽]+")
+PRICE_NUMBER_RE = re.compile(r"\d[\d    ]*(?:[.,]\d+)?")
+DECIMAL_SEPARATOR_RE = re.compile(r"[.,]")
+NON_DIGITS_RE = re.compile(r"\D")
+
+
+def price_region(html: str) -> Tuple[int, int]:
+    """(начало, конец) области товара; без шапки/подвала в разметке - вся страница"""
+    start = html.find(PRICE_REGION_START)
+    start = html.find(">", start) + 1 if start != -1 else 0
+    end = len(html)
+    for marker in PRICE_REGION_END_MARKERS:
+        position = html.find(marker, start, end)
+        if position != -1:
+            end = position
+    return start, end
+
+
+def normalize_price(raw: Optional[str]) -> Optional[str]:
+    """Цена из найденного текста: первое число без пробелов и копеек ("1 234,50 ₽" -> "1234")"""
+    if not raw:
+        return None
+    match = PRICE_NUMBER_RE.search(raw)
+    if not match:
+        return None
+    number = DECIMAL_SEPARATOR_RE.split(match.group(0), 1)[0]
+    digits = NON_DIGITS_RE.sub("", number)
+    return digits or None
+
+
+class _StopParsing(Exception):
+    """Фрагмент разобран, остаток страницы не нужен"""
+
+
+class _ElementTextParser(HTMLParser):
+    """
+    Собирает текст элементов (с учётом вложенных) в порядке открывающих тегов.
+    track(tag, attrs, ancestors) решает, нужен ли элемент; stop_when_closed
+    прерывает разбор (_StopParsing), когда закрыт первый элемент фрагмента.
+    """
+
+    def __init__(self, track: Callable, stop_when_closed: bool = False):
+        super().__init__(convert_charrefs=True)
+        self.track = track
+        self.stop_when_closed = stop_when_closed
+        self.stack: List[Tuple[str, Optional[int]]] = []
+        self.elements: List[Dict] = []
+        self.open_tracked: List[int] = []
+        self.skip_text = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self.skip_text += 1
+        if tag in VOID_TAGS:
+            return
+        ancestors = [name for name, _ in self.stack]
+        index = None
+        if self.track(tag, dict(attrs), ancestors):
+            index = len(self.elements)
+            self.elements.append({"tag": tag, "ancestors": ancestors, "text": []})
+            self.open_tracked.append(index)
+        self.stack.append((tag, index))
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style") and self.skip_text:
+            self.skip_text -= 1
+        if tag in VOID_TAGS:
+            return
+        # Незакрытые вложенные теги закрываются вместе с родителем
+        for position in range(len(self.stack) - 1, -1, -1):
+            if self.stack[position][0] == tag:
+                for _, index in self.stack[position:]:
+                    if index is not None:
+                        self.open_tracked.remove(index)
+                del self.stack[position:]
+                break
+        if self.stop_when_closed and not self.stack:
+            raise _StopParsing()
+
+    def handle_data(self, data):
+        if self.skip_text or not self.open_tracked:
+            return
+        for index in self.open_tracked:
+            self.elements[index]["text"].append(data)
+
+
+def _element_text(element: Dict) -> str:
+    return " ".join("".join(element["text"]).split())
+
+
+def extract_web_price(html: str) -> Optional[str]:
+    """span с ценой внутри кнопки виджета webPrice (как CSS-селектор в браузере)"""
+    marker = WEB_PRICE_MARKER.search(html)
+    if not marker:
+        return None
+    start = html.rfind("<div", 0, marker.start())
+    if start == -1:
+        return None
+
+    parser = _ElementTextParser(
+        lambda tag, attrs, ancestors: tag == "span" and "button" in ancestors,
+        stop_when_closed=True
+    )
+    try:
+        parser.feed(html[start:])
+    except _StopParsing:
+        pass
+    for element in parser.elements:
+        text = _element_text(element)
+        if "₽" in text or "руб" in text:
+            return text
+    return None
+
+
+def extract_by_patterns(html: str) -> Optional[str]:
+    """Первое в области товара совпадение любого из PRICE_PATTERNS (COMBINED_PRICE_RE, один проход)"""
+    start, end = price_region(html)
+    anchor = html.find(PRICE_ANCHOR, start, end)
+    while anchor != -1:
+        # Окно до знака рубля (и закрывающей кавычки шаблонов состояния). page_source
+        # из Chrome пишет неразрывный пробел как &nbsp; ("1 234&nbsp;₽"), \s его не находит
+        window = html[max(start, anchor - ANCHOR_LOOKBEHIND):min(end, anchor + 2)]
+        if "&nbsp;" in window:
+            window = window.replace("&nbsp;", " ")
+        match = COMBINED_PRICE_RE.search(window)
+        if match:
+            for name in PRICE_GROUPS:
+                value = match.group(name)
+                if value is not None:
+                    return value + " ₽"
+        anchor = html.find(PRICE_ANCHOR, anchor + 1, end)
+    return None
+
+
+def extract_by_patterns_sequential(html: str, patterns: List[re.Pattern] = PRICE_REGEXES) -> Optional[str]:
+    """
+    Прежний вариант: шаблоны по очереди, каждый по всей странице (без области
+    товара, поэтому находит и "Доставка от 99 ₽" в шапке); оставлен для
+    сравнения в бенчмарке.
+    """
+    for pattern in patterns:
+        match = pattern.search(html)
+        if match:
+            return match.group(1) + " ₽"
+    return None
+
+
+def extract_by_text_scan(html: str) -> Optional[str]:
+    """Первый span/div в порядке документа, текст которого похож на цену (аналог JS-поиска)"""
+    start, end = price_region(html)
+    parser = _ElementTextParser(lambda tag, attrs, ancestors: tag in ("span", "div"))
+    parser.feed(html[start:end])
+    parser.close()
+    for element in parser.elements:
+        text = _element_text(element)
+        if ("₽" in text or "руб" in text) and PRICE_TEXT_RE.search(text):
+            return text
+    return None
+
+
+STRATEGIES: List[Tuple[str, Callable[[str], Optional[str]]]] = [
+    ("web_price", extract_web_price),
+    ("patterns", extract_by_patterns),
+    ("text_scan", extract_by_text_scan),
+]
+
+
+def extract_price_from_html(html: str) -> Tuple[Optional[str], Optional[str]]:
+    """Каскад стратегий до первой найденной цены. Возвращает (текст цены, имя стратегии)"""
+    for name, strategy in STRATEGIES:
+        raw = strategy(html)
+        if raw:
+            return raw, name
+    return None, None
+
+
+def is_blocked_html(html: str) -> bool:
+    """Страница блокировки или проверки на робота"""
+    return any(marker in html for marker in BLOCK_MARKERS) or any(p.search(html) for p in BLOCK_PATTERNS)
@@ -0,0 +1,144 @@
+# price_records.py
+
+"""
+Формат файлов bad_price_*.jsonl и рабочего файла in_work/inwork.jsonl.
+
+Одна строка - одна запись JSON с именованными полями (FIELDS), поэтому
+название товара может содержать пробелы, а update_price обновляет отдельную
+запись, не разбирая и не пересобирая остальные строки.
+Старые текстовые файлы (поля через пробел) читаются той же функцией
+loads_record и конвертируются командой:
+    python price_records.py in/bad_price_20250101_000000.txt
+"""
+
+import argparse
+import json
+import os
+from typing import Iterable, List, Optional
+
+from loguru import logger
+
+# Порядок полей совпадает с прежним текстовым форматом:
+# OzonID SKU Артикул %Отклонение База Старая Минимум Цена1С ЦенаOzon Название Ссылка
+FIELDS = (
+    "ozon_id", "sku", "offer_id", "deviation",
+    "base_price", "old_price", "min_price", "price_1c", "ozon_price",
+    "name", "url",
+)
+TEXT_FIELDS = ("ozon_id", "sku", "offer_id", "name", "url")
+
+RECORDS_EXT = ".jsonl"
+LEGACY_EXT = ".txt"
+
+
+def _to_number(value) -> float:
+    """Число из значения записи: "+12.5%" -> 12.5, "1500.0" -> 1500"""
+    if isinstance(value, str):
+        value = value.strip().rstrip("%")
+    number = float(value)
+    return int(number) if number.is_integer() else number
+
+
+def make_record(values: Iterable) -> dict:
+    """Запись из значений в порядке FIELDS (кортеж search_bad_price или поля старой строки)"""
+    values = list(values)
+    if len(values) != len(FIELDS):
+        raise ValueError(f"Ожидается {len(FIELDS)} полей, получено {len(values)}")
+    record = {}
+    for field, value in zip(FIELDS, values):
+        record[field] = str(value) if field in TEXT_FIELDS else _to_number(value)
+    return record
+
+
+def parse_legacy_line(line: str) -> Optional[dict]:
+    """Разбор строки старого формата; название - всё между ценой Ozon и ссылкой"""
+    parts = line.strip().split()
+    if len(parts) < len(FIELDS):
+        return None
+    return make_record(parts[:9] + [" ".join(parts[9:-1]), parts[-1]])
+
+
+def loads_record(line: str) -> Optional[dict]:
+    """
+    Запись из строки файла (JSON или старый текстовый формат).
+    Возвращает None для пустых и неполных строк.
+    """
+    line = line.strip()
+    if not line:
+        return None
+    if not line.startswith("{"):
+        return parse_legacy_line(line)
+    record = json.loads(line)
+    if any(field not in record for field in FIELDS):
+        return None
+    return record
+
+
+def dumps_record(record: dict) -> str:
+    """Строка файла для записи (без перевода строки)"""
+    return json.dumps(record, ensure_ascii=False)
+
+
+def write_records(path: str, records: Iterable[dict]) -> int:
+    """
+    Атомарная запись файла: временный файл с точкой в начале имени (не попадает
+    под шаблон bad_price_*), fsync и переименование. Возвращает число записей.
+    """
+    directory, name = os.path.split(path)
+    os.makedirs(directory or ".", exist_ok=True)
+    tmp_path = os.path.join(directory, f".{name}.tmp")
+    count = 0
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(dumps_record(record) + "\n")
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_records(path: str) -> List[dict]:
+    """Все записи файла (любого из двух форматов), неполные строки пропускаются"""
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            try:
+                record = loads_record(line)
+            except ValueError:
+                record = None
+            if record is None:
+                if line.strip():
+                    logger.warning(f"{path}:{number}: строка пропущена: {line.strip()[:100]!r}")
+                continue
+            records.append(record)
+    return records
+
+
+def records_path(path: str) -> str:
+    """Путь к .jsonl файлу для старого .txt"""
+    return f"{os.path.splitext(path)[0]}{RECORDS_EXT}"
+
+
+def convert_legacy_file(source: str, dest: Optional[str] = None) -> str:
+    """Конвертирует текстовый файл в JSON Lines. Возвращает путь к новому файлу"""
+    dest = dest or records_path(source)
+    count = write_records(dest, read_records(source))
+    logger.info(f"{source} -> {dest}: {count} записей")
+    return dest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Конвертация bad_price_*.txt / inwork.txt в JSON Lines")
+    parser.add_argument("files", nargs="+", help="Текстовые файлы старого формата")
+    parser.add_argument("--remove-source", action="store_true", help="Удалить исходный файл после конвертации")
+    args = parser.parse_args()
+
+    for source in args.files:
+        convert_legacy_file(source)
+        if args.remove_source:
+            os.remove(source)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# scrape_cache.py
+
+"""
+Кэш цен "С Ozon картой", полученных браузером: ссылка -> (цена, время парсинга).
+
+За день одни и те же товары парсятся несколько раз: pars_link.py, затем
+проверки update_price.py. Кэш хранится в SQLite (data/scrape_cache.sqlite3,
+режим WAL, можно открыть из нескольких скриптов одновременно) и проверяется
+до Parser.parse_price:
+    - запись действует ttl секунд с момента парсинга, устаревшая удаляется;
+    - при превышении max_entries удаляются записи, к которым дольше всего
+      не обращались (LRU по used_at);
+    - get(url, bypass=True) всегда идёт в браузер (проверка после коррекции
+      цены), invalidate(url) удаляет запись после изменения цены.
+Кэшируются только найденные цены. Статистика попаданий пишется в итог запуска.
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+from loguru import logger
+
+DEFAULT_PATH = "data/scrape_cache.sqlite3"
+DEFAULT_TTL = 3 * 60 * 60
+DEFAULT_MAX_ENTRIES = 50000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scrape_cache (
+    url TEXT PRIMARY KEY,
+    price REAL NOT NULL,
+    raw TEXT,
+    scraped_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scrape_cache_used_at ON scrape_cache(used_at);
+"""
+
+
+class ScrapeCache:
+    """
+    Подключение к кэшу. Одно соединение на объект, операции под блокировкой,
+    поэтому объект можно использовать из потоков ThreadManager и run_product_workers.
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, ttl: float = DEFAULT_TTL,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, timeout: float = 30):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "bypassed": 0, "stored": 0, "evicted": 0}
+        self.purge_expired()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def purge_expired(self) -> int:
+        """Удаляет записи старше ttl"""
+        with self.lock, self.conn:
+            cursor = self.conn.execute("DELETE FROM scrape_cache WHERE scraped_at < ?", (time.time() - self.ttl,))
+        return cursor.rowcount
+
+    def get(self, url: str, bypass: bool = False) -> Optional[float]:
+        """Цена из кэша или None, если товар нужно парсить (нет записи, устарела или bypass)"""
+        with self.lock:
+            if bypass:
+                self.stats["bypassed"] += 1
+                return None
+            stamp = time.time()
+            row = self.conn.execute("SELECT price, scraped_at FROM scrape_cache WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            price, scraped_at = row
+            with self.conn:
+                if stamp - scraped_at > self.ttl:
+                    self.conn.execute("DELETE FROM scrape_cache WHERE url = ?", (url,))
+                    self.stats["misses"] += 1
+                    self.stats["expired"] += 1
+                    return None
+                self.conn.execute("UPDATE scrape_cache SET used_at = ? WHERE url = ?", (stamp, url))
+            self.stats["hits"] += 1
+            return price
+
+    def put(self, url: str, price: Optional[float], raw: Optional[str] = None):
+        """Сохраняет спарсенную цену; при переполнении удаляет давно не использованные записи"""
+        if not price:
+            return
+        stamp = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO scrape_cache (url, price, raw, scraped_at, used_at) VALUES (?, ?, ?, ?, ?)",
+                (url, float(price), raw, stamp, stamp)
+            )
+            self.stats["stored"] += 1
+            excess = self.conn.execute("SELECT count(*) FROM scrape_cache").fetchone()[0] - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM scrape_cache WHERE url IN "
+                    "(SELECT url FROM scrape_cache ORDER BY used_at LIMIT ?)",
+                    (excess,)
+                )
+                self.stats["evicted"] += excess
+
+    def invalidate(self, url: str):
+        """Цена товара изменена: следующий запрос пойдёт в браузер"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM scrape_cache WHERE url = ?", (url,))
+
+    def summary(self) -> Dict:
+        with self.lock:
+            stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+        return stats
+
+    def log_summary(self):
+        s = self.summary()
+        logger.info(
+            f"Кэш парсинга: попаданий {s['hits']}, промахов {s['misses']} (устарело {s['expired']}), "
+            f"доля попаданий {s['hit_rate']:.0%}, в обход кэша {s['bypassed']}, "
+            f"сохранено {s['stored']}, вытеснено {s['evicted']}"
+        )
+
+
+def open_cache(path: str = DEFAULT_PATH, ttl: float = DEFAULT_TTL,
+               max_entries: int = DEFAULT_MAX_ENTRIES) -> Optional[ScrapeCache]:
+    """Открывает кэш; при ошибке цены парсятся без кэша"""
+    try:
+        return ScrapeCache(path, ttl, max_entries)
+    except sqlite3.Error as e:
+        logger.warning(f"Кэш парсинга {path} недоступен: {e}")
+        return None
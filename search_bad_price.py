@@ -1,9 +1,15 @@
+import argparse
 import os
 import glob
+import numpy as np
 import pandas as pd
 from datetime import datetime
 import re
 
+from price_records import make_record, write_records
+from state_store import DEFAULT_PATH, StateStore
+from table_store import PARQUET_AVAILABLE, read_table
+
 
 def clean_price_value(value):
     """Очистка числовых значений от символов валюты и пробелов"""
@@ -25,7 +31,7 @@ def clean_price_value(value):
 
 def extract_datetime_from_filename(filename):
     """Извлечение даты из имени файла"""
-    match = re.search(r'result_price_(\d{8}_\d{6})\.xlsx', filename)
+    match = re.search(r'result_price_(\d{8}_\d{6})\.(?:xlsx|parquet)$', filename)
     if match:
         dt_str = match.group(1)
         try:
@@ -35,8 +41,10 @@ def extract_datetime_from_filename(filename):
     return datetime.min
 
 
-def find_latest_file(directory="out", prefix="result_price_", ext=".xlsx"):
-    files = glob.glob(os.path.join(directory, f"{prefix}*{ext}"))
+def find_latest_file(directory="out", prefix="result_price_", exts=(".parquet", ".xlsx")):
+    files = []
+    for ext in exts:
+        files.extend(glob.glob(os.path.join(directory, f"{prefix}*{ext}")))
     if not files:
         raise FileNotFoundError(
             f"Файлы с префиксом '{prefix}' не найдены в директории '{directory}'")
@@ -68,97 +76,258 @@ def calculate_deviation(price_1c, ozon_price):
     return deviation
 
 
-def process_excel_file(file_path):
-    df = pd.read_excel(file_path)
+REQUIRED_COLUMNS = [
+    "Ozon Product ID", "SKU", "Артикул",
+    "Цена 1С", "Цена по карте озон",
+    "Базовая цена API", "Старая цена API",
+    "Минимальная цена API", "Название товара", "Ссылка на товар"
+]
 
-    required_columns = [
-        "Ozon Product ID", "SKU", "Артикул",
-        "Цена 1С", "Цена по карте озон",
-        "Базовая цена API", "Старая цена API",
-        "Минимальная цена API", "Название товара", "Ссылка на товар"
-    ]
+PRICE_COLUMNS = [
+    "Цена 1С", "Цена по карте озон",
+    "Базовая цена API", "Старая цена API", "Минимальная цена API"
+]
 
-    missing_cols = [col for col in required_columns if col not in df.columns]
-    if missing_cols:
-        raise KeyError(f"Отсутствуют колонки: {', '.join(missing_cols)}")
+# Символы вне ASCII, которые встречаются в ценах и точно не являются цифрами
+PRICE_EXTRA_CHARS = '₽\u2009\u00a0\u202fА-Яа-яЁё'
 
-    bad_prices = []
+# Строковые операции над колонками на pyarrow выполняются без Python-цикла
+STRING_DTYPE = "string[pyarrow]" if PARQUET_AVAILABLE else object
 
-    for index, row in df.iterrows():
-        try:
-            # Извлечение и валидация данных
-            ozon_id = str(row['Ozon Product ID']).strip()
-            sku = str(int(float(row['SKU']))) if not pd.isna(row['SKU']) else "N/A"
-            article = str(row['Артикул']).strip()
-            
-            # Обработка названия товара: берем только первое слово до пробела
-            full_name = str(row['Название товара']).strip()
-            first_space = full_name.find(' ')
-            product_name = full_name[:first_space] if first_space != -1 else full_name
+
+def process_row(index, row):
+    """Проверка одной строки таблицы. Возвращает кортеж для bad_price или None"""
+    try:
+        # Извлечение и валидация данных
+        ozon_id = str(row['Ozon Product ID']).strip()
+        sku = str(int(float(row['SKU']))) if not pd.isna(row['SKU']) else "N/A"
+        article = str(row['Артикул']).strip()
+        
+        # Название сохраняется целиком: в JSON Lines пробелы не ломают разбор строки
+        product_name = str(row['Название товара']).strip()
+        
+        product_url = str(row['Ссылка на товар']).strip()
+
+        price_1c = clean_price_value(row['Цена 1С'])
+        ozon_price = clean_price_value(row['Цена по карте озон'])
+
+        base_price = clean_price_value(row['Базовая цена API'])
+        old_price = clean_price_value(row['Старая цена API'])
+        min_price = clean_price_value(row['Минимальная цена API'])
+
+        # Пропускаем нулевые или отрицательные цены
+        if price_1c <= 0 or ozon_price <= 0:
+            return None
+
+        dev = calculate_deviation(price_1c, ozon_price)
+
+        # Проверяем абсолютное значение отклонения (> 3% в любую сторону)
+        if dev is not None and abs(dev) > 3:
+            # Форматируем отклонение со знаком
+            sign = '+' if dev >= 0 else ''
+            formatted_dev = f"{sign}{round(dev, 2)}%"
             
-            product_url = str(row['Ссылка на товар']).strip()
-
-            price_1c = clean_price_value(row['Цена 1С'])
-            ozon_price = clean_price_value(row['Цена по карте озон'])
-
-            base_price = clean_price_value(row['Базовая цена API'])
-            old_price = clean_price_value(row['Старая цена API'])
-            min_price = clean_price_value(row['Минимальная цена API'])
-
-            # Пропускаем нулевые или отрицательные цены
-            if price_1c <= 0 or ozon_price <= 0:
-                continue
-
-            dev = calculate_deviation(price_1c, ozon_price)
-
-            # Проверяем абсолютное значение отклонения (> 3% в любую сторону)
-            if dev is not None and abs(dev) > 3:
-                # Форматируем отклонение со знаком
-                sign = '+' if dev >= 0 else ''
-                formatted_dev = f"{sign}{round(dev, 2)}%"
-                
-                bad_prices.append((
-                    ozon_id, sku, article,
-                    formatted_dev,
-                    int(base_price), int(old_price),
-                    int(min_price), int(price_1c),
-                    int(ozon_price),
-                    product_name,  # Используем обработанное название
-                    product_url
-                ))
-
-        except Exception as e:
-            print(f"Ошибка в строке {index}: {str(e)}")
-            print(f"Сырые данные: {row.values}")
+            return (
+                ozon_id, sku, article,
+                formatted_dev,
+                int(base_price), int(old_price),
+                int(min_price), int(price_1c),
+                int(ozon_price),
+                product_name,
+                product_url
+            )
+
+    except Exception as e:
+        print(f"Ошибка в строке {index}: {str(e)}")
+        print(f"Сырые данные: {row.values}")
+
+    return None
+
+
+def process_rows_legacy(df):
+    """Построчная обработка через iterrows (эталон для сравнения с process_rows)"""
+    bad_prices = []
+    for index, row in df.iterrows():
+        result = process_row(index, row)
+        if result is not None:
+            bad_prices.append(result)
+    return bad_prices
+
+
+def clean_price_column(column):
+    """
+    Векторный аналог clean_price_value для колонки.
+    Значения с символами, которые str.isdigit() может счесть цифрами (цифры вне
+    ASCII), обрабатываются через clean_price_value, чтобы результат совпадал побитово.
+    """
+    text = pd.Series([str(v) for v in column.tolist()], index=column.index, dtype=STRING_DTYPE)
+    cleaned = (
+        text.str.replace(',', '.', regex=False)
+            .str.replace(r'[^0-9.]', '', regex=True)
+    )
+    # float() принимает только такие строки, остальные (пустые, '.', '1.2.3') дают 0
+    is_number = cleaned.str.fullmatch(r'[0-9]+\.?[0-9]*|\.[0-9]+').fillna(False).astype(bool)
+    values = pd.Series(
+        cleaned.where(is_number).astype('Float64').to_numpy(dtype=float, na_value=np.nan),
+        index=column.index
+    ).fillna(0.0)
+    values[column.isna().to_numpy()] = 0.0
+
+    fallback = (
+        text.str.contains(f'[^\\x00-\\x7f{PRICE_EXTRA_CHARS}]', regex=True).to_numpy(dtype=bool)
+        & column.notna().to_numpy()
+    )
+    if fallback.any():
+        values[fallback] = column[fallback].map(clean_price_value).astype(float)
+    return values
+
+
+def keeps_raw_values(values):
+    """
+    iterrows строит Series из строки таблицы и выводит её тип: строка только из
+    строк/пропусков становится str, только из чисел - числовой (int → float).
+    Значения остаются как есть, только если в строке есть и строки, и не-строки.
+    """
+    has_str = has_other = False
+    for value in values:
+        if isinstance(value, str):
+            has_str = True
+        elif not pd.isna(value):
+            has_other = True
+        if has_str and has_other:
+            return True
+    return False
+
+
+def process_rows(df):
+    """
+    Векторная проверка таблицы: цены очищаются и сравниваются по колонкам целиком,
+    в Python-цикл попадают только строки с отклонением (и редкие строки,
+    которые нельзя разобрать векторно - они проверяются через process_row).
+    Результат совпадает с process_rows_legacy.
+    """
+    if df.empty:
+        return []
+
+    # Значения берутся так же, как их видит iterrows (общая матрица df.values)
+    matrix = df.values
+    columns = {col: pd.Series(matrix[:, df.columns.get_loc(col)], index=df.index) for col in REQUIRED_COLUMNS}
+
+    prices = {col: clean_price_column(columns[col]).to_numpy() for col in PRICE_COLUMNS}
+    price_1c = prices["Цена 1С"]
+    ozon_price = prices["Цена по карте озон"]
+
+    valid = (price_1c > 0) & (ozon_price > 0)
+    target_price = price_1c * 1.10
+    with np.errstate(divide='ignore', invalid='ignore'):
+        deviation = ((ozon_price - target_price) / target_price) * 100
+    flagged = valid & (np.abs(deviation) > 3)
+
+    # SKU, который не удаётся привести к числу, приводит к ошибке строки - такие строки идут через process_row
+    sku_column = columns['SKU']
+    sku_values = pd.to_numeric(sku_column, errors='coerce').astype(float).to_numpy()
+    sku_missing = sku_column.isna().to_numpy()
+    row_fallback = ~sku_missing & ~np.isfinite(sku_values)
+    # Бесконечные цены (слишком длинные числа) тоже дают ошибку строки
+    for values in prices.values():
+        row_fallback |= ~np.isfinite(values)
+
+    positions = np.flatnonzero(flagged | row_fallback)
+    if not len(positions):
+        return []
+
+    ozon_ids = columns['Ozon Product ID'].tolist()
+    articles = columns['Артикул'].tolist()
+    names = columns['Название товара'].tolist()
+    urls = columns['Ссылка на товар'].tolist()
+    index = df.index
+
+    bad_prices = []
+    for pos in positions.tolist():
+        if row_fallback[pos] or not keeps_raw_values(matrix[pos]):
+            result = process_row(index[pos], pd.Series(matrix[pos], index=df.columns, name=index[pos]))
+            if result is not None:
+                bad_prices.append(result)
             continue
 
+        dev = float(deviation[pos])
+        sign = '+' if dev >= 0 else ''
+
+        bad_prices.append((
+            str(ozon_ids[pos]).strip(),
+            str(int(sku_values[pos])) if not sku_missing[pos] else "N/A",
+            str(articles[pos]).strip(),
+            f"{sign}{round(dev, 2)}%",
+            int(prices["Базовая цена API"][pos]), int(prices["Старая цена API"][pos]),
+            int(prices["Минимальная цена API"][pos]), int(price_1c[pos]),
+            int(ozon_price[pos]),
+            str(names[pos]).strip(),
+            str(urls[pos]).strip()
+        ))
+
+    return bad_prices
+
+
+def process_excel_file(file_path):
+    df = read_table(file_path)
+
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in df.columns]
+    if missing_cols:
+        raise KeyError(f"Отсутствуют колонки: {', '.join(missing_cols)}")
+
+    return process_rows(df)
+
+
+def process_state_store(db_path=DEFAULT_PATH, threshold=3):
+    """Товары вне диапазона из хранилища состояния (индексный запрос вместо чтения таблицы)"""
+    with StateStore(db_path) as store:
+        products = store.out_of_band(threshold)
+
+    bad_prices = []
+    for product in products:
+        dev = product['deviation']
+        sign = '+' if dev >= 0 else ''
+        bad_prices.append((
+            product['ozon_id'],
+            product['sku'] or "N/A",
+            product['offer_id'] or "",
+            f"{sign}{round(dev, 2)}%",
+            int(product['base_price'] or 0), int(product['old_price'] or 0),
+            int(product['min_price'] or 0), int(product['price_1c']),
+            int(product['card_price']),
+            product['name'] or "",
+            product['url'] or ""
+        ))
     return bad_prices
 
 
 def save_bad_prices(data):
-    """Сохранение результатов в файл"""
-    if not os.path.exists('in'):
-        os.makedirs('in')
-        
+    """Сохранение результатов в файл (JSON Lines, формат записей - price_records.py)"""
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = os.path.join("in", f"bad_price_{timestamp}.txt")
+    filename = os.path.join("in", f"bad_price_{timestamp}.jsonl")
 
-    with open(filename, 'w', encoding='utf-8') as f:
-        for item in data:
-            # Формат: OzonID SKU Артикул %Отклонение База Старая Минимум Цена1С ЦенаOzon Название Ссылка
-            line = (f"{item[0]} {item[1]} {item[2]} {item[3]} {item[4]} {item[5]} "
-                    f"{item[6]} {item[7]} {item[8]} {item[9]} {item[10]}\n")
-            f.write(line)
+    # Запись атомарная: update_price увидит файл только целиком
+    write_records(filename, (make_record(item) for item in data))
 
     print(f"Найдено проблемных позиций: {len(data)}")
     print(f"Файл результатов: {filename}")
 
 
 if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Поиск товаров с отклонением цены по карте")
+    arg_parser.add_argument("--from-store", action="store_true",
+                            help="Брать данные из хранилища состояния (state_store.py), а не из out/result_price_*")
+    arg_parser.add_argument("--db", default=DEFAULT_PATH, help="Путь к хранилищу состояния")
+    args = arg_parser.parse_args()
+
     try:
-        input_file = find_latest_file()
-        print(f"Обрабатываем файл: {input_file}")
-        results = process_excel_file(input_file)
+        if args.from_store:
+            print(f"Обрабатываем хранилище: {args.db}")
+            results = process_state_store(args.db)
+        else:
+            input_file = find_latest_file()
+            print(f"Обрабатываем файл: {input_file}")
+            results = process_excel_file(input_file)
 
         if results:
             save_bad_prices(results)
@@ -0,0 +1,341 @@
+# state_store.py
+
+"""
+Локальное хранилище состояния (SQLite, режим WAL).
+
+Таблицы:
+    products     - текущее состояние товаров: данные отчёта и цены API (get_data-api.py),
+                   цена 1С, последняя цена по карте и отклонение от целевой цены
+    prices_1c    - цены из opt_all.xlsx по ключам поиска (артикул, код 1С, название, номенклатура)
+    card_prices  - история цен "С Ozon картой" (pars_link.py)
+    corrections  - каждая коррекция цен, отправленная update_price.py
+
+Файлы xlsx/parquet остаются для людей и прежних этапов конвейера, а запросы вида
+"текущее состояние SKU" или "все товары вне диапазона" выполняются по индексам:
+    python state_store.py sku 1234567890
+    python state_store.py out-of-band --threshold 3
+    python state_store.py history ART-001
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional
+
+from loguru import logger
+
+DEFAULT_PATH = "data/state.sqlite3"
+
+# Целевая цена по карте = цена 1С * TARGET_MARKUP (как в search_bad_price.calculate_deviation)
+TARGET_MARKUP = 1.10
+
+PRODUCT_COLUMNS = (
+    "ozon_id", "sku", "offer_id", "name", "url", "status", "visibility",
+    "base_price", "old_price", "marketing_price", "min_price", "price_1c", "fbs_stock",
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    ozon_id TEXT PRIMARY KEY,
+    sku TEXT,
+    offer_id TEXT,
+    name TEXT,
+    url TEXT,
+    status TEXT,
+    visibility TEXT,
+    base_price REAL,
+    old_price REAL,
+    marketing_price REAL,
+    min_price REAL,
+    price_1c REAL,
+    fbs_stock INTEGER,
+    card_price REAL,
+    card_scraped_at TEXT,
+    deviation REAL,
+    updated_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_products_sku ON products(sku);
+CREATE INDEX IF NOT EXISTS idx_products_offer_id ON products(offer_id);
+CREATE INDEX IF NOT EXISTS idx_products_url ON products(url);
+CREATE INDEX IF NOT EXISTS idx_products_abs_deviation ON products(abs(deviation));
+
+CREATE TABLE IF NOT EXISTS prices_1c (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    price REAL,
+    updated_at TEXT,
+    PRIMARY KEY (kind, key)
+);
+
+CREATE TABLE IF NOT EXISTS card_prices (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    ozon_id TEXT,
+    sku TEXT,
+    price REAL,
+    raw TEXT,
+    scraped_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_card_prices_url ON card_prices(url, scraped_at);
+CREATE INDEX IF NOT EXISTS idx_card_prices_sku ON card_prices(sku, scraped_at);
+
+CREATE TABLE IF NOT EXISTS corrections (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    offer_id TEXT NOT NULL,
+    ozon_id TEXT,
+    deviation REAL,
+    old_price REAL,
+    price REAL,
+    min_price REAL,
+    updated INTEGER,
+    errors TEXT,
+    sent_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_corrections_offer_id ON corrections(offer_id, sent_at);
+"""
+
+# Пересчёт отклонения после изменения цены 1С или цены по карте
+DEVIATION_SQL = f"""
+CASE WHEN price_1c > 0 AND card_price > 0
+     THEN (card_price - price_1c * {TARGET_MARKUP}) / (price_1c * {TARGET_MARKUP}) * 100
+END
+"""
+
+
+def now() -> str:
+    return datetime.now().isoformat(timespec="seconds")
+
+
+def to_float(value) -> Optional[float]:
+    """Число из значения таблицы/API ("1 234,50 ₽", "Н/Д", None)"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    cleaned = re.sub(r"[^\d,.]", "", str(value)).replace(",", ".")
+    try:
+        return float(cleaned) if cleaned else None
+    except ValueError:
+        return None
+
+
+def to_text(value) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, float):
+        # ID из xlsx приходят числами: 123.0 -> "123"
+        if value != value:
+            return None
+        if value.is_integer():
+            value = int(value)
+    text = str(value).strip()
+    return text if text and text != "Н/Д" else None
+
+
+class StateStore:
+    """
+    Подключение к хранилищу. Одно соединение на процесс, запись под блокировкой,
+    поэтому объект можно использовать из нескольких потоков (update_price, pars_link).
+    """
+
+    def __init__(self, path: str = DEFAULT_PATH, timeout: float = 30):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL: читатели не блокируют запись из другого скрипта
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # Запись
+
+    def upsert_products(self, products: Iterable[Dict]) -> int:
+        """
+        Обновляет товары по Ozon Product ID (словари с ключами из PRODUCT_COLUMNS).
+        Цена по карте и история не затрагиваются, отклонение пересчитывается.
+        """
+        rows = [
+            tuple(product.get(col) for col in PRODUCT_COLUMNS) + (now(),)
+            for product in products if product.get("ozon_id")
+        ]
+        if not rows:
+            return 0
+        columns = ", ".join(PRODUCT_COLUMNS)
+        updates = ", ".join(f"{col} = excluded.{col}" for col in PRODUCT_COLUMNS[1:])
+        with self.lock, self.conn:
+            self.conn.executemany(
+                f"INSERT INTO products ({columns}, updated_at) "
+                f"VALUES ({', '.join('?' * (len(PRODUCT_COLUMNS) + 1))}) "
+                f"ON CONFLICT(ozon_id) DO UPDATE SET {updates}, updated_at = excluded.updated_at, "
+                f"deviation = {DEVIATION_SQL.replace('price_1c', 'excluded.price_1c')}",
+                rows
+            )
+        return len(rows)
+
+    def replace_prices_1c(self, price_indexes: Dict[str, Dict]) -> int:
+        """
+        Заменяет цены 1С индексами из get_data-api.load_opt_prices
+        ({"by_article": {ключ: цена}, "by_code1c": ..., ...}).
+        """
+        stamp = now()
+        rows = [
+            (kind[3:] if kind.startswith("by_") else kind, str(key), to_float(price), stamp)
+            for kind, index in price_indexes.items()
+            for key, price in index.items()
+        ]
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM prices_1c")
+            self.conn.executemany("INSERT OR REPLACE INTO prices_1c VALUES (?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def add_card_prices(self, prices: Iterable[Dict]) -> int:
+        """
+        Добавляет цены по карте ({"url", "price", "ozon_id", "sku", "raw"}) в историю
+        и обновляет текущую цену и отклонение товара (по ozon_id, иначе по ссылке).
+        """
+        stamp = now()
+        rows = [
+            (item["url"], to_text(item.get("ozon_id")), to_text(item.get("sku")),
+             to_float(item.get("price")), to_text(item.get("raw")), stamp)
+            for item in prices if item.get("url")
+        ]
+        if not rows:
+            return 0
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT INTO card_prices (url, ozon_id, sku, price, raw, scraped_at) VALUES (?, ?, ?, ?, ?, ?)",
+                rows
+            )
+            for url, ozon_id, _, price, _, scraped_at in rows:
+                if price is None:
+                    continue
+                where, key = ("ozon_id = ?", ozon_id) if ozon_id else ("url = ?", url)
+                self.conn.execute(
+                    f"UPDATE products SET card_price = ?, card_scraped_at = ? WHERE {where}",
+                    (price, scraped_at, key)
+                )
+                self.conn.execute(f"UPDATE products SET deviation = {DEVIATION_SQL} WHERE {where}", (key,))
+        return len(rows)
+
+    def add_correction(self, offer_id: str, old_price: float, price: float, min_price: float,
+                       updated: bool, errors: Optional[List] = None, deviation: Optional[float] = None,
+                       ozon_id: Optional[str] = None):
+        """Запись об отправленной коррекции цен"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT INTO corrections (offer_id, ozon_id, deviation, old_price, price, min_price, "
+                "updated, errors, sent_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(offer_id), to_text(ozon_id), deviation, old_price, price, min_price,
+                 int(bool(updated)), json.dumps(errors, ensure_ascii=False) if errors else None, now())
+            )
+
+    # Запросы
+
+    def _query(self, sql: str, params=()) -> List[Dict]:
+        with self.lock:
+            return [dict(row) for row in self.conn.execute(sql, params)]
+
+    def product_state(self, sku: Optional[str] = None, offer_id: Optional[str] = None,
+                      ozon_id: Optional[str] = None) -> Optional[Dict]:
+        """Текущее состояние товара по SKU, артикулу или Ozon Product ID"""
+        for column, value in (("sku", sku), ("offer_id", offer_id), ("ozon_id", ozon_id)):
+            if value is not None:
+                rows = self._query(f"SELECT * FROM products WHERE {column} = ? LIMIT 1", (str(value),))
+                return rows[0] if rows else None
+        raise ValueError("Нужен sku, offer_id или ozon_id")
+
+    def out_of_band(self, threshold: float = 3) -> List[Dict]:
+        """Товары, у которых цена по карте отклоняется от целевой больше чем на threshold %"""
+        return self._query(
+            "SELECT * FROM products WHERE abs(deviation) > ? ORDER BY abs(deviation) DESC",
+            (threshold,)
+        )
+
+    def card_price_divergence(self, tolerance_pct: float = 1.0) -> List[str]:
+        """Ozon Product ID товаров, у которых цена по карте расходится с marketing_price API больше допуска"""
+        rows = self._query(
+            "SELECT ozon_id FROM products WHERE card_price > 0 AND marketing_price > 0 "
+            "AND abs(card_price - marketing_price) / card_price * 100 > ?",
+            (tolerance_pct,)
+        )
+        return [row["ozon_id"] for row in rows]
+
+    def card_price_history(self, url: str, limit: int = 20) -> List[Dict]:
+        return self._query(
+            "SELECT * FROM card_prices WHERE url = ? ORDER BY scraped_at DESC, id DESC LIMIT ?",
+            (url, limit)
+        )
+
+    def correction_history(self, offer_id: str, limit: int = 20) -> List[Dict]:
+        return self._query(
+            "SELECT * FROM corrections WHERE offer_id = ? ORDER BY sent_at DESC, id DESC LIMIT ?",
+            (str(offer_id), limit)
+        )
+
+
+def open_store(path: str = DEFAULT_PATH) -> Optional[StateStore]:
+    """Открывает хранилище; при ошибке конвейер продолжает работать на файлах"""
+    try:
+        return StateStore(path)
+    except sqlite3.Error as e:
+        logger.warning(f"Хранилище состояния {path} недоступно: {e}")
+        return None
+
+
+_shared_stores: Dict[str, StateStore] = {}
+_shared_lock = threading.Lock()
+
+
+def get_store(path: str = DEFAULT_PATH) -> Optional[StateStore]:
+    """Общее для процесса подключение (для долгоживущих скриптов вроде update_price)"""
+    with _shared_lock:
+        if path not in _shared_stores:
+            store = open_store(path)
+            if store is None:
+                return None
+            _shared_stores[path] = store
+        return _shared_stores[path]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Запросы к хранилищу состояния")
+    parser.add_argument("--db", default=DEFAULT_PATH, help="Путь к базе SQLite")
+    commands = parser.add_subparsers(dest="command", required=True)
+    sku_cmd = commands.add_parser("sku", help="Текущее состояние товара по SKU")
+    sku_cmd.add_argument("sku")
+    band_cmd = commands.add_parser("out-of-band", help="Товары с отклонением цены по карте")
+    band_cmd.add_argument("--threshold", type=float, default=3)
+    history_cmd = commands.add_parser("history", help="История коррекций по артикулу")
+    history_cmd.add_argument("offer_id")
+    args = parser.parse_args()
+
+    with StateStore(args.db) as store:
+        if args.command == "sku":
+            result = store.product_state(sku=args.sku)
+            if result and result.get("url"):
+                result["card_prices"] = store.card_price_history(result["url"])
+        elif args.command == "out-of-band":
+            result = store.out_of_band(args.threshold)
+        else:
+            result = store.correction_history(args.offer_id)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+# table_store.py
+
+"""
+Промежуточные таблицы между этапами конвейера.
+
+Каждая таблица сохраняется в Parquet рядом с xlsx (то же имя, расширение
+.parquet), читатели предпочитают Parquet: он читается на порядок быстрее,
+чем pd.read_excel. xlsx остаётся итоговым файлом для людей и может быть
+отключён. Если pyarrow не установлен, всё работает через xlsx, как раньше.
+Большие xlsx пишутся потоково (ExcelRowWriter): через xlsxwriter в режиме
+constant_memory, а без него - через openpyxl.
+"""
+
+import os
+import sys
+
+import pandas as pd
+from loguru import logger
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pc = None
+    pq = None
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+PARQUET_AVAILABLE = pa is not None
+XLSXWRITER_AVAILABLE = xlsxwriter is not None
+
+
+def parquet_path(path):
+    """Путь к Parquet-файлу для таблицы (по пути к xlsx или к самому parquet)"""
+    return f"{os.path.splitext(path)[0]}.parquet"
+
+
+def excel_path(path):
+    """Путь к xlsx-файлу для таблицы"""
+    return f"{os.path.splitext(path)[0]}.xlsx"
+
+
+def table_exists(path):
+    return os.path.isfile(excel_path(path)) or (PARQUET_AVAILABLE and os.path.isfile(parquet_path(path)))
+
+
+def _to_arrow_compatible(df):
+    """Колонки со смешанными типами (числа и строки) приводятся к строкам"""
+    df = df.copy()
+    for col in df.columns:
+        if df[col].dtype == object:
+            df[col] = df[col].map(lambda v: v if v is None or (isinstance(v, float) and pd.isna(v)) else str(v))
+    return df
+
+
+def write_parquet(df, path):
+    target = parquet_path(path)
+    try:
+        df.to_parquet(target, index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        _to_arrow_compatible(df).to_parquet(target, index=False)
+    return target
+
+
+def write_table(df, path, excel=True):
+    """
+    Сохраняет DataFrame в Parquet и (если excel=True) в xlsx.
+    Возвращает путь к основному сохранённому файлу.
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    saved = None
+
+    if PARQUET_AVAILABLE:
+        saved = write_parquet(df, path)
+        logger.debug(f"Таблица сохранена в {saved}")
+    elif not excel:
+        logger.warning("pyarrow не установлен, таблица будет сохранена в xlsx")
+        excel = True
+
+    if excel:
+        # xlsx пишется после parquet, поэтому свежий parquet не старше xlsx
+        df.to_excel(excel_path(path), index=False)
+        saved = excel_path(path)
+        if PARQUET_AVAILABLE:
+            os.utime(parquet_path(path))
+
+    return saved
+
+
+def prefer_parquet(path):
+    """
+    Parquet используется, если он есть, pyarrow установлен и xlsx не новее
+    (иначе xlsx правили вручную и он считается актуальным).
+    """
+    pq_file = parquet_path(path)
+    xl_file = excel_path(path)
+
+    if not PARQUET_AVAILABLE or not os.path.isfile(pq_file):
+        return False
+    if os.path.isfile(xl_file) and os.path.getmtime(xl_file) > os.path.getmtime(pq_file):
+        logger.info(f"{xl_file} новее {pq_file}, читаем xlsx")
+        return False
+    return True
+
+
+def read_table(path):
+    """Читает таблицу в DataFrame, предпочитая Parquet"""
+    if prefer_parquet(path):
+        logger.debug(f"Читаем таблицу из {parquet_path(path)}")
+        return pd.read_parquet(parquet_path(path))
+    return pd.read_excel(excel_path(path))
+
+
+def iter_table_records(path, batch_size=10000):
+    """Построчно отдаёт записи таблицы словарями {заголовок: значение}, предпочитая Parquet"""
+    if prefer_parquet(path):
+        for batch in pq.ParquetFile(parquet_path(path)).iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+        return
+
+    from openpyxl import load_workbook
+
+    wb = load_workbook(excel_path(path), read_only=True)
+    try:
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        headers = next(rows, None)
+        if not headers:
+            return
+        for row in rows:
+            yield {header: row[i] if i < len(row) else None for i, header in enumerate(headers)}
+    finally:
+        wb.close()
+
+
+def rows_to_table(columns, rows):
+    """Строки (списки значений) в таблицу Arrow со строковыми колонками; пустые строки - null"""
+    schema = pa.schema([(col, pa.string()) for col in columns])
+    arrays = [
+        pa.array([None if row[i] is None or row[i] == "" else str(row[i]) for row in rows], pa.string())
+        for i in range(len(columns))
+    ]
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def read_parquet_columns(path, columns):
+    """Parquet-таблица в заданных колонках (строками); недостающие колонки заполняются null"""
+    table = pq.read_table(parquet_path(path))
+    arrays = [
+        table[col].cast(pa.string()) if col in table.column_names else pa.nulls(table.num_rows, pa.string())
+        for col in columns
+    ]
+    return pa.Table.from_arrays(arrays, names=list(columns))
+
+
+def upsert_parquet_rows(path, columns, rows, key, replace_keys=None):
+    """
+    Слияние по ключу без построчного чтения старой таблицы: новые строки идут первыми,
+    из старых отбрасываются строки без ключа и с ключом из replace_keys (по умолчанию -
+    ключи новых строк). Возвращает итоговую таблицу Arrow, файл не записывается.
+    """
+    new_table = rows_to_table(columns, rows)
+    old_table = read_parquet_columns(path, columns)
+    if replace_keys is None:
+        replace_keys = new_table[key]
+    else:
+        replace_keys = pa.array([str(k) for k in replace_keys], pa.string())
+
+    old_keys = old_table[key]
+    keep = pc.and_(pc.is_valid(old_keys), pc.invert(pc.is_in(old_keys, value_set=replace_keys)))
+    kept = old_table.filter(keep)
+    logger.info(f"Слияние {parquet_path(path)}: новых строк {new_table.num_rows}, сохранено старых {kept.num_rows}")
+    return pa.concat_tables([new_table, kept])
+
+
+def write_parquet_table(table, path):
+    """Атомарная запись таблицы Arrow в Parquet"""
+    target = parquet_path(path)
+    os.makedirs(os.path.dirname(target) or ".", exist_ok=True)
+    tmp_path = f"{target}.part"
+    pq.write_table(table, tmp_path)
+    os.replace(tmp_path, target)
+    logger.info(f"Сохранено {table.num_rows} строк в {target}")
+    return target
+
+
+def iter_table_rows(table, batch_size=10000):
+    """Строки таблицы Arrow списками значений в порядке колонок"""
+    for batch in table.to_batches(max_chunksize=batch_size):
+        yield from zip(*(column.to_pylist() for column in batch.columns))
+
+
+class ParquetRowWriter:
+    """
+    Потоковая запись строк (списков значений) в Parquet пачками.
+    Все колонки сохраняются строками, как их отдаёт read_excel для xlsx из get_data-api.
+    """
+
+    def __init__(self, path, columns, batch_size=10000):
+        self.path = parquet_path(path)
+        self.columns = list(columns)
+        self.batch_size = batch_size
+        self.schema = pa.schema([(col, pa.string()) for col in self.columns])
+        self.rows = []
+        self.rows_written = 0
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.tmp_path = f"{self.path}.part"
+        self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+
+    def append(self, row):
+        self.rows.append(row)
+        if len(self.rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        self.writer.write_table(rows_to_table(self.columns, self.rows))
+        self.rows_written += len(self.rows)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+        logger.info(f"Сохранено {self.rows_written} строк в {self.path}")
+
+    def abort(self):
+        self.writer.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+class ExcelRowWriter:
+    """
+    Потоковая запись строк (списков значений) в xlsx.
+    Ширина колонок считается по мере добавления строк, поэтому данные проходятся
+    один раз. xlsxwriter с constant_memory сбрасывает каждую строку на диск и
+    держит в памяти только текущую; без него используется обычная книга openpyxl.
+    """
+
+    def __init__(self, path, columns, sheet_title="Sheet1", max_width=50):
+        self.path = path
+        self.max_width = max_width
+        self.widths = [0] * len(columns)
+        self.rows_written = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        if XLSXWRITER_AVAILABLE:
+            self.engine = "xlsxwriter"
+            # Ссылки остаются строками, как при записи через openpyxl
+            self.wb = xlsxwriter.Workbook(path, {"constant_memory": True, "strings_to_urls": False})
+            self.ws = self.wb.add_worksheet(sheet_title)
+        else:
+            from openpyxl import Workbook
+
+            self.engine = "openpyxl"
+            self.wb = Workbook()
+            self.ws = self.wb.active
+            self.ws.title = sheet_title
+
+        self._write(list(columns))
+
+    def _write(self, row):
+        widths = self.widths
+        for i, value in enumerate(row):
+            if value:
+                length = len(str(value))
+                if length > widths[i]:
+                    widths[i] = length
+
+        if self.engine == "xlsxwriter":
+            self.ws.write_row(self.rows_written, 0, row)
+        else:
+            self.ws.append(row)
+        self.rows_written += 1
+
+    def append(self, row):
+        self._write(row)
+
+    def close(self):
+        """Проставляет ширину колонок и сохраняет файл"""
+        for i, max_len in enumerate(self.widths):
+            width = min((max_len + 2) * 1.2, self.max_width)
+            if self.engine == "xlsxwriter":
+                self.ws.set_column(i, i, width)
+            else:
+                from openpyxl.utils import get_column_letter
+
+                self.ws.column_dimensions[get_column_letter(i + 1)].width = width
+
+        if self.engine == "xlsxwriter":
+            self.wb.close()
+        else:
+            self.wb.save(self.path)
+        logger.info(f"Сохранено {self.rows_written - 1} строк в {self.path} ({self.engine})")
+
+    def abort(self):
+        """Прерванная запись: файл не сохраняется, временные файлы строк xlsxwriter удаляются"""
+        if self.engine == "xlsxwriter":
+            for ws in self.wb.worksheets():
+                fh = getattr(ws, "row_data_fh", None)
+                if fh is not None and not fh.closed:
+                    fh.close()
+                filename = getattr(ws, "row_data_filename", None)
+                if filename and os.path.exists(filename):
+                    os.remove(filename)
+        self.wb = None
+        self.ws = None
+
+
+def peak_memory_mb():
+    """Пиковый объём памяти процесса (RSS) в МБ или None, если недоступно"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт КБ, macOS - байты
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
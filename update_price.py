@@ -2,16 +2,16 @@
 
 
 import time
-import re
 import os
+import json
 import glob
 import shutil
 import math
 import random
-import requests
 from loguru import logger
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Set, Tuple
 import threading
+from queue import Queue, Empty
 from threading import Lock
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
@@ -19,132 +19,31 @@ from selenium.webdriver.support import expected_conditions as EC
 from webdriver_manager.chrome import ChromeDriverManager
 import zipfile
 from urllib.parse import urlparse
-from fake_useragent import UserAgent
 import undetected_chromedriver as uc
-from requests.auth import HTTPProxyAuth
 import conf as Config
+from ozon_client import TokenBucket, get_client
+from file_watcher import DirectoryWatcher
+from price_records import LEGACY_EXT, RECORDS_EXT, convert_legacy_file, dumps_record, loads_record, records_path
+from state_store import get_store
+from ozon_scraper import DriverPool, LazyLease, ProxyManager, TrafficMonitor, traffic_monitor
+from ozon_scraper import Parser as BaseParser
+from price_extraction import NON_DIGITS_RE
+from card_price_resolver import CardPriceResolver
+from scrape_cache import ScrapeCache, open_cache
 
+IN_WORK_FILE = os.path.join("in_work", f"inwork{RECORDS_EXT}")
+LEGACY_IN_WORK_FILE = os.path.join("in_work", f"inwork{LEGACY_EXT}")
+# Путь к bad_price файлу, из которого создан текущий рабочий файл
+WORK_SOURCE_FILE = f"{IN_WORK_FILE}.source"
 
-class TrafficMonitor:
-    """Мониторинг сетевого трафика"""
-    def __init__(self):
-        self.lock = Lock()
-        self.total_bytes_received = 0
-        self.total_bytes_sent = 0
-        self.url_traffic = {}
-    
-    def add_traffic(self, url, bytes_received, bytes_sent):
-        with self.lock:
-            self.total_bytes_received += bytes_received
-            self.total_bytes_sent += bytes_sent
-            if url in self.url_traffic:
-                self.url_traffic[url]["received"] += bytes_received
-                self.url_traffic[url]["sent"] += bytes_sent
-            else:
-                self.url_traffic[url] = {"received": bytes_received, "sent": bytes_sent}
-            self._log_traffic(url)
-            
-    def _log_traffic(self, url):
-        received = self.url_traffic[url]["received"]
-        sent = self.url_traffic[url]["sent"]
-        total = received + sent
-        def format_bytes(count):
-            if count < 1024: return f"{count} B"
-            elif count < 1024**2: return f"{count/1024:.2f} KB"
-            else: return f"{count/(1024**2):.2f} MB"
-        logger.info(f"[Traffic] {url}: received {format_bytes(received)}, sent {format_bytes(sent)}, total {format_bytes(total)}")
-
-    def get_total_traffic(self):
-        with self.lock:
-            total = self.total_bytes_received + self.total_bytes_sent
-            if total < 1024: return f"{total} B"
-            elif total < 1024**2: return f"{total/1024:.2f} KB"
-            else: return f"{total/(1024**2):.2f} MB"
-
-# Global traffic monitor instance
-traffic_monitor = TrafficMonitor()
-
-class ProxyManager:
-    """Управление прокси"""
-    def __init__(self, proxies_file="proxies.txt"):
-        self.lock = threading.Lock()
-        self.proxies: List[Tuple[str, Optional[Dict[str, str]]]] = []
-        self.index = 0
-        self.ua = UserAgent(platforms=['desktop'], browsers=['chrome', 'firefox', 'edge'])
-        self._load_proxies(proxies_file)
-
-    def _load_proxies(self, path):
-        if not os.path.isfile(path):
-            logger.warning(f"{path} not found, using direct connection.")
-            self.proxies = [("direct", None)]
-            return
-
-        with open(path, 'r') as f:
-            lines = [ln.strip() for ln in f if ln.strip()]
-
-        for raw in lines:
-            try:
-                proxy_str = raw
-                if '://' not in proxy_str: proxy_str = 'http://' + proxy_str
-                parsed = urlparse(proxy_str)
-                if parsed.scheme not in Config.SUPPORTED_SCHEMES:
-                    logger.warning(f"Skip unsupported scheme {parsed.scheme} in {proxy_str}")
-                    continue
-                host = parsed.hostname
-                port = parsed.port
-                if not host or not port:
-                    logger.warning(f"Invalid proxy address: {proxy_str}")
-                    continue
-                cred = None
-                if parsed.username and parsed.password:
-                    cred = {'username': parsed.username, 'password': parsed.password}
-                server = f"{parsed.scheme}://{host}:{port}"
-                if self._check_proxy_simple(server, cred):
-                    self.proxies.append((server, cred))
-                    logger.info(f"Added proxy: {server}")
-                if len(self.proxies) >= Config.MAX_PROXIES: break
-            except Exception as e:
-                logger.warning(f"Error parsing proxy '{raw}': {e}")
-
-        if not self.proxies:
-            self.proxies = [("direct", None)]
-            logger.warning("No valid proxies found, using direct connection.")
-        else:
-            logger.info(f"Loaded proxies: {[p[0] for p in self.proxies]}")
 
-    def _check_proxy_simple(self, server, credentials):
-        proxies = {"http": server, "https": server}
-        auth = None
-        if credentials: auth = HTTPProxyAuth(credentials['username'], credentials['password'])
-        try:
-            resp = requests.get(Config.HTTPBIN_URL, proxies=proxies, auth=auth, timeout=Config.TIMEOUT)
-            traffic_monitor.add_traffic('proxy_check', len(resp.content), 0)
-            return resp.ok
-        except Exception: return False
-
-    def get_proxy(self):
-        with self.lock:
-            if not self.proxies: return ("direct", None)
-            proxy = self.proxies[self.index]
-            self.index = (self.index + 1) % len(self.proxies)
-            logger.debug(f"Using proxy: {proxy[0]}")
-            return proxy
-
-    def get_random_user_agent(self):
-        try: return self.ua.random if self.ua else random.choice(Config.STATIC_USER_AGENTS)
-        except: return random.choice(Config.STATIC_USER_AGENTS)
-        
-class Parser:
+class Parser(BaseParser):
     """Парсер страниц Ozon"""
+    DIGITS_ONLY = True
+
     def __init__(self, proxy_manager: ProxyManager, traffic_monitor: TrafficMonitor):
-        self.proxy_manager = proxy_manager
-        self.traffic_monitor = traffic_monitor
-        self.proxy_info = proxy_manager.get_proxy()
-        self.user_agent = proxy_manager.get_random_user_agent()
-        self.driver = self.setup_driver()
-        self.anti_bot_counter = 0
-        self.warm_up()
-        
+        super().__init__(proxy_manager, Config, traffic_monitor)
+
     def setup_driver(self):
         options = uc.ChromeOptions()
         options.add_argument("--disable-extensions")
@@ -221,6 +120,7 @@ class Parser:
             else:
                 options.add_argument(f'--proxy-server={proxy_server}')
 
+        self.apply_load_profile(options)
         try:
             driver = uc.Chrome(
                 options=options,
@@ -230,6 +130,7 @@ class Parser:
             )
             driver.set_page_load_timeout(Config.TIMEOUT)
             driver.set_script_timeout(Config.TIMEOUT)
+            self.enable_load_profile(driver)
             stealth_js = """
             // Удаляем нативные функции WebDriver
             Object.defineProperty(navigator, 'webdriver', {
@@ -334,109 +235,6 @@ class Parser:
             time.sleep(random.uniform(1, 2))
         except Exception as e: logger.warning(f"Human behavior simulation error: {e}")
 
-    def parse_price(self, url: str) -> str | None:
-        if not self.driver:
-            try:
-                self.driver = self.setup_driver()
-                self.warm_up()
-            except Exception as e:
-                logger.error(f"Driver init failed: {e}")
-                return None
-
-        retries = 0
-        while retries < Config.MAX_RETRIES:
-            try:
-                logger.info(f"Loading URL: {url}")
-                self.driver.get(url)
-                time.sleep(random.uniform(*Config.REQUEST_DELAY))
-                if self.driver:
-                    page_source = self.driver.page_source
-                    bytes_rcv = len(page_source.encode('utf-8'))
-                    traffic_monitor.add_traffic(url, bytes_rcv, 0)
-                    self.simulate_human_behavior()
-                    if self.is_blocked():
-                        self.handle_block()
-                        retries += 1
-                        continue
-                    price = self.extract_price()
-                    if price: return price
-                retries += 1
-                self.rotate_identity()
-            except Exception as e: logger.error(f"Parsing error {url}: {e}")
-        logger.error(f"Price extraction failed: {url}")
-        return None
-
-    def extract_price(self) -> str | None:
-        if not self.driver:
-            return None
-
-        # 1. Новый метод: поиск через data-widget и кнопку
-        try:
-            web_price_block = WebDriverWait(self.driver, 15).until(
-                EC.presence_of_element_located((By.CSS_SELECTOR, "div[data-widget='webPrice']"))
-            )
-            # Ищем все span внутри кнопки
-            buttons = web_price_block.find_elements(By.CSS_SELECTOR, "button")
-            for button in buttons:
-                spans = button.find_elements(By.TAG_NAME, "span")
-                for span in spans:
-                    raw_price = span.text.strip()
-                    if '₽' in raw_price:
-                        # Очистка через регулярное выражение
-                        clean_price = re.sub(r'[^\d]', '', raw_price)
-                        if clean_price.isdigit():
-                            return clean_price
-        except Exception as e:
-            logger.debug(f"Data-widget parsing failed: {e}")
-
-        # 2. Резерв: старые селекторы
-        for selector in Config.PRICE_SELECTORS[1:]:
-            try:
-                price_element = WebDriverWait(self.driver, 10).until(
-                    EC.presence_of_element_located((By.CSS_SELECTOR, selector))
-                )
-                raw_price = price_element.text.strip()
-                if '₽' in raw_price:
-                    clean_price = re.sub(r'[^\d]', '', raw_price)
-                    if clean_price.isdigit():
-                        return clean_price
-            except:
-                continue
-
-        # 3. Финальный резерв: регулярные выражения
-        page_source = self.driver.page_source
-        for pattern in Config.PRICE_PATTERNS:
-            matches = re.findall(pattern, page_source)
-            if matches:
-                clean_price = re.sub(r'[^\d]', '', matches[0])
-                if clean_price.isdigit():
-                    return clean_price
-
-        return None
-
-    def is_blocked(self) -> bool:
-        if not self.driver: return False
-        blocks = [
-            "//*[contains(text(), 'Доступ ограничен')]",
-            "//*[contains(text(), 'Подозрительная активность')]",
-            "//*[contains(text(), 'Проверка безопасности')]",
-            "//*[contains(text(), 'Cloudflare')]",
-            "//*[contains(text(), 'Please verify you are a human')]"
-        ]
-        for xpath in blocks:
-            try:
-                element = self.driver.find_element(By.XPATH, xpath)
-                if element.is_displayed(): return True
-            except: continue
-        try: 
-            return self.driver.execute_script("""
-                return document.body.innerHTML.includes('Доступ ограничен') || 
-                       document.body.innerHTML.includes('Подозрительная активность') ||
-                       document.title.includes('Security check') ||
-                       document.querySelector('iframe[src*=\"challenge\"]') !== null;
-            """)
-        except: return False
-
     def handle_block(self):
         if not self.driver: return
         try:
@@ -485,8 +283,7 @@ class Parser:
             self.proxy_info = self.proxy_manager.get_proxy()
             self.user_agent = self.proxy_manager.get_random_user_agent()
             time.sleep(Config.PROXY_CHANGE_DELAY)
-            self.driver = self.setup_driver()
-            self.warm_up()
+            self.start_driver()
             if current_url: self.driver.get(current_url)
             self.anti_bot_counter = 0
         except Exception as e: logger.error(f"Identity rotation error: {e}")
@@ -531,8 +328,8 @@ def calculate_prices_for_api(base_price: float, condition: dict) -> tuple[float,
     
     return old_price, price, min_price
 
-def update_ozon_prices(offer_id: str, old_price: float, price: float, min_price: float) -> bool:
-    """Обновление цен товара через API Ozon"""
+def build_price_item(offer_id: str, old_price: float, price: float, min_price: float) -> dict:
+    """Формирует элемент массива prices для /v1/product/import/prices"""
     # Округляем все цены до целых чисел
     old_price_int = round_price(old_price) if old_price > 0 else 0
     price_int = round_price(price)
@@ -547,15 +344,7 @@ def update_ozon_prices(offer_id: str, old_price: float, price: float, min_price:
         old_price_int = price_int + 1
         logger.warning(f"Adjusted old_price for {offer_id} to {old_price_int}")
     
-    # Формируем запрос
-    url = f"{Config.BASE_URL}/v1/product/import/prices"
-    headers = {
-        "Client-Id": Config.CLIENT_ID,
-        "Api-Key": Config.API_KEY,
-        "Content-Type": "application/json"
-    }
-    
-    payload = {"prices": [{
+    return {
         "offer_id": str(offer_id),
         "old_price": str(old_price_int),
         "price": str(price_int),
@@ -563,52 +352,202 @@ def update_ozon_prices(offer_id: str, old_price: float, price: float, min_price:
         "currency_code": "RUB",
         "min_price_for_auto_actions_enabled": True,
         "price_strategy_enabled": "DISABLED"
-    }]}
+    }
 
-    for attempt in range(1, Config.MAX_API_ATTEMPTS + 1):
-        logger.info(f"Updating {offer_id} (attempt {attempt}): old={old_price_int}, price={price_int}, min={min_price_int}")
-        
-        try:
-            response = requests.post(
-                url, 
-                json=payload, 
-                headers=headers, 
-                timeout=Config.API_TIMEOUT
-            )
-            
-            if response.status_code == 200:
-                data = response.json()
-                # Проверяем результат обновления
-                for item in data.get("result", []):
-                    if item.get("offer_id") == offer_id and item.get("updated"):
-                        logger.success(f"Price updated successfully for {offer_id}")
-                        return True
-                # Логируем ошибки валидации
-                for item in data.get("result", []):
-                    if item.get("offer_id") == offer_id:
-                        errors = item.get("errors", [])
-                        for error in errors:
-                            logger.error(f"Validation error for {offer_id}: {error}")
-                logger.error(f"Failed to update prices for {offer_id}: {data}")
-                return False
-                
-            elif response.status_code == 429:
-                retry_after = int(response.headers.get('Retry-After', Config.BACKOFF_BASE ** attempt))
-                retry_after = min(retry_after, Config.BACKOFF_MAX)
-                logger.warning(f"Rate limit for {offer_id}, sleeping {retry_after}s")
-                time.sleep(retry_after)
-                continue
-                
+def update_ozon_prices(offer_id: str, old_price: float, price: float, min_price: float) -> bool:
+    """Обновление цен товара через API Ozon"""
+    item = build_price_item(offer_id, old_price, price, min_price)
+    payload = {"prices": [item]}
+
+    # Повторы при 429/5xx (с учетом Retry-After) выполняет общий клиент
+    logger.info(f"Updating {offer_id}: old={item['old_price']}, price={item['price']}, min={item['min_price']}")
+    data = get_client().post("/v1/product/import/prices", payload)
+    if data is None:
+        logger.error(f"Max attempts reached for update_prices {offer_id}")
+        return False
+
+    # Проверяем результат обновления
+    for item in data.get("result", []):
+        if item.get("offer_id") == offer_id and item.get("updated"):
+            logger.success(f"Price updated successfully for {offer_id}")
+            return True
+    # Логируем ошибки валидации
+    for item in data.get("result", []):
+        if item.get("offer_id") == offer_id:
+            errors = item.get("errors", [])
+            for error in errors:
+                logger.error(f"Validation error for {offer_id}: {error}")
+    logger.error(f"Failed to update prices for {offer_id}: {data}")
+    return False
+
+class PriceUpdateTicket:
+    """Результат отложенного обновления цены одного offer_id"""
+    def __init__(self, offer_id: str):
+        self.offer_id = offer_id
+        self.updated = False
+        self.errors: List = []
+        self._done = threading.Event()
+        self._lock = Lock()
+
+    def resolve(self, updated: bool, errors: List):
+        """Сохраняет результат; учитывается первый (поздний ответ после fail не меняет итог)"""
+        with self._lock:
+            if self._done.is_set():
+                return
+            self.updated = updated
+            self.errors = errors
+            self._done.set()
+
+    def fail(self, error: str):
+        """Завершает ожидание ошибкой, если результата ещё нет"""
+        self.resolve(False, [error])
+
+    def wait(self, timeout: Optional[float] = Config.PRICE_TICKET_TIMEOUT) -> bool:
+        """Ожидает отправки пачки; возвращает True, если Ozon подтвердил обновление"""
+        if not self._done.wait(timeout):
+            logger.error(f"No price batch result for {self.offer_id} in {timeout} sec")
+            self.fail(f"timeout {timeout} sec")
+        return self.updated
+
+class PriceBatchWriter:
+    """
+    Пакетная запись цен: накапливает обновления и отправляет их одним запросом
+    /v1/product/import/prices (до PRICE_BATCH_SIZE товаров) при заполнении пачки
+    или через max_delay секунд после первого обновления в пачке. При max_delay=None
+    пачка отправляется только по размеру и при flush()/close() (первый проход
+    пакетного режима: товар проверяется дольше, чем PRICE_BATCH_MAX_DELAY, и
+    отправка по времени уходила бы по одному товару).
+    Результат updated/errors по каждому offer_id возвращается через PriceUpdateTicket;
+    при любой ошибке отправки или закрытии writer тикеты завершаются ошибкой, поэтому
+    ticket.wait() не зависает.
+    """
+    def __init__(self, batch_size: int = Config.PRICE_BATCH_SIZE,
+                 max_delay: Optional[float] = Config.PRICE_BATCH_MAX_DELAY,
+                 rate_limiter: Optional[TokenBucket] = None):
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.rate_limiter = rate_limiter
+        self.lock = Lock()
+        self.pending: Dict[str, Tuple[dict, List[PriceUpdateTicket]]] = {}
+        self.outstanding: Set[PriceUpdateTicket] = set()
+        self.first_added_at: Optional[float] = None
+        self.requests_sent = 0
+        self.items_sent = 0
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._flusher = None
+        if max_delay is not None:
+            self._flusher = threading.Thread(target=self._flush_loop, name="PriceBatchWriter", daemon=True)
+            self._flusher.start()
+
+    def submit(self, offer_id: str, old_price: float, price: float, min_price: float) -> PriceUpdateTicket:
+        """Ставит обновление в очередь. Повторное обновление того же offer_id заменяет предыдущее"""
+        offer_id = str(offer_id)
+        item = build_price_item(offer_id, old_price, price, min_price)
+        ticket = PriceUpdateTicket(offer_id)
+        with self.lock:
+            self.outstanding.add(ticket)
+            if offer_id in self.pending:
+                self.pending[offer_id][1].append(ticket)
+                self.pending[offer_id] = (item, self.pending[offer_id][1])
             else:
-                logger.error(f"HTTP {response.status_code} for {offer_id}: {response.text}")
-                time.sleep(Config.BACKOFF_BASE ** attempt)
-                
+                self.pending[offer_id] = (item, [ticket])
+            if self.first_added_at is None:
+                self.first_added_at = time.monotonic()
+            batch_full = len(self.pending) >= self.batch_size
+        logger.info(f"Queued price update for {offer_id}: old={item['old_price']}, price={item['price']}, min={item['min_price']}")
+        if batch_full:
+            self.flush()
+        else:
+            self._wakeup.set()
+        return ticket
+
+    def flush(self):
+        """Немедленно отправляет все накопленные обновления"""
+        with self.lock:
+            batch = self.pending
+            self.pending = {}
+            self.first_added_at = None
+        if not batch:
+            return
+        entries = list(batch.items())
+        for i in range(0, len(entries), self.batch_size):
+            self._send(entries[i:i + self.batch_size])
+
+    def _send(self, entries: List[Tuple[str, Tuple[dict, List[PriceUpdateTicket]]]]):
+        """Отправляет пачку; тикеты без результата (исключение, неожиданный ответ) завершаются ошибкой"""
+        error = "no result in response"
+        try:
+            self._send_batch(entries)
         except Exception as e:
-            logger.error(f"Exception for {offer_id} on attempt {attempt}: {e}")
-            time.sleep(Config.BACKOFF_BASE ** attempt)
-    
-    logger.error(f"Max attempts reached for update_prices {offer_id}")
-    return False
+            logger.error(f"Price batch failed ({len(entries)} offers): {type(e).__name__}: {e}")
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            tickets = [ticket for _, (_, offer_tickets) in entries for ticket in offer_tickets]
+            for ticket in tickets:
+                ticket.fail(error)
+            with self.lock:
+                self.outstanding.difference_update(tickets)
+
+    def _send_batch(self, entries: List[Tuple[str, Tuple[dict, List[PriceUpdateTicket]]]]):
+        payload = {"prices": [item for _, (item, _) in entries]}
+        logger.info(f"Sending price batch: {len(entries)} offers")
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        data = get_client().post("/v1/product/import/prices", payload)
+        with self.lock:
+            self.requests_sent += 1
+            self.items_sent += len(entries)
+
+        results = {}
+        if data is None:
+            logger.error(f"Price batch failed ({len(entries)} offers)")
+        else:
+            results = {str(r.get("offer_id")): r for r in data.get("result", [])}
+
+        for offer_id, (_, tickets) in entries:
+            result = results.get(offer_id, {})
+            updated = bool(result.get("updated"))
+            errors = result.get("errors", []) if data is not None else ["request failed"]
+            if updated:
+                logger.success(f"Price updated successfully for {offer_id}")
+            else:
+                for error in errors:
+                    logger.error(f"Validation error for {offer_id}: {error}")
+            for ticket in tickets:
+                ticket.resolve(updated, errors)
+
+    def _flush_loop(self):
+        while not self._stopped:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            while not self._stopped:
+                with self.lock:
+                    started = self.first_added_at
+                if started is None:
+                    break
+                remaining = self.max_delay - (time.monotonic() - started)
+                if remaining <= 0:
+                    self.flush()
+                    break
+                time.sleep(min(remaining, 0.5))
+
+    def close(self):
+        """Отправляет остаток, останавливает фоновый поток и завершает ошибкой тикеты без результата"""
+        self.flush()
+        self._stopped = True
+        self._wakeup.set()
+        if self._flusher:
+            self._flusher.join(timeout=5)
+        with self.lock:
+            leftover = list(self.outstanding)
+            self.outstanding.clear()
+            self.pending = {}
+        for ticket in leftover:
+            ticket.fail("price writer closed")
+        if leftover:
+            logger.error(f"Price writer closed with {len(leftover)} unresolved updates")
+        logger.info(f"Price writer: {self.items_sent} offers in {self.requests_sent} API requests")
 
 def get_condition(offset: float) -> dict:
     """Выбор условия обработки по проценту отклонения"""
@@ -619,182 +558,642 @@ def get_condition(offset: float) -> dict:
 
 def parse_price_str(price_str: str) -> float:
     """Преобразование строки цены в число"""
-    clean = re.sub(r'[^\d]', '', price_str)
+    clean = NON_DIGITS_RE.sub('', price_str)
     try:
         return float(clean) if clean else 0.0
     except ValueError:
         return 0.0
 
-def find_latest_bad_price_file() -> Optional[str]:
-    """Поиск последнего файла с проблемными ценами"""
+def is_bad_price_file(path: str) -> bool:
+    return path.endswith(RECORDS_EXT) or path.endswith(LEGACY_EXT)
+
+def is_converted_legacy_file(path: str) -> bool:
+    """Старый .txt, рядом с которым уже есть .jsonl (python price_records.py без --remove-source)"""
+    return path.endswith(LEGACY_EXT) and os.path.exists(records_path(path))
+
+def find_bad_price_files() -> List[str]:
+    """
+    Необработанные файлы с проблемными ценами, от старых к новым.
+    Сконвертированный .txt пропускается: обрабатывается его .jsonl
+    """
     try:
-        files = glob.glob("in/bad_price_*.txt")
-        if not files:
-            return None
-        # Сортировка по дате создания (по имени файла)
-        files.sort(key=os.path.getmtime, reverse=True)
-        return files[0]
+        files = glob.glob(f"in/bad_price_*{RECORDS_EXT}") + glob.glob(f"in/bad_price_*{LEGACY_EXT}")
+        files = [path for path in files if not is_converted_legacy_file(path)]
+        files.sort(key=os.path.getmtime)
+        return files
     except Exception as e:
         logger.error(f"Ошибка поиска файлов: {str(e)}")
+        return []
+
+def read_work_source() -> Optional[str]:
+    """bad_price файл, из которого создан рабочий файл (None - неизвестен)"""
+    try:
+        with open(WORK_SOURCE_FILE, 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
         return None
 
 def prepare_in_work_file(source_file: str) -> Optional[str]:
-    """Подготовка рабочего файла"""
+    """
+    Подготовка рабочего файла (старый текстовый формат конвертируется в JSON Lines).
+    Путь к исходному файлу сохраняется в WORK_SOURCE_FILE: после обработки
+    (в том числе продолженной после перезапуска) перемещается именно он.
+    """
     try:
         os.makedirs("in_work", exist_ok=True)
-        dest_file = os.path.join("in_work", "inwork.txt")
-        shutil.copy(source_file, dest_file)
-        logger.info(f"Создан рабочий файл: {dest_file}")
+        dest_file = IN_WORK_FILE
+        if source_file.endswith(LEGACY_EXT):
+            convert_legacy_file(source_file, dest_file)
+        else:
+            shutil.copy(source_file, dest_file)
+        # Журнал прошлого рабочего файла к новому не относится
+        ProgressJournal(dest_file).discard()
+        with open(WORK_SOURCE_FILE, 'w', encoding='utf-8') as f:
+            f.write(source_file)
+        logger.info(f"Создан рабочий файл: {dest_file} (из {source_file})")
         return dest_file
     except Exception as e:
         logger.error(f"Ошибка подготовки файла: {str(e)}")
         return None
 
-def process_product_line(line: str, parser: Parser) -> str:
-    """Обработка строки с товаром"""
-    parts = line.strip().split()
-    if len(parts) < 11:
+def migrate_legacy_work_file():
+    """
+    Рабочий файл inwork.txt прежней версии конвертируется в inwork.jsonl вместе
+    с журналом: строки старого формата в журнале читает loads_record.
+    """
+    if not os.path.exists(LEGACY_IN_WORK_FILE) or os.path.exists(IN_WORK_FILE):
+        return
+    try:
+        convert_legacy_file(LEGACY_IN_WORK_FILE, IN_WORK_FILE)
+        legacy_journal = ProgressJournal(LEGACY_IN_WORK_FILE)
+        if os.path.exists(legacy_journal.path):
+            os.replace(legacy_journal.path, ProgressJournal(IN_WORK_FILE).path)
+        os.remove(LEGACY_IN_WORK_FILE)
+        logger.info(f"Рабочий файл {LEGACY_IN_WORK_FILE} конвертирован в {IN_WORK_FILE}")
+    except Exception as e:
+        logger.error(f"Ошибка конвертации рабочего файла: {str(e)}")
+
+class ProgressJournal:
+    """
+    Журнал прогресса обработки рабочего файла (append-only, JSON Lines).
+    На каждый обработанный товар дописывается одна запись {"i": индекс, "status": ..., "line": ...},
+    fsync выполняется пачками. Рабочий файл целиком перезаписывается только при
+    компактировании, поэтому стоимость сохранения прогресса не зависит от размера файла.
+    После компактирования в журнале остаются только статусы (без строк).
+    Статусы: "in_range", "queued", "failed" (первый проход пакетного режима) и "done".
+    """
+
+    def __init__(self, work_file: str, fsync_every: int = Config.JOURNAL_FSYNC_EVERY,
+                 fsync_interval: float = Config.JOURNAL_FSYNC_INTERVAL):
+        self.work_file = work_file
+        self.path = f"{work_file}.journal"
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.file = None
+        self.pending = 0
+        self.records = 0
+        self.statuses: Dict[int, str] = {}
+        self.last_sync = time.monotonic()
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path) and os.path.getsize(self.path) > 0
+
+    def replay(self, lines: List[str]) -> Dict[int, str]:
+        """Применяет записи журнала к строкам файла. Возвращает {индекс: последний статус}"""
+        statuses = self.statuses
+        if not os.path.exists(self.path):
+            return statuses
+
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for raw in f:
+                try:
+                    record = json.loads(raw)
+                    i = int(record["i"])
+                except (ValueError, KeyError, TypeError):
+                    # Недописанная последняя запись после аварийного завершения
+                    logger.warning(f"Пропущена повреждённая запись журнала: {raw[:100]!r}")
+                    continue
+                if 0 <= i < len(lines):
+                    if "line" in record:
+                        lines[i] = record["line"].rstrip("\n") + "\n"
+                    statuses[i] = record["status"]
+        logger.info(f"Из журнала восстановлен прогресс по {len(statuses)} товарам")
+        return statuses
+
+    def append(self, index: int, line: str, status: str):
+        """Дописывает запись о товаре; данные сразу уходят в ОС, fsync - раз в fsync_every записей"""
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        record = {"i": index, "status": status, "line": line.rstrip("\n")}
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+        self.statuses[index] = status
+        self.pending += 1
+        self.records += 1
+        if self.pending >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.file is not None and self.pending:
+            os.fsync(self.file.fileno())
+            self.pending = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+    @staticmethod
+    def _write_atomic(path: str, content_lines: List[str]):
+        tmp_file = f"{path}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.writelines(content_lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, path)
+
+    def compact(self, lines: List[str]):
+        """
+        Атомарно записывает актуальные строки в рабочий файл, а журнал заменяет
+        списком статусов, чтобы после сбоя не проверять уже обработанные товары заново.
+        """
+        self.close()
+        self._write_atomic(self.work_file, lines)
+        self._write_atomic(self.path, [
+            json.dumps({"i": i, "status": status}) + "\n" for i, status in sorted(self.statuses.items())
+        ])
+        logger.debug(f"Журнал компактирован в {self.work_file} ({self.records} записей)")
+        self.records = 0
+
+    def finish(self, lines: List[str]):
+        """Файл обработан полностью: сохраняет строки и удаляет журнал"""
+        self.close()
+        self._write_atomic(self.work_file, lines)
+        self.discard()
+
+    def discard(self):
+        self.close()
+        self.statuses = {}
+        self.records = 0
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+def check_card_price(record: dict, parser: Parser, resolver: Optional[CardPriceResolver] = None,
+                     cache: Optional[ScrapeCache] = None, bypass_cache: bool = False) -> Optional[Tuple[float, float]]:
+    """
+    Получает цену "С Ozon картой" (из API через resolver, из кэша парсинга,
+    иначе парсингом) и обновляет в записи цену и отклонение.
+    parser - Parser или LazyLease: с LazyLease браузер берётся из пула только
+    для парсинга, цена из API или кэша его не занимает.
+    bypass_cache - проверка после коррекции: цена всегда парсится заново
+    """
+    url = record["url"]
+    ozon_price = resolver.api_price(record["ozon_id"], record["offer_id"]) if resolver else None
+    cached_price = None
+    if ozon_price is None and cache:
+        cached_price = cache.get(url, bypass=bypass_cache)
+    if ozon_price is not None:
+        logger.info(f"Цена по карте из API: {ozon_price}")
+    elif cached_price is not None:
+        ozon_price = cached_price
+        logger.info(f"Цена по карте из кэша парсинга: {ozon_price}")
+    else:
+        logger.info(f"Парсинг цены: {url}")
+        ozon_price_str = parser.parse_price(url)
+        ozon_price = parse_price_str(ozon_price_str) if ozon_price_str else None
+        if resolver:
+            resolver.record_scrape(ozon_price, record["ozon_id"], record["offer_id"])
+        if not ozon_price:
+            return None
+        if cache:
+            cache.put(url, ozon_price, ozon_price_str)
+
+    record["ozon_price"] = ozon_price
+
+    current_offset = calculate_deviation(float(record["price_1c"]), ozon_price)
+    record["deviation"] = round(current_offset, 2)
+    logger.info(f"Текущее отклонение: {current_offset:.2f}%")
+    return ozon_price, current_offset
+
+def is_price_in_range(price_1c_val: float, ozon_price: float) -> bool:
+    """Проверка, находится ли цена по карте в допустимом диапазоне"""
+    """
+    ВМЕСТО ЭТОГО ДИАПАЗОНА НУЖНО РАСЧИТАТЬ ДРУГОЙ
+    
+    # 3. Проверяем, находится ли цена в допустимом диапазоне (±3%)
+    lower_bound = price_1c_val * (1 - Config.PRICE_TOLERANCE)
+    upper_bound = price_1c_val * (1 + Config.PRICE_TOLERANCE)
+    logger.info(f"Диапазон цен: {lower_bound:.2f}-{upper_bound:.2f}, текущая: {ozon_price}")
+    
+    """
+    lower_bound = price_1c_val
+    upper_bound = price_1c_val * (1 + Config.PRICE_TOLERANCE)
+    logger.info(f"Диапазон цен: {lower_bound:.2f}-{upper_bound:.2f}, текущая: {ozon_price}")
+
+    if lower_bound <= ozon_price <= upper_bound:
+        logger.success(f"Цена в диапазоне: {ozon_price}")
+        return True
+    logger.warning(f"Цена вне диапазона: {ozon_price} не входит в [{lower_bound:.2f}, {upper_bound:.2f}]")
+    return False
+
+def plan_price_correction(record: dict, base_price: float, current_offset: float) -> Tuple[int, int, int]:
+    """Рассчитывает новые цены по условию для текущего отклонения и записывает их в запись"""
+    condition = get_condition(current_offset)
+    logger.info(f"Условие для отклонения {current_offset}%: {condition}")
+
+    new_old, new_price, new_min = calculate_prices_for_api(float(base_price), condition)
+
+    # Округление цен
+    new_old = round(new_old)
+    new_price = round(new_price)
+    new_min = round(new_min)
+
+    # Обновление данных в записи
+    record["base_price"] = new_price
+    record["old_price"] = new_old
+    record["min_price"] = new_min
+    return new_old, new_price, new_min
+
+def record_correction(offer_id: str, new_old: int, new_price: int, new_min: int, updated: bool,
+                      errors: Optional[List] = None, deviation: Optional[float] = None,
+                      ozon_id: Optional[str] = None):
+    """Сохраняет отправленную коррекцию в историю хранилища состояния"""
+    if not Config.STATE_STORE:
+        return
+    store = get_store(Config.STATE_DB_PATH)
+    if store is None:
+        return
+    try:
+        store.add_correction(offer_id, new_old, new_price, new_min, updated, errors=errors, deviation=deviation,
+                             ozon_id=ozon_id)
+    except Exception as e:
+        logger.warning(f"Коррекция {offer_id} не записана в хранилище состояния: {str(e)}")
+
+def send_price_correction(offer_id: str, new_old: int, new_price: int, new_min: int,
+                          price_writer: Optional[PriceBatchWriter] = None,
+                          deviation: Optional[float] = None, ozon_id: Optional[str] = None) -> bool:
+    """Отправляет цены через API: сразу или через пакетную запись с ожиданием результата"""
+    logger.info(f"Отправка обновленных цен для {offer_id}")
+    errors = None
+    if price_writer:
+        ticket = price_writer.submit(offer_id, new_old, new_price, new_min)
+        updated = ticket.wait()
+        errors = ticket.errors
+    else:
+        updated = update_ozon_prices(offer_id, new_old, new_price, new_min)
+    record_correction(offer_id, new_old, new_price, new_min, updated, errors=errors, deviation=deviation,
+                      ozon_id=ozon_id)
+
+    if updated:
+        logger.success(f"Цены успешно обновлены на Ozon для {offer_id}")
+    else:
+        logger.error(f"Ошибка при обновлении цен на Ozon для {offer_id}")
+    return updated
+
+def process_product_line(line: str, parser: Parser, price_writer: Optional[PriceBatchWriter] = None,
+                         resolver: Optional[CardPriceResolver] = None, cache: Optional[ScrapeCache] = None,
+                         bypass_cache: bool = False) -> str:
+    """
+    Обработка строки с товаром (запись JSON Lines, см. price_records.py).
+    bypass_cache - цена товара уже изменена (первый проход пакетного режима),
+    первая проверка идёт мимо кэша парсинга; проверки после коррекции - всегда
+    """
+    try:
+        record = loads_record(line)
+    except ValueError:
+        record = None
+    if record is None:
         return line
     
     try:
-        # Извлечение данных из строки
-        product_id = parts[0]
-        sku = parts[1]
-        offer_id = parts[2]
-        offset_str = parts[3].rstrip('%')
-        base_price = parts[4]
-        old_price = parts[5]
-        min_price = parts[6]
-        price_1c = parts[7]
-        card_price = parts[8]
-        product_name = " ".join(parts[9:-1])
-        url = parts[-1]
-        
-        # Преобразование числовых значений
-        price_1c_val = float(price_1c)
+        # Извлечение данных из записи
+        offer_id = record["offer_id"]
+        base_price = float(record["base_price"])
+        price_1c_val = float(record["price_1c"])
         
         # Основной цикл обработки товара
         for attempt in range(1, Config.MAX_ATTEMPTS_PER_PRODUCT + 1):
-            # 1. Парсим текущую цену "С Ozon картой"
-            logger.info(f"Парсинг цены: {url}")
-            ozon_price_str = parser.parse_price(url)
-            
-            if not ozon_price_str:
+            # 1-2. Парсим текущую цену "С Ozon картой" и вычисляем отклонение
+            checked = check_card_price(record, parser, resolver, cache, bypass_cache)
+            if not checked:
                 logger.warning("Цена не получена, попытка пропущена")
                 time.sleep(20)
                 continue
-                
-            ozon_price = parse_price_str(ozon_price_str)
-            parts[8] = str(ozon_price)
-            
-            # 2. Вычисляем текущее отклонение
-            current_offset = calculate_deviation(price_1c_val, ozon_price)
-            formatted_offset = f"{current_offset:.2f}%"
-            parts[3] = formatted_offset
-            logger.info(f"Текущее отклонение: {formatted_offset}")
-            
-            
+            ozon_price, current_offset = checked
             
-            
-            """
-            ВМЕСТО ЭТОГО ДИАПАЗОНА НУЖНО РАСЧИТАТЬ ДРУГОЙ
-            
-            # 3. Проверяем, находится ли цена в допустимом диапазоне (±3%)
-            lower_bound = price_1c_val * (1 - Config.PRICE_TOLERANCE)
-            upper_bound = price_1c_val * (1 + Config.PRICE_TOLERANCE)
-            logger.info(f"Диапазон цен: {lower_bound:.2f}-{upper_bound:.2f}, текущая: {ozon_price}")
-            
-            """
-            # 3. Проверяем, находится ли цена в допустимом диапазоне (±3%)
-            lower_bound = price_1c_val
-            upper_bound = price_1c_val * (1 + Config.PRICE_TOLERANCE)
-            logger.info(f"Диапазон цен: {lower_bound:.2f}-{upper_bound:.2f}, текущая: {ozon_price}")
-            
-            if lower_bound <= ozon_price <= upper_bound:
-                logger.success(f"Цена в диапазоне: {ozon_price}")
+            # 3. Проверяем, находится ли цена в допустимом диапазоне
+            if is_price_in_range(price_1c_val, ozon_price):
                 break
-            else:
-                logger.warning(f"Цена вне диапазона: {ozon_price} не входит в [{lower_bound:.2f}, {upper_bound:.2f}]")
-                
-                # 4. Определяем условие обработки по текущему отклонению
-                condition = get_condition(current_offset)
-                logger.info(f"Условие для отклонения {current_offset}%: {condition}")
-                
-                # 5. Рассчитываем новые цены
-                try:
-                    base_val = float(base_price)
-                    new_old, new_price, new_min = calculate_prices_for_api(base_val, condition)
-                    
-                    # Округление цен
-                    new_old = round(new_old)
-                    new_price = round(new_price)
-                    new_min = round(new_min)
-                    
-                    # Обновление данных в строке
-                    parts[4] = str(new_price)
-                    parts[5] = str(new_old)
-                    parts[6] = str(new_min)
+            
+            # 4-6. Рассчитываем новые цены и обновляем их через API
+            try:
+                new_old, new_price, new_min = plan_price_correction(record, base_price, current_offset)
+                send_price_correction(offer_id, new_old, new_price, new_min, price_writer,
+                                      deviation=round(current_offset, 2), ozon_id=record["ozon_id"])
+                # marketing_price в API обновится не сразу: проверка после коррекции - браузером
+                if resolver:
+                    resolver.invalidate(record["ozon_id"], offer_id)
+                if cache:
+                    cache.invalidate(record["url"])
+                bypass_cache = True
                     
-                    # 6. Обновляем цены через API
-                    logger.info(f"Отправка обновленных цен для {offer_id}")
-                    if update_ozon_prices(offer_id, new_old, new_price, new_min):
-                        logger.success(f"Цены успешно обновлены на Ozon для {offer_id}")
-                    else:
-                        logger.error(f"Ошибка при обновлении цен на Ozon для {offer_id}")
-                        
-                    # 7. Обновляем базовую цену для возможной следующей итерации
-                    base_price = str(new_price)
-                except Exception as e:
-                    logger.error(f"Ошибка расчета цен: {str(e)}")
-                    break
-                
-                # Задержка перед повторной проверкой
-                retry_delay = random.uniform(2, 5)  # Увеличена задержка для обновления цен на Ozon
-                logger.info(f"Ожидание обновления цен {retry_delay:.1f} сек. (попытка {attempt})")
-                time.sleep(retry_delay)
+                # 7. Обновляем базовую цену для возможной следующей итерации
+                base_price = new_price
+            except Exception as e:
+                logger.error(f"Ошибка расчета цен: {str(e)}")
+                break
+            
+            # Задержка перед повторной проверкой
+            retry_delay = random.uniform(2, 5)  # Увеличена задержка для обновления цен на Ozon
+            logger.info(f"Ожидание обновления цен {retry_delay:.1f} сек. (попытка {attempt})")
+            time.sleep(retry_delay)
         else:
             logger.warning(f"Достигнуто максимальное количество попыток для товара")
         
         # Формирование обновленной строки
-        return " ".join(parts)
+        return dumps_record(record)
         
     except Exception as e:
         logger.error(f"Критическая ошибка обработки: {str(e)}")
         return line
 
-def process_in_work_file(in_work_file: str, proxy_manager: ProxyManager):
-    """Обработка рабочего файла"""
-    traffic_monitor = TrafficMonitor()
-    parser = Parser(proxy_manager, traffic_monitor)
+def queue_product_correction(line: str, parser: Parser, price_writer: PriceBatchWriter,
+                             resolver: Optional[CardPriceResolver] = None, cache: Optional[ScrapeCache] = None
+                             ) -> Tuple[str, str, Optional[PriceUpdateTicket]]:
+    """
+    Первый проход пакетного режима: одна проверка цены и постановка коррекции
+    в очередь без ожидания ответа API.
+    Возвращает (строка, статус, ticket), статус: "in_range", "queued" или "failed".
+    """
+    try:
+        record = loads_record(line)
+    except ValueError:
+        record = None
+    if record is None:
+        return line, "failed", None
+
+    try:
+        checked = check_card_price(record, parser, resolver, cache)
+        if not checked:
+            logger.warning("Цена не получена, товар будет обработан во втором проходе")
+            return dumps_record(record), "failed", None
+        ozon_price, current_offset = checked
+
+        if is_price_in_range(float(record["price_1c"]), ozon_price):
+            return dumps_record(record), "in_range", None
+
+        new_old, new_price, new_min = plan_price_correction(record, float(record["base_price"]), current_offset)
+        ticket = price_writer.submit(record["offer_id"], new_old, new_price, new_min)
+        if resolver:
+            resolver.invalidate(record["ozon_id"], record["offer_id"])
+        if cache:
+            cache.invalidate(record["url"])
+        return dumps_record(record), "queued", ticket
+
+    except Exception as e:
+        logger.error(f"Критическая ошибка обработки: {str(e)}")
+        return line, "failed", None
+
+def create_card_price_resolver(lines: List[str]) -> Optional[CardPriceResolver]:
+    """Резолвер цен по карте с ценами API для всех товаров рабочего файла (Config.CARD_PRICE_API_FIRST)"""
+    if not Config.CARD_PRICE_API_FIRST:
+        return None
+    store = get_store(Config.STATE_DB_PATH) if Config.STATE_STORE else None
+    resolver = CardPriceResolver(store=store, tolerance_pct=Config.CARD_PRICE_API_TOLERANCE)
+    ozon_ids = []
+    for line in lines:
+        try:
+            record = loads_record(line)
+        except ValueError:
+            record = None
+        if record:
+            ozon_ids.append(record["ozon_id"])
+    try:
+        resolver.prefetch(ozon_ids)
+    except Exception as e:
+        logger.error(f"Ошибка получения цен из API, цены будут парситься: {str(e)}")
+    return resolver
+
+def create_parser_pool(proxy_manager: ProxyManager, size: int = Config.PRICE_WORKERS) -> DriverPool:
+    """Пул браузеров для обработки рабочих файлов; переиспользуется между файлами одного процесса main()"""
+    return DriverPool(
+        lambda: Parser(proxy_manager, traffic_monitor), size=size, max_pages=Config.POOL_MAX_PAGES,
+        max_heap_growth_mb=Config.POOL_MAX_HEAP_GROWTH_MB, name="update_price"
+    )
+
+def run_product_workers(indexes: List[int], pool: DriverPool, workers: int, handle, label: str):
+    """
+    Обработка товаров несколькими потоками: потоки забирают индексы строк из
+    общей очереди и на каждый товар получают LazyLease пула - браузер берётся,
+    только если цену нужно парсить. Пауза PRODUCT_DELAY_RANGE - только после
+    товаров, страница которых загружалась.
+    handle(i, parser) обрабатывает одну строку и сам сохраняет результат.
+    По завершении пишет в лог статистику по каждому потоку.
+    """
+    tasks: Queue = Queue()
+    for i in indexes:
+        tasks.put(i)
+
+    stats = [{"processed": 0, "scraped": 0, "errors": 0, "busy": 0.0} for _ in range(workers)]
+    started = time.perf_counter()
+
+    def worker(n: int):
+        while True:
+            try:
+                i = tasks.get_nowait()
+            except Empty:
+                return
+            logger.info(f"[Поток {n + 1}] {label} товара {i + 1}")
+            item_started = time.perf_counter()
+            scraped = False
+            try:
+                with pool.lazy_session() as parser:
+                    try:
+                        handle(i, parser)
+                    finally:
+                        scraped = parser.used
+            except Exception as e:
+                stats[n]["errors"] += 1
+                logger.error(f"[Поток {n + 1}] Ошибка обработки строки {i + 1}: {str(e)}")
+            stats[n]["processed"] += 1
+            stats[n]["scraped"] += int(scraped)
+            stats[n]["busy"] += time.perf_counter() - item_started
+
+            # Задержка между товарами одного браузера (цена из API или кэша её не требует)
+            if scraped and not tasks.empty():
+                delay = random.uniform(*Config.PRODUCT_DELAY_RANGE)
+                time.sleep(delay)
+
+    threads = [
+        threading.Thread(target=worker, args=(n,), name=f"PriceWorker-{n + 1}", daemon=True)
+        for n in range(workers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - started
+    for n, stat in enumerate(stats):
+        per_minute = stat["processed"] / elapsed * 60 if elapsed > 0 else 0
+        avg = stat["busy"] / stat["processed"] if stat["processed"] else 0
+        logger.info(
+            f"[Поток {n + 1}] {label}: товаров {stat['processed']} ({per_minute:.1f}/мин), "
+            f"с парсингом {stat['scraped']}, ошибок {stat['errors']}, в среднем {avg:.1f} сек. на товар"
+        )
+    total = sum(stat["processed"] for stat in stats)
+    logger.info(f"{label}: {total} товаров за {elapsed:.1f} сек. ({workers} потоков)")
+
+def process_in_work_file(in_work_file: str, proxy_manager: ProxyManager, batch_mode: bool = Config.PRICE_BATCH_MODE,
+                         workers: int = Config.PRICE_WORKERS, pool: Optional[DriverPool] = None):
+    """
+    Обработка рабочего файла.
+    В пакетном режиме сначала все товары проверяются один раз, а коррекции цен
+    отправляются пачками; затем полный цикл с проверкой выполняется только
+    для товаров, которые были вне диапазона или не распарсились.
+    При workers > 1 товары обрабатываются параллельно несколькими браузерами
+    (run_product_workers), цены пишутся через один общий PriceBatchWriter.
+    Браузер берётся из pool на товар, только если цену нужно парсить (нет цены
+    из API и кэша); пауза между товарами - только после парсинга. Без pool
+    создаётся свой пул и закрывается по окончании файла.
+    Коррекции первого прохода отправляются только полными пачками и в конце
+    прохода (batch_writer без отправки по времени), второго - через price_writer
+    с PRICE_BATCH_MAX_DELAY: там каждый товар ждёт результата своей коррекции.
+    """
+    workers = max(1, workers)
+    own_pool = pool is None
+    if own_pool:
+        pool = create_parser_pool(proxy_manager, workers)
+    rate_limiter = TokenBucket(Config.API_RATE_LIMIT, Config.API_RATE_BURST)
+    batch_writer = PriceBatchWriter(max_delay=None, rate_limiter=rate_limiter)
+    price_writer = PriceBatchWriter(rate_limiter=rate_limiter)
+    journal = ProgressJournal(in_work_file)
+    progress_lock = Lock()
     
     with open(in_work_file, 'r', encoding='utf-8') as f:
         lines = f.readlines()
     
     total_lines = len(lines)
     logger.info(f"Начата обработка {total_lines} товаров")
-    
-    # Обработка каждой строки с немедленным сохранением
-    for i, line in enumerate(lines):
-        line = line.strip()
-        if not line:
-            continue
-            
-        logger.info(f"Обработка товара {i+1}/{total_lines}")
-        processed_line = process_product_line(line, parser)
-        lines[i] = processed_line + "\n"
-        
-        # Немедленное сохранение прогресса
-        with open(in_work_file, 'w', encoding='utf-8') as f:
-            f.writelines(lines)
-        
-        # Задержка между товарами
-        if i < total_lines - 1:
+    resolver = create_card_price_resolver(lines)
+    cache = None
+    if Config.SCRAPE_CACHE:
+        cache = open_cache(Config.SCRAPE_CACHE_PATH, Config.SCRAPE_CACHE_TTL, Config.SCRAPE_CACHE_MAX_ENTRIES)
+
+    # Продолжение прерванной обработки: применяем журнал и пропускаем готовые товары
+    statuses = journal.replay(lines)
+    # Товары с уже отправленной коррекцией: во втором проходе цена проверяется мимо кэша
+    corrected = {i for i, status in statuses.items() if status == "queued"}
+
+    def save_progress(i: int, processed_line: str, status: str):
+        # Строки пишутся по своим индексам, поэтому порядок в файле сохраняется при любом числе потоков
+        with progress_lock:
+            lines[i] = processed_line.rstrip("\n") + "\n"
+            journal.append(i, lines[i], status)
+            if journal.records >= Config.JOURNAL_COMPACT_EVERY:
+                journal.compact(lines)
+
+    def product_delay(position: int, count: int, scraped: bool):
+        if scraped and position < count - 1:
             delay = random.uniform(*Config.PRODUCT_DELAY_RANGE)
             logger.info(f"Пауза {delay:.1f} сек.")
             time.sleep(delay)
+
+    try:
+        to_process = [
+            i for i, line in enumerate(lines)
+            if line.strip() and statuses.get(i) not in ("done", "in_range")
+        ]
+        if statuses:
+            logger.info(f"Осталось обработать {len(to_process)} товаров")
+
+        if batch_mode:
+            # Товары, уже проверенные в первом проходе до прерывания, сразу идут во второй
+            retry_indexes = [i for i in to_process if i in statuses]
+            first_pass = [i for i in to_process if i not in statuses]
+
+            logger.info("Пакетный режим: первый проход по всем товарам")
+            tickets: Dict[int, PriceUpdateTicket] = {}
+
+            def check_line(i: int, line_parser: LazyLease):
+                processed_line, status, ticket = queue_product_correction(
+                    lines[i], line_parser, batch_writer, resolver, cache
+                )
+                save_progress(i, processed_line, status)
+                with progress_lock:
+                    if status != "in_range":
+                        retry_indexes.append(i)
+                    if ticket:
+                        tickets[i] = ticket
+                        corrected.add(i)
+
+            if workers > 1:
+                run_product_workers(first_pass, pool, workers, check_line, "Проверка")
+            else:
+                for n, i in enumerate(first_pass):
+                    logger.info(f"Проверка товара {i+1}/{total_lines}")
+                    with pool.lazy_session() as parser:
+                        check_line(i, parser)
+                    product_delay(n, len(first_pass), parser.used)
+
+            # Отправляем остаток и сопоставляем результаты API со строками
+            batch_writer.flush()
+            updated_count = 0
+            for i, ticket in tickets.items():
+                if ticket.wait():
+                    updated_count += 1
+                else:
+                    logger.error(f"Строка {i+1} ({ticket.offer_id}): цены не обновлены: {ticket.errors}")
+                record = loads_record(lines[i])
+                record_correction(ticket.offer_id, record["old_price"], record["base_price"], record["min_price"],
+                                  ticket.updated, errors=ticket.errors, deviation=record["deviation"],
+                                  ozon_id=record["ozon_id"])
+            logger.info(
+                f"Первый проход завершен: обновлено {updated_count}/{len(tickets)} товаров, "
+                f"на повторную проверку {len(retry_indexes)}"
+            )
+            to_process = sorted(retry_indexes)
+            journal.compact(lines)
+    
+        # Обработка каждой строки с записью прогресса в журнал
+        def correct_line(i: int, line_parser: LazyLease):
+            processed_line = process_product_line(
+                lines[i], line_parser, price_writer, resolver, cache, bypass_cache=i in corrected
+            )
+            # Сохранение прогресса (одна запись в журнал)
+            save_progress(i, processed_line, "done")
+
+        if workers > 1:
+            run_product_workers(to_process, pool, workers, correct_line, "Обработка")
+        else:
+            for n, i in enumerate(to_process):
+                logger.info(f"Обработка товара {i+1}/{total_lines}")
+                with pool.lazy_session() as parser:
+                    correct_line(i, parser)
+                
+                # Задержка между товарами (если страница загружалась)
+                product_delay(n, len(to_process), parser.used)
+
+        # Файл обработан полностью: следующий цикл начнёт его с начала
+        journal.finish(lines)
+    finally:
+        journal.close()
+        batch_writer.close()
+        price_writer.close()
+        if own_pool:
+            pool.close()
+        else:
+            pool.log_stats()
+        if resolver:
+            resolver.log_summary()
+        if cache:
+            cache.log_summary()
+            cache.close()
+        logger.info(f"Трафик: {traffic_monitor.get_total_traffic()}, загрузка страниц: {traffic_monitor.get_profile_summary()}")
     
     logger.success(f"Файл обработан: {in_work_file}")
-    parser.quit()
 
 def move_processed_file(source_file: str):
     """Перемещение обработанного файла"""
@@ -808,94 +1207,82 @@ def move_processed_file(source_file: str):
     except Exception as e:
         logger.error(f"Ошибка перемещения файла: {str(e)}")
 
-def check_file_age(file_path: str) -> bool:
-    """Проверка возраста файла (в минутах)"""
-    if not os.path.exists(file_path):
-        return True
-        
-    file_time = os.path.getmtime(file_path)
-    current_time = time.time()
-    age_minutes = (current_time - file_time) / 60
-    return age_minutes > Config.MAX_FILE_AGE_MINUTES
-
 def main():
     """Основной цикл программы"""
     logger.info("Запуск Ozon Price Corrector")
-    proxy_manager = ProxyManager()
+    proxy_manager = ProxyManager(Config)
     
     # Создаем необходимые директории
     os.makedirs("in", exist_ok=True)
     os.makedirs("in/processed", exist_ok=True)
     os.makedirs("in_work", exist_ok=True)
+
+    # Новые bad_price файлы будят основной цикл сразу, не дожидаясь FILE_CHECK_INTERVAL
+    watcher = DirectoryWatcher("in", "bad_price_*", poll_interval=Config.WATCH_POLL_INTERVAL)
+    migrate_legacy_work_file()
+    # Браузеры переживают обработку файла (в пределах этого процесса): следующий файл
+    # не ждёт запуска Chrome и warm_up
+    pool = create_parser_pool(proxy_manager)
     
+    # Очередь bad_price файлов: найденные при запуске и те, о которых сообщил watcher
+    # (в том числе появившиеся во время обработки). Источник текущего рабочего файла
+    # в очередь не попадает - он обрабатывается как рабочий файл
+    pending = [path for path in find_bad_price_files() if path != read_work_source()]
+
     while True:
         try:
-            in_work_dir = "in_work"
-            in_work_file_path = os.path.join(in_work_dir, "inwork.txt")
-            latest_bad = find_latest_bad_price_file()
-            
-            # Переменная для отслеживания, нужно ли обрабатывать файл
-            should_process = False
+            in_work_file_path = IN_WORK_FILE
             work_file_to_process = None
             
-            if os.path.exists(in_work_file_path):
-                logger.info(f"Найден рабочий файл: {in_work_file_path}")
-                
-                # Проверяем возраст файла
-                if check_file_age(in_work_file_path):
-                    logger.info("Файл устарел (более 30 минут)")
-                    
-                    if latest_bad:
-                        bad_mtime = os.path.getmtime(latest_bad)
-                        work_mtime = os.path.getmtime(in_work_file_path)
-                        
-                        if bad_mtime > work_mtime:
-                            logger.info("Найден новый файл bad_price, обновляем рабочий файл")
-                            new_work_file = prepare_in_work_file(latest_bad)
-                            if new_work_file and os.path.exists(new_work_file):
-                                work_file_to_process = new_work_file
-                                should_process = True
-                            else:
-                                logger.error("Не удалось создать новый рабочий файл")
-                        else:
-                            logger.info("Новых файлов не найдено, продолжаем обработку")
-                            work_file_to_process = in_work_file_path
-                            should_process = True
-                    else:
-                        logger.info("Файлов bad_price не найдено, продолжаем обработку")
-                        work_file_to_process = in_work_file_path
-                        should_process = True
-                else:
-                    logger.info("Файл актуален, продолжаем обработку")
-                    work_file_to_process = in_work_file_path
-                    should_process = True
-            else:
-                logger.info("Рабочий файл не найден")
-                if latest_bad:
-                    logger.info(f"Найден файл для обработки: {latest_bad}")
-                    new_work_file = prepare_in_work_file(latest_bad)
-                    if new_work_file and os.path.exists(new_work_file):
-                        work_file_to_process = new_work_file
-                        should_process = True
-                    else:
+            # Непустой журнал означает прерванную обработку - продолжаем её
+            if os.path.exists(in_work_file_path) and ProgressJournal(in_work_file_path).exists():
+                logger.info("Найден журнал прерванной обработки, продолжаем с места остановки")
+                work_file_to_process = in_work_file_path
+            elif pending:
+                next_bad = pending.pop(0)
+                if is_converted_legacy_file(next_bad):
+                    # Те же товары придут из .jsonl; исходный .txt убираем, чтобы не исправлять их дважды
+                    logger.info(f"Файл {next_bad} уже сконвертирован в {records_path(next_bad)}, пропущен")
+                    move_processed_file(next_bad)
+                elif os.path.exists(next_bad):
+                    logger.info(f"Найден файл для обработки: {next_bad}")
+                    work_file_to_process = prepare_in_work_file(next_bad)
+                    if not work_file_to_process:
                         logger.error("Не удалось создать рабочий файл")
                 else:
-                    logger.info("Файлы для обработки не найдены")
+                    logger.warning(f"Файл {next_bad} больше не существует, пропущен")
+            elif os.path.exists(in_work_file_path):
+                logger.info("Новых файлов не найдено, продолжаем обработку рабочего файла")
+                work_file_to_process = in_work_file_path
+            else:
+                logger.info("Файлы для обработки не найдены")
             
-            # Если нужно обработать файл и у нас есть валидный путь
-            if should_process and work_file_to_process:
-                process_in_work_file(work_file_to_process, proxy_manager)
+            if work_file_to_process:
+                process_in_work_file(work_file_to_process, proxy_manager, pool=pool)
                 
-                # После обработки перемещаем исходный bad_price файл
-                if latest_bad and os.path.exists(latest_bad):
-                    move_processed_file(latest_bad)
+                # После обработки перемещаем bad_price файл, из которого создан рабочий файл
+                source = read_work_source()
+                if source and os.path.exists(source):
+                    move_processed_file(source)
             
-            # Пауза перед следующей проверкой
-            logger.info(f"Ожидание следующей проверки через {Config.FILE_CHECK_INTERVAL} сек.")
-            time.sleep(Config.FILE_CHECK_INTERVAL)
+            # Пауза перед следующей проверкой (прерывается появлением нового файла)
+            if not pending:
+                logger.info(f"Ожидание нового файла bad_price или следующей проверки через {Config.FILE_CHECK_INTERVAL} сек.")
+                timeout = Config.FILE_CHECK_INTERVAL
+            else:
+                timeout = 0
+            new_files = [
+                path for path in watcher.wait(timeout)
+                if is_bad_price_file(path) and path not in pending
+            ]
+            if new_files:
+                logger.info(f"Обнаружен новый файл: {', '.join(new_files)}")
+                pending.extend(new_files)
             
         except KeyboardInterrupt:
             logger.info("Работа завершена по запросу пользователя")
+            watcher.close()
+            pool.close()
             break
         except Exception as e:
             logger.error(f"Критическая ошибка: {str(e)}")